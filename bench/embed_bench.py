@@ -0,0 +1,175 @@
+# embed_bench.py
+# 埋め込みバックエンド（torch / onnx fp32 / onnx int8）ごとに、起動の速さ・エンコード処理量・メモリと PyTorch 版との同等性を計測
+# バックエンドごとに別プロセスで実行するので、import から最初のエンコードまでの時間と RSS がそのまま比べられる
+# 例: python utils/onnx_encoder.py export   （初回のみ）
+#     python bench/embed_bench.py --texts 512 --batch 32
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from generate_corpus import VOCAB, sentence
+from run_bench import REPO_DIR, RESULTS_DIR, UTILS_DIR, git_revision, memory_mb, summarize
+
+VARIANTS = {
+    "torch": {"VECTORIZER_BACKEND": "torch"},
+    "onnx-fp32": {"VECTORIZER_BACKEND": "onnx", "VECTORIZER_ONNX_QUANTIZED": "0"},
+    "onnx-int8": {"VECTORIZER_BACKEND": "onnx", "VECTORIZER_ONNX_QUANTIZED": "1"}
+}
+
+def make_texts(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [sentence(rng, rng.choice(list(VOCAB)), rng.randint(6, 40)) for _ in range(n)]
+
+# === ワーカー（1バックエンド）===
+def run_worker(args: argparse.Namespace) -> None:
+    spawned = float(os.environ["EMBED_BENCH_SPAWNED"])
+    sys.path[:0] = [UTILS_DIR, REPO_DIR]
+    texts = make_texts(args.texts, args.seed)
+    result: Dict[str, Any] = {}
+
+    started = time.perf_counter()
+    import vectorizer
+    result["import_s"] = round(time.perf_counter() - started, 3)
+    result["backend"] = vectorizer.ACTIVE_BACKEND
+    started = time.perf_counter()
+    model = vectorizer.get_model()
+    result["load_s"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    model.encode(["warm up"], convert_to_numpy=True)
+    result["first_encode_s"] = round(time.perf_counter() - started, 3)
+    result["cold_start_s"] = round(time.time() - spawned, 3)  # プロセス起動から最初の埋め込みまで
+    rss, _ = memory_mb()
+    result["rss_after_load_mb"] = round(rss, 1) if rss else None
+
+    # 1件ずつ（キャッシュ・バッチャーを通さない素のエンコード）
+    latencies = []
+    wall_started = time.perf_counter()
+    for text in texts[:args.single]:
+        started = time.perf_counter()
+        model.encode([text], convert_to_numpy=True)
+        latencies.append(time.perf_counter() - started)
+    result["single"] = summarize(latencies, time.perf_counter() - wall_started)
+
+    # まとめて（batch 件ずつ）
+    latencies = []
+    wall_started = time.perf_counter()
+    for i in range(0, len(texts), args.batch):
+        started = time.perf_counter()
+        model.encode(texts[i:i + args.batch], convert_to_numpy=True)
+        latencies.append(time.perf_counter() - started)
+    wall = time.perf_counter() - wall_started
+    result["batch"] = summarize(latencies, wall)
+    result["batch"]["texts_per_s"] = round(len(texts) / wall, 1) if wall > 0 else None
+
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+def run_verify(args: argparse.Namespace) -> None:
+    sys.path[:0] = [UTILS_DIR, REPO_DIR]
+    import onnx_encoder
+    texts = onnx_encoder.SAMPLE_TEXTS + make_texts(args.verify_texts, args.seed + 1)
+    results: Dict[str, Any] = {}
+    for quantized in (False, True):
+        reason = onnx_encoder.unavailable_reason(quantized=quantized)
+        if reason:
+            results[onnx_encoder.variant(quantized)] = {"skipped": reason}
+            continue
+        results[onnx_encoder.variant(quantized)] = onnx_encoder.verify(texts=texts, quantized=quantized, threshold=args.threshold)
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+# === 親プロセス ===
+def spawn(args: argparse.Namespace, mode: str, env_extra: Dict[str, str], result_file: str) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.update(env_extra)
+    env.update({"EMBED_BENCH_SPAWNED": repr(time.time()), "VECTORIZER_CACHE_PATH": "", "VECTORIZER_CACHE_SIZE": "0"})
+    command = [
+        sys.executable, os.path.abspath(__file__), mode, "--result-file", result_file, "--texts", str(args.texts),
+        "--single", str(args.single), "--batch", str(args.batch), "--seed", str(args.seed),
+        "--verify-texts", str(args.verify_texts), "--threshold", str(args.threshold)
+    ]
+    try:
+        subprocess.run(command, cwd=REPO_DIR, env=env, check=True)
+        with open(result_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"[bench] {mode} 失敗: {e}")
+        return {"error": str(e)}
+    finally:
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+def print_table(results: Dict[str, Any]) -> None:
+    base = results["variants"].get("torch", {})
+    print(f"{'variant':<10} {'cold s':>8} {'load s':>8} {'RSS MB':>8} {'1件 p50 ms':>11} {'texts/s':>9} {'vs torch':>9}")
+    for name, r in results["variants"].items():
+        if "error" in r:
+            print(f"{name:<10} error: {r['error']}")
+            continue
+        tps = r["batch"].get("texts_per_s") or 0
+        speedup = f"{tps / base['batch']['texts_per_s']:.2f}x" if base.get("batch", {}).get("texts_per_s") else "-"
+        print(f"{name:<10} {r['cold_start_s']:>8.2f} {r['load_s']:>8.2f} {r['rss_after_load_mb'] or 0:>8.1f} "
+              f"{r['single'].get('p50_ms', 0):>11.2f} {tps:>9.1f} {speedup:>9}  (backend={r['backend']})")
+    for name, v in results.get("equivalence", {}).items():
+        if isinstance(v, dict) and "skipped" in v:
+            print(f"⏭ {name}: {v['skipped']}")
+        elif isinstance(v, dict) and "min_cosine" in v:
+            mark = "✅" if v["passed"] else "❌"
+            print(f"{mark} {name}: min cosine {v['min_cosine']} / mean {v['mean_cosine']} (>= {v['threshold']})")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="埋め込みバックエンドの比較ベンチマーク")
+    parser.add_argument("mode", nargs="?", choices=["run", "worker", "verify"], default="run", help=argparse.SUPPRESS)
+    parser.add_argument("--variants", default=",".join(VARIANTS), help="比べるバックエンド（カンマ区切り）")
+    parser.add_argument("--texts", type=int, default=512, help="まとめてエンコードする文の数")
+    parser.add_argument("--single", type=int, default=100, help="1件ずつエンコードする回数")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verify-texts", type=int, default=200, help="同等性チェックに追加する合成文の数")
+    parser.add_argument("--threshold", type=float, default=0.99, help="PyTorch 版とのコサイン類似度の下限")
+    parser.add_argument("--no-verify", action="store_true")
+    parser.add_argument("--out", default=None, help="結果JSONの保存先（省略時 bench/results/embed-<日時>-<commit>.json）")
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == "worker":
+        run_worker(args)
+        return 0
+    if args.mode == "verify":
+        run_verify(args)
+        return 0
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    results: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(),
+        "git": git_revision(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("mode", "result_file", "out")},
+        "variants": {}
+    }
+    for name in [v.strip() for v in args.variants.split(",") if v.strip()]:
+        print(f"🧪 {name}")
+        results["variants"][name] = spawn(args, "worker", VARIANTS[name], os.path.join(RESULTS_DIR, f".embed-{stamp}-{name}.json"))
+    if not args.no_verify:
+        results["equivalence"] = spawn(args, "verify", {}, os.path.join(RESULTS_DIR, f".embed-{stamp}-verify.json"))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"embed-{stamp}-{results['git']['commit'] or 'nogit'}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_table(results)
+    print(f"📁 {out}")
+    failed = [name for name, v in results.get("equivalence", {}).items() if isinstance(v, dict) and v.get("passed") is False]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
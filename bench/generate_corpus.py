@@ -0,0 +1,183 @@
+# generate_corpus.py
+# ベンチマーク用の合成記憶コーパスを生成（aria_journal.jsonl / vector_memory.json / dialog_log.jsonl / compressed_memory.json）
+# 例: python bench/generate_corpus.py --sizes 1k,10k,100k,1m
+
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpora")
+DEFAULT_SIZES = "1k,10k,100k,1m"
+DIM = 384  # all-MiniLM-L6-v2 と同じ次元
+CHUNK = 2048
+
+VOCAB = {
+    "dreams": ["dream", "nightmare", "sleep", "moon", "drift", "lucid", "pillow", "midnight"],
+    "memory": ["remember", "past", "recall", "letter", "photograph", "childhood", "trace", "archive"],
+    "solitude": ["alone", "silence", "solitude", "empty", "room", "distance", "quiet", "window"],
+    "future": ["future", "tomorrow", "possibility", "horizon", "seed", "promise", "orbit", "dawn"],
+    "ai": ["machine", "algorithm", "network", "signal", "circuit", "model", "language", "code"]
+}
+STYLE_PHRASES = ["like a", "as if", "whisper", "echo", "because", "therefore", "is like", "symbolizes", "why", "what if"]
+FILLER = ["the", "a", "of", "in", "and", "to", "my", "your", "we", "is", "was", "feels", "becomes", "under", "between"]
+EMOTIONS = ["joy", "sadness", "calm", "wonder", "longing", "fear", "hope"]
+STYLES = ["poetic", "logical", "metaphorical", "questioning", "neutral"]
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def size_label(n: int) -> str:
+    if n >= 1_000_000 and n % 1_000_000 == 0:
+        return f"{n // 1_000_000}m"
+    if n >= 1_000 and n % 1_000 == 0:
+        return f"{n // 1_000}k"
+    return str(n)
+
+# === 文・ベクトルの合成 ===
+def sentence(rng: random.Random, topic: str, words: int = 14) -> str:
+    out = []
+    for _ in range(words):
+        r = rng.random()
+        if r < 0.35:
+            out.append(rng.choice(VOCAB[topic]))
+        elif r < 0.45:
+            out.append(rng.choice(VOCAB[rng.choice(list(VOCAB))]))
+        elif r < 0.52:
+            out.append(rng.choice(STYLE_PHRASES))
+        else:
+            out.append(rng.choice(FILLER))
+    text = " ".join(out)
+    return text[0].upper() + text[1:] + ("?" if rng.random() < 0.15 else ".")
+
+def vectors(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    matrix = rng.standard_normal((n, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.round(matrix, 5)
+
+def timestamps(n: int, start: datetime) -> Iterator[str]:
+    for i in range(n):
+        yield (start + timedelta(seconds=37 * i)).isoformat()
+
+# === 各ファイル ===
+def write_journal(path: str, n: int, seed: int, dim: int) -> None:
+    rng, nprng = random.Random(seed), np.random.default_rng(seed)
+    stamps = timestamps(n, datetime(2025, 1, 1))
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, n, CHUNK):
+            block = vectors(nprng, min(CHUNK, n - start), dim).tolist()
+            lines = []
+            for vec in block:
+                topic = rng.choice(list(VOCAB))
+                tags = rng.sample(EMOTIONS, rng.randint(0, 2))
+                entry = {
+                    "timestamp": next(stamps),
+                    "summary": "Reflection from poetic layer",
+                    "topics": [topic],
+                    "style": rng.choice(STYLES),
+                    "emotion_tags": tags,
+                    "source": "memory_manager",
+                    "content": sentence(rng, topic, rng.randint(10, 30)),
+                    "vector": vec,
+                    "meta": {},
+                    "symbolic_score": round(rng.random(), 3)
+                }
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.write("".join(lines))
+
+def write_vector_memory(path: str, n: int, seed: int, dim: int) -> None:
+    rng, nprng = random.Random(seed), np.random.default_rng(seed)
+    stamps = timestamps(n, datetime(2025, 1, 1))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for start in range(0, n, CHUNK):
+            block = vectors(nprng, min(CHUNK, n - start), dim).tolist()
+            lines = []
+            for i, vec in enumerate(block):
+                entry = {
+                    "timestamp": next(stamps),
+                    "content": sentence(rng, rng.choice(list(VOCAB))),
+                    "embedding": vec,
+                    "emotion_score": round(rng.random() * 0.3, 3)
+                }
+                sep = "\n" if start + i == n - 1 else ",\n"
+                lines.append(json.dumps(entry, ensure_ascii=False) + sep)
+            f.write("".join(lines))
+        f.write("]\n")
+
+def write_dialog_log(path: str, n: int, seed: int) -> None:
+    """旧形式（1発話1行の role/content）。初回起動時に memory/dialog/ へ取り込まれる"""
+    rng = random.Random(seed)
+    stamps = timestamps(2 * n, datetime(2025, 1, 1))
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, n, CHUNK):
+            lines = []
+            for _ in range(min(CHUNK, n - start)):
+                topic = rng.choice(list(VOCAB))
+                for role, words in (("user", rng.randint(5, 20)), ("assistant", rng.randint(20, 60))):
+                    lines.append(json.dumps({
+                        "timestamp": next(stamps), "role": role, "content": sentence(rng, topic, words), "channel": "bench"
+                    }, ensure_ascii=False) + "\n")
+            f.write("".join(lines))
+
+def write_compressed_memory(path: str, n: int, seed: int) -> None:
+    rng = random.Random(seed)
+    stamps = timestamps(n, datetime(2024, 6, 1))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i in range(n):
+            topic = rng.choice(list(VOCAB))
+            entry = {
+                "id": f"{i:08x}",
+                "content": f"{sentence(rng, topic, 10)} / {sentence(rng, topic, 25)}",
+                "timestamp": next(stamps),
+                "topic": topic
+            }
+            f.write(json.dumps(entry, ensure_ascii=False) + ("\n" if i == n - 1 else ",\n"))
+        f.write("]\n")
+
+def generate(n: int, out_dir: str = CORPUS_DIR, seed: int = 42, dim: int = DIM, force: bool = False) -> str:
+    """corpora/<規模>/memory/ を作る（生成済みなら何もしない）。コーパスのディレクトリを返す"""
+    corpus = os.path.join(out_dir, size_label(n))
+    memory = os.path.join(corpus, "memory")
+    done_path = os.path.join(corpus, "corpus.json")
+    if os.path.exists(done_path) and not force:
+        return corpus
+    os.makedirs(memory, exist_ok=True)
+    steps = [
+        ("aria_journal.jsonl", lambda p: write_journal(p, n, seed, dim)),
+        ("vector_memory.json", lambda p: write_vector_memory(p, n, seed + 1, dim)),
+        ("dialog_log.jsonl", lambda p: write_dialog_log(p, n, seed + 2)),
+        ("compressed_memory.json", lambda p: write_compressed_memory(p, n, seed + 3))
+    ]
+    files: Dict[str, int] = {}
+    for name, write in steps:
+        path = os.path.join(memory, name)
+        write(path)
+        files[name] = os.path.getsize(path)
+        print(f"  {size_label(n)}/{name}: {files[name] / 1e6:.1f} MB")
+    with open(done_path, "w", encoding="utf-8") as f:
+        json.dump({"entries": n, "seed": seed, "dim": dim, "files": files}, f, indent=2)
+    return corpus
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成記憶コーパス生成")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="件数（カンマ区切り、k/m 可）")
+    parser.add_argument("--out", default=CORPUS_DIR)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--force", action="store_true", help="生成済みでも作り直す")
+    args = parser.parse_args()
+    sizes: List[int] = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    for n in sizes:
+        print(f"🧪 コーパス生成: {size_label(n)}")
+        generate(n, args.out, args.seed, args.dim, args.force)
+    sys.exit(0)
@@ -0,0 +1,397 @@
+# run_bench.py
+# 記憶の規模ごとに build_prompt・各リフレクター・english_bot.on_message・翻訳の遅延を計測し、JSONで保存
+# 規模ごとに別プロセス（作業用コピーの memory/ 上）で実行するので、ピークRSSも規模ごとに取れる
+# 例: python bench/run_bench.py --sizes 1k,10k --iterations 50
+#     python bench/run_bench.py --sizes 1k --baseline bench/results/前回.json --fail-on-regression
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+UTILS_DIR = os.path.join(REPO_DIR, "utils")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+PROMPT_SOURCE = os.path.join(REPO_DIR, "prompts", "aria_prompt.txt")
+sys.path.insert(0, BENCH_DIR)
+
+from generate_corpus import CORPUS_DIR, VOCAB, generate, parse_size, sentence, size_label
+
+STAGES = ["short_term", "rag", "symbolic", "poetic", "build_prompt", "on_message", "on_message_burst", "translate", "translate_burst"]
+
+# === メモリ使用量 ===
+def memory_mb() -> Tuple[Optional[float], Optional[float]]:
+    """(現在のRSS, ピークRSS) MB。取れない環境では None"""
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        peak = getattr(info, "peak_wset", None)  # Windows
+        return info.rss / 2**20, (peak / 2**20 if peak else None)
+    except ImportError:
+        pass
+    rss = peak = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss / 2**20 if sys.platform == "darwin" else maxrss / 1024
+    except ImportError:
+        pass
+    return rss, peak
+
+# === 集計 ===
+def summarize(latencies: List[float], wall: float, first: Optional[float] = None) -> Dict[str, Any]:
+    if not latencies:
+        return {"count": 0}
+    ms = np.array(latencies, dtype=np.float64) * 1000
+    rss, peak = memory_mb()
+    result: Dict[str, Any] = {
+        "count": len(latencies),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(latencies) / wall, 3) if wall > 0 else None,
+        "rss_mb": round(rss, 1) if rss else None,
+        "peak_rss_mb": round(peak, 1) if peak else None
+    }
+    if first is not None:
+        result["first_ms"] = round(first * 1000, 3)
+    return result
+
+def measure(func: Callable[[str], Any], queries: List[str], warmup: int) -> Dict[str, Any]:
+    """1件ずつ順に実行。最初の1回（冷えた状態）の所要時間も残す"""
+    first = None
+    for i, query in enumerate(queries[:warmup]):
+        started = time.perf_counter()
+        func(query)
+        if i == 0:
+            first = time.perf_counter() - started
+    latencies = []
+    wall_started = time.perf_counter()
+    for query in queries[warmup:]:
+        started = time.perf_counter()
+        func(query)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies, time.perf_counter() - wall_started, first)
+
+# === english_bot.on_message（Discordなしで、送信・編集を記録する偽チャンネルに流す）===
+class FakeSent:
+    def __init__(self, channel: "FakeChannel") -> None:
+        self.channel = channel
+
+    async def edit(self, content: str = "") -> None:
+        self.channel.last_activity = time.perf_counter()
+
+class FakeChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self.last_activity = 0.0
+        self.sends = 0
+
+    async def send(self, content: str = "") -> FakeSent:
+        self.sends += 1
+        self.last_activity = time.perf_counter()
+        return FakeSent(self)
+
+class FakeAuthor:
+    def __init__(self, author_id: int) -> None:
+        self.id = author_id
+
+class FakeMessage:
+    def __init__(self, content: str, channel_id: int, author_id: int) -> None:
+        self.content = content
+        self.channel = FakeChannel(channel_id)
+        self.author = FakeAuthor(author_id)
+
+async def bench_on_message(queries: List[str], warmup: int, burst: int) -> Dict[str, Dict[str, Any]]:
+    import english_bot
+
+    async def one(i: int, query: str) -> float:
+        # チャンネル・ユーザー・本文を毎回変えて、重複抑止とレート制限に掛からないようにする
+        message = FakeMessage(f"{query} ({i})", 10_000 + i, 20_000 + i)
+        started = time.perf_counter()
+        await english_bot.on_message(message)
+        await english_bot.admission.drain()
+        return message.channel.last_activity - started
+
+    first = None
+    for i, query in enumerate(queries[:warmup]):
+        elapsed = await one(i, query)
+        first = elapsed if i == 0 else first
+    latencies = []
+    wall_started = time.perf_counter()
+    for i, query in enumerate(queries[warmup:], warmup):
+        latencies.append(await one(i, query))
+    results = {"on_message": summarize(latencies, time.perf_counter() - wall_started, first)}
+
+    # 同時に burst 件届いたとき（別チャンネル）：admission と LLM の同時実行上限を含めた処理量
+    messages = [FakeMessage(f"{q} (burst {i})", 50_000 + i, 60_000 + i) for i, q in enumerate(queries[:burst])]
+    wall_started = time.perf_counter()
+    for message in messages:
+        await english_bot.on_message(message)
+    await english_bot.admission.drain()
+    wall = time.perf_counter() - wall_started
+    results["on_message_burst"] = summarize([m.channel.last_activity - wall_started for m in messages if m.channel.sends], wall)
+    results["on_message_burst"]["admission"] = english_bot.admission.stats()
+    await english_bot.llm_client.close()
+    return results
+
+async def bench_translate(queries: List[str], warmup: int, burst: int) -> Dict[str, Dict[str, Any]]:
+    sys.path.insert(0, os.path.join(REPO_DIR, "translate_bot"))
+    from translator import Translator
+
+    translator = Translator()
+
+    async def timed(text: str) -> float:
+        started = time.perf_counter()
+        await translator.translate(text, "ja")
+        return time.perf_counter() - started
+
+    first = None
+    for i, query in enumerate(queries[:warmup]):
+        elapsed = await timed(f"warmup {i} {query}")
+        first = elapsed if i == 0 else first
+    latencies = []
+    wall_started = time.perf_counter()
+    for i, query in enumerate(queries[warmup:]):
+        latencies.append(await timed(f"{i} {query}"))
+    results = {"translate": summarize(latencies, time.perf_counter() - wall_started, first)}
+    wall_started = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(f"burst {i} {q}") for i, q in enumerate(queries[:burst])))
+    results["translate_burst"] = summarize(list(latencies), time.perf_counter() - wall_started)
+    results["translate_burst"]["translator"] = translator.stats()
+    await translator.close()
+    return results
+
+def run_async(name: str, make: Callable[[], Awaitable[Dict[str, Dict[str, Any]]]]) -> Dict[str, Dict[str, Any]]:
+    try:
+        return asyncio.run(make())
+    except ImportError as e:
+        print(f"[bench] {name} をスキップ（依存モジュールなし）: {e}")
+        return {name: {"skipped": str(e)}}
+
+# === ワーカー（作業ディレクトリ = コーパスのコピー）===
+def make_queries(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [sentence(rng, rng.choice(list(VOCAB)), rng.randint(6, 16)) for _ in range(n)]
+
+def run_worker(args: argparse.Namespace) -> None:
+    sys.path[:0] = [UTILS_DIR, REPO_DIR]
+    queries = make_queries(args.warmup + args.iterations, args.seed)
+    with open(PROMPT_SOURCE, "r", encoding="utf-8") as f:
+        system_prompt = f.read()
+    stages: Dict[str, Any] = {}
+
+    started = time.perf_counter()
+    import memory_manager
+    from memory_core import get_dialog_store, get_short_term
+    from memory_store import get_memory_store, migrate, use_sqlite
+    from symbolic_reflector import recall_symbolic_memories
+    from poetic_reflector import generate_poetic_reflection
+    setup: Dict[str, Any] = {"import_s": round(time.perf_counter() - started, 3)}
+    if use_sqlite():
+        started = time.perf_counter()
+        migrate(get_memory_store(), os.path.abspath("memory"))
+        setup["migrate_s"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    get_dialog_store()  # 旧 dialog_log.jsonl の取り込み（初回のみ）
+    setup["dialog_open_s"] = round(time.perf_counter() - started, 3)
+    stages["setup"] = setup
+
+    stages["short_term"] = measure(lambda q: get_short_term(), queries, args.warmup)
+    stages["rag"] = measure(lambda q: memory_manager._load_rag(), queries, args.warmup)
+    stages["symbolic"] = measure(recall_symbolic_memories, queries, args.warmup)
+    stages["poetic"] = measure(generate_poetic_reflection, queries, args.warmup)
+    stages["build_prompt"] = measure(lambda q: memory_manager.build_prompt(system_prompt, q), queries, args.warmup)
+    stages["build_prompt"]["stages"] = memory_manager.get_stage_stats()
+    stages.update(run_async("on_message", lambda: bench_on_message(queries, args.warmup, args.burst)))
+    stages.update(run_async("translate", lambda: bench_translate(queries, args.warmup, args.burst)))
+
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(stages, f, ensure_ascii=False, indent=2)
+
+# === 親プロセス ===
+def wait_for_port(host: str, port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"スタブサーバーが起動しません: {host}:{port}")
+
+def start_stub(args: argparse.Namespace) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "stub_server.py"), "--port", str(args.stub_port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--translate-latency-ms", str(args.translate_latency_ms),
+        "--tokens", str(args.tokens), "--token-interval-ms", str(args.token_interval_ms), "--jitter-ms", str(args.jitter_ms)
+    ]
+    process = subprocess.Popen(command)
+    try:
+        wait_for_port("127.0.0.1", args.stub_port)
+    except Exception:
+        process.terminate()
+        raise
+    return process
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip())
+        return {"commit": sha, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def prepare_workdir(corpus: str, in_place: bool) -> str:
+    workdir = corpus if in_place else tempfile.mkdtemp(prefix="aria-bench-")
+    if not in_place:
+        shutil.copytree(os.path.join(corpus, "memory"), os.path.join(workdir, "memory"))
+    shutil.copyfile(PROMPT_SOURCE, os.path.join(workdir, "aria_prompt.txt"))  # english_bot が作業ディレクトリから読む
+    return workdir
+
+def run_size(n: int, args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, Any]:
+    corpus = generate(n, args.corpora, seed=args.seed)
+    workdir = prepare_workdir(corpus, args.in_place)
+    result_file = os.path.join(workdir, "bench_result.json")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--result-file", result_file,
+        "--iterations", str(args.iterations), "--warmup", str(args.warmup), "--burst", str(args.burst), "--seed", str(args.seed)
+    ]
+    try:
+        started = time.perf_counter()
+        subprocess.run(command, cwd=workdir, env=env, check=True)
+        with open(result_file, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        result["setup"]["total_s"] = round(time.perf_counter() - started, 3)
+        return result
+    finally:
+        if not args.in_place:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def print_table(results: Dict[str, Any]) -> None:
+    print(f"{'size':>6} {'stage':<18} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>9} {'peak MB':>9}")
+    for label, stages in results["sizes"].items():
+        for stage in STAGES:
+            s = stages.get(stage)
+            if not s or not s.get("count"):
+                continue
+            print(f"{label:>6} {stage:<18} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['p99_ms']:>10.2f} "
+                  f"{s['throughput_per_s'] or 0:>9.1f} {s['peak_rss_mb'] or 0:>9.1f}")
+
+def compare(baseline_path: str, results: Dict[str, Any], threshold: float) -> List[str]:
+    """前回結果と p95 を比べ、threshold を超えて悪化した (規模, ステージ) を返す"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n📊 比較: {baseline.get('meta', {}).get('git', {}).get('commit')} → {results['meta']['git']['commit']}（p95）")
+    regressions = []
+    for label, stages in results["sizes"].items():
+        for stage in STAGES:
+            new, old = stages.get(stage, {}), baseline.get("sizes", {}).get(label, {}).get(stage, {})
+            if "p95_ms" not in new or "p95_ms" not in old or not old["p95_ms"]:
+                continue
+            ratio = new["p95_ms"] / old["p95_ms"]
+            flag = "⚠️" if ratio > 1 + threshold else "  "
+            print(f"{flag} {label:>6} {stage:<18} {old['p95_ms']:>10.2f} → {new['p95_ms']:>10.2f} ms  x{ratio:.2f}")
+            if ratio > 1 + threshold:
+                regressions.append(f"{label}/{stage}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="記憶規模別のレイテンシ・ベンチマーク")
+    parser.add_argument("--sizes", default="1k,10k", help="コーパス規模（カンマ区切り、例: 1k,10k,100k,1m）")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--burst", type=int, default=16, help="同時投入の件数（on_message_burst / translate_burst）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--corpora", default=CORPUS_DIR)
+    parser.add_argument("--in-place", action="store_true", help="コーパスをコピーせずに直接使う（派生索引が残り、ジャーナルが伸びる）")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=os.getenv("ARIA_MEMORY_BACKEND", "json"))
+    parser.add_argument("--stage-timeout", type=float, default=None, help="build_prompt の各ステージ締切（秒）を一律に上書き")
+    parser.add_argument("--llm-url", default=None, help="スタブを起動せず既存のLLMサーバーを使う")
+    parser.add_argument("--stub-port", type=int, default=18080)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--token-interval-ms", type=float, default=5.0)
+    parser.add_argument("--tokens", type=int, default=48)
+    parser.add_argument("--translate-latency-ms", type=float, default=40.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--out", default=None, help="結果JSONの保存先（省略時 bench/results/<日時>-<commit>.json）")
+    parser.add_argument("--baseline", default=None, help="比較する前回の結果JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p95 がこの割合を超えて悪化したら回帰とみなす")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    stub = None if args.llm_url else start_stub(args)
+    base_url = f"http://127.0.0.1:{args.stub_port}"
+    env = dict(os.environ)
+    env.update(
+        PYTHONPATH=os.pathsep.join(p for p in (UTILS_DIR, REPO_DIR, env.get("PYTHONPATH")) if p),
+        LM_API_URL=args.llm_url or f"{base_url}/v1/chat/completions",
+        MS_TRANSLATOR_ENDPOINT=base_url,
+        ARIA_MEMORY_BACKEND=args.backend
+    )
+    if args.stage_timeout is not None:
+        for stage in ("SHORT_TERM", "SYMBOLIC", "RAG", "POETIC"):
+            env[f"ARIA_STAGE_TIMEOUT_{stage}"] = str(args.stage_timeout)
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend
+        },
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "result_file", "baseline", "out")},
+        "sizes": {}
+    }
+    try:
+        for n in [parse_size(s) for s in args.sizes.split(",") if s.strip()]:
+            print(f"🧪 計測: {size_label(n)}", flush=True)
+            results["sizes"][size_label(n)] = run_size(n, args, env)
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{results['meta']['git']['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_table(results)
+    print(f"✅ 結果を保存: {out}")
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.threshold)
+        if regressions and args.fail_on_regression:
+            print(f"❌ 回帰: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# stub_server.py
+# ベンチマーク用のスタブ：/v1/chat/completions（通常・SSEストリーム）と翻訳API /translate を、指定した遅延で応答
+# 例: python bench/stub_server.py --port 18080 --llm-latency-ms 300 --translate-latency-ms 40
+
+import json
+import random
+import asyncio
+import argparse
+from typing import Any, Dict
+
+from aiohttp import web
+
+REPLY_WORDS = "The moonlight drifts across the quiet water and every echo becomes a small promise of tomorrow".split()
+
+class StubConfig:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.llm_latency = args.llm_latency_ms / 1000.0
+        self.translate_latency = args.translate_latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.tokens = args.tokens
+        self.token_interval = args.token_interval_ms / 1000.0
+        self.requests: Dict[str, int] = {"chat": 0, "stream": 0, "translate": 0, "translate_texts": 0}
+
+    async def delay(self, base: float) -> None:
+        await asyncio.sleep(max(0.0, base + random.uniform(-self.jitter, self.jitter)))
+
+CONFIG_KEY = web.AppKey("config", StubConfig)
+
+def reply_tokens(n: int) -> list:
+    return [REPLY_WORDS[i % len(REPLY_WORDS)] + " " for i in range(n)]
+
+async def chat(request: web.Request) -> web.StreamResponse:
+    config = request.app[CONFIG_KEY]
+    data: Dict[str, Any] = await request.json()
+    await config.delay(config.llm_latency)  # 最初のトークンまでの時間
+    tokens = reply_tokens(config.tokens)
+    if not data.get("stream"):
+        config.requests["chat"] += 1
+        await asyncio.sleep(config.token_interval * len(tokens))
+        return web.json_response({
+            "choices": [{"message": {"content": "".join(tokens).strip()}}],
+            "usage": {"completion_tokens": len(tokens)}
+        })
+    config.requests["stream"] += 1
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    for token in tokens:
+        event = {"choices": [{"delta": {"content": token}}]}
+        await response.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        if config.token_interval:
+            await asyncio.sleep(config.token_interval)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+async def translate(request: web.Request) -> web.Response:
+    config = request.app[CONFIG_KEY]
+    body = await request.json()
+    to_lang = request.query.get("to", "en")
+    config.requests["translate"] += 1
+    config.requests["translate_texts"] += len(body)
+    await config.delay(config.translate_latency)
+    return web.json_response([
+        {"translations": [{"text": f"[{to_lang}] {item.get('text', '')}", "to": to_lang}]} for item in body
+    ])
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app[CONFIG_KEY].requests)
+
+def create_app(args: argparse.Namespace) -> web.Application:
+    app = web.Application()
+    app[CONFIG_KEY] = StubConfig(args)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/translate", translate)
+    app.router.add_get("/stats", stats)
+    return app
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="LLM / 翻訳APIのスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="LLMの最初のトークンまでの遅延")
+    parser.add_argument("--token-interval-ms", type=float, default=5.0, help="トークン1つあたりの生成間隔")
+    parser.add_argument("--tokens", type=int, default=48, help="応答のトークン数")
+    parser.add_argument("--translate-latency-ms", type=float, default=40.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="遅延に加える一様ゆらぎ（±）")
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"🧪 スタブサーバー起動: http://{args.host}:{args.port}", flush=True)
+    web.run_app(create_app(args), host=args.host, port=args.port, print=None)
@@ -4,23 +4,38 @@
 
 import os
 import re
-import time
-import subprocess
 import json
-import requests
-import discord
-from discord.ext import commands
-from typing import Set, Dict, Any, List
-
-# ベクトル初期化（起動時に一括処理）
-subprocess.run(["python", os.path.abspath("utils/vectorizer.py")], check=True)
-
-from dotenv import load_dotenv
-from memory_manager import build_prompt
+import asyncio
+from typing import Set, Dict, Any, List, Optional, Tuple
+
+from startup_timer import StartupTimer
+startup = StartupTimer("english_bot")
+
+with startup.phase("import:discord"):
+    import discord
+    from discord.ext import commands
+    from dotenv import load_dotenv
+
+with startup.phase("import:bot"):
+    from llm_client import LLMClient
+    from admission import AdmissionController
+    import metrics
+    import profiler
+    from reply_streamer import ReplyStreamer
+
+# 記憶層（memory_manager → 各リフレクター・numpy・埋め込みモデル）は重いので、
+# 高速起動では Discord 接続後のウォームアップで読み込む（ARIA_FAST_START=0 で接続前に読み込む）
+FAST_START = os.getenv("ARIA_FAST_START", "1") != "0"
+build_prompt = None
+embedding_service = None
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 LM_API_URL = os.getenv("LM_API_URL")
+LLM_STREAM = os.getenv("LLM_STREAM", "1") != "0"  # トークンを逐次Discordへ反映
+llm_client = LLMClient(LM_API_URL)
+METRICS_PORT = int(os.getenv("ARIA_METRICS_PORT", "9464"))  # ARIA_METRICS=1 のとき /metrics を公開
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if i}  # !profile を使えるユーザー
 
 PROMPT_PATH = os.path.abspath("aria_prompt.txt")
 
@@ -29,12 +44,19 @@ with open(PROMPT_PATH, "r", encoding="utf-8") as f:
     SYSTEM_PROMPT = f.read()
 
 
+class AriaBot(commands.Bot):
+    async def setup_hook(self) -> None:
+        startup.mark("login")  # ここから on_ready までがゲートウェイ接続
+
+    async def close(self) -> None:
+        await llm_client.close()
+        await super().close()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = AriaBot(command_prefix="!", intents=intents, help_command=None)
 
 IGNORE_USER_IDS: Set[int] = set()
-recent_messages: Dict[str, float] = {}
 
 # === 英文比率で判定 ===
 def is_majority_english(text: str) -> bool:
@@ -49,29 +71,104 @@ def is_majority_english(text: str) -> bool:
 def split_message(text: str, max_length: int = 2000) -> List[str]:
     return [text[i:i + max_length] for i in range(0, len(text), max_length)]
 
+# === 記憶層の読み込み・ウォームアップ（高速起動では on_ready 後に別スレッドで）===
+def warm_up() -> None:
+    global build_prompt, embedding_service
+    if build_prompt is not None:
+        return
+    with startup.phase("import:memory"):
+        import vectorizer
+        import memory_manager
+        from embedding_service import get_embedding_service
+        from symbolic_reflector import recall_symbolic_memories
+        from poetic_reflector import generate_poetic_reflection
+    with startup.phase("warm:embedding_model"):
+        vectorizer.get_model().encode(["warm up"], convert_to_numpy=True)
+    with startup.phase("warm:reflectors"):  # 索引（ジャーナル・ベクトル）を開いておく
+        recall_symbolic_memories("warm up")
+        generate_poetic_reflection("warm up")
+
+    # ベクトル初期化（常駐ワーカーで少しずつ。途中の発言のエンコードは割り込める）
+    embedding_service = get_embedding_service()
+    embedding_service.submit_init()
+    metrics.register_stats("aria_embedding_service", embedding_service.backlog)
+    metrics.register_stats("aria_embedding_cache", vectorizer.get_cache_stats)
+    metrics.register_stats("aria_encode_batcher", vectorizer.get_batch_stats)
+    build_prompt = memory_manager.build_prompt
+    startup.mark("warm")
+
+_warm_up_task: Optional["asyncio.Future[None]"] = None
+
+async def ensure_warm() -> None:
+    """ウォームアップ済みでなければ開始して待つ（最初の発言がウォームアップ中に届いた場合も同じ処理を待つ）"""
+    global _warm_up_task
+    if build_prompt is not None:
+        return
+    if _warm_up_task is None:
+        _warm_up_task = asyncio.ensure_future(asyncio.to_thread(warm_up))
+    try:
+        await asyncio.shield(_warm_up_task)
+    except Exception:
+        _warm_up_task = None  # 次の発言で再試行
+        raise
+
+async def background_warm_up() -> None:
+    try:
+        await ensure_warm()
+    except Exception as e:
+        print(f"[english_bot] ウォームアップエラー: {e}")
+    startup.print_report()
+    startup.save()
+
 @bot.event
 async def on_ready():
     global IGNORE_USER_IDS
     IGNORE_USER_IDS = {bot.user.id}
-    print(f"✅ AriaBot is online: {bot.user} (ID: {bot.user.id})")
-
-@bot.event
-async def on_message(message: discord.Message):
-    if message.author.id in IGNORE_USER_IDS:
+    if "gateway_ready" in startup.marks:
+        return  # 再接続時
+    startup.mark("gateway_ready")
+    print(f"✅ AriaBot is online: {bot.user} (ID: {bot.user.id}) in {startup.elapsed():.2f}s")
+    metrics.start_http_server(METRICS_PORT)
+    if build_prompt is not None:  # ARIA_FAST_START=0（接続前に読み込み済み）
+        startup.print_report()
+        startup.save()
+    elif _warm_up_task is None:
+        asyncio.create_task(background_warm_up())
+
+# === 管理者向け：一定時間プロファイルを取る（!profile 30）。計測は別スレッドなので応答は止まらない ===
+def is_admin(ctx: commands.Context) -> bool:
+    return ctx.author.id in ADMIN_USER_IDS
+
+@bot.command(name="profile")
+@commands.check(is_admin)
+async def profile_command(ctx: commands.Context, seconds: float = 10.0) -> None:
+    try:
+        session = profiler.start(seconds, label="english_bot")
+    except profiler.ProfileBusy as busy:
+        await ctx.send(f"⏳ {busy}")
         return
+    await ctx.send(f"🔬 プロファイル開始（{session.seconds:.0f}秒）")
+    await asyncio.to_thread(session.wait)
+    for chunk in split_message(profiler.summary_text(session)):
+        await ctx.send(chunk)
 
-    content = message.content.strip()
-    if not content or not is_majority_english(content):
-        return
+@profile_command.error
+async def profile_error(ctx: commands.Context, error: commands.CommandError) -> None:
+    if not isinstance(error, commands.CheckFailure):
+        await ctx.send(f"❌ {error}")
 
-    now = time.time()
-    if content in recent_messages and now - recent_messages[content] < 10:
-        return
-    recent_messages[content] = now
+metrics.add_route("/debug/profile", profiler.http_route("english_bot"))
 
-    # 🔁 プロンプト構築（memory_manager + 全構文）
+# === 応答生成（受付制御を通ったもの。処理中に同じチャンネルへ届いた発言はまとめて1回で答える）===
+async def respond(channel_id: str, items: List[Tuple[str, discord.Message]]) -> None:
+    content = "\n".join(text for text, _ in items)
+    message = items[-1][1]
+
+    # 🔁 プロンプト構築（memory_manager + 全構文）※イベントループを塞がないよう別スレッドで
     try:
-        prompt = build_prompt(SYSTEM_PROMPT, content)
+        await ensure_warm()
+        with metrics.span("prompt"):
+            prompt = await asyncio.to_thread(build_prompt, SYSTEM_PROMPT, content)
     except Exception as e:
         await message.channel.send(f"❌ Prompt build error: {str(e)}")
         print(f"Prompt build error: {e}")
@@ -80,24 +177,59 @@ async def on_message(message: discord.Message):
     payload = {
         "messages": prompt,
         "temperature": 0.7,
-        "max_tokens": 1024
+        "max_tokens": 1024,
+        "channel": channel_id  # サーバー側のチャンネル単位公平スケジューリング用
     }
 
     try:
-        response = requests.post(LM_API_URL, json=payload)
-        response.raise_for_status()
-        reply = response.json()["choices"][0]["message"]["content"].strip()
-
-        for chunk in split_message(reply):
-            await message.channel.send(chunk)
-
-        # ベクトル記録（非同期追記）
+        with metrics.span("reply", stream=LLM_STREAM):
+            if LLM_STREAM:
+                streamer = ReplyStreamer(message.channel)
+                async for delta in llm_client.stream_chat(payload):
+                    await streamer.feed(delta)
+                reply = (await streamer.finish()).strip()
+            else:
+                reply = await llm_client.chat(payload)
+                for chunk in split_message(reply):
+                    await message.channel.send(chunk)
+
+        # ベクトル記録（常駐ワーカーへ非同期追記）
         cleaned_reply = reply.replace("\n", " ").replace('"', "'").strip()
-        subprocess.Popen(["python", os.path.abspath("utils/vectorizer.py"), "--mode", "append", cleaned_reply])
+        embedding_service.submit_append(cleaned_reply)
 
     except Exception as e:
+        metrics.inc("aria_reply_errors_total")
         await message.channel.send(f"❌ Error: {str(e)}")
         print(f"Error: {e}")
 
+# 重複抑止・チャンネル/ユーザー単位のレート制限・飽和時のまとめ処理
+admission = AdmissionController(respond, max_in_flight=llm_client.max_concurrency)
+
+# === 計測（キャッシュ命中・待ち行列の深さはスクレイプ時に各 stats() から読む）===
+metrics.register_stats("aria_admission", admission.stats)
+metrics.register_stats("aria_llm_client", llm_client.metrics)
+
+@bot.event
+async def on_message(message: discord.Message):
+    if message.author.id in IGNORE_USER_IDS:
+        return
+
+    content = message.content.strip()
+    if bot.user is not None and content.startswith(bot.command_prefix):
+        ctx = await bot.get_context(message)
+        if ctx.valid:  # 登録済みのコマンドだけ実行し、それ以外は通常の発言として扱う
+            await bot.invoke(ctx)
+            return
+
+    with metrics.span("is_majority_english"):
+        english = bool(content) and is_majority_english(content)
+    if not english:
+        return
+
+    admission.offer(str(message.channel.id), message.author.id, content, message)
+
 if __name__ == "__main__":
+    if not FAST_START:
+        warm_up()
+    startup.mark("run")
     bot.run(TOKEN)
@@ -1,8 +1,15 @@
-
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from llama_cpp import Llama
 import os
-from typing import Any
+import json
+import time
+import threading
+import numpy as np
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from context_packer import fit_messages, render_phi, set_tokenizer
+import metrics
+import profiler
 
 app = Flask(__name__)
 
@@ -10,6 +17,16 @@ app = Flask(__name__)
 # モデルパス（絶対パス化）
 model_path = os.path.abspath("model/Phi-4-mini-instruct.Q4_K_S.gguf")
 
+N_CTX = int(os.getenv("LLAMA_N_CTX", "2048"))
+REPLY_RESERVE = int(os.getenv("LLAMA_REPLY_RESERVE", "512"))  # 応答生成のために空けておくトークン数
+
+# 推論スロット設定（スロット数 × スロットあたりスレッド数 ≒ 推論機のコア数）
+N_SLOTS = int(os.getenv("LLAMA_SLOTS", "2"))
+THREADS_PER_SLOT = int(os.getenv("LLAMA_THREADS_PER_SLOT", str(max(1, (os.cpu_count() or 6) // max(1, N_SLOTS)))))
+MAX_QUEUE = int(os.getenv("LLAMA_MAX_QUEUE", "16"))              # 待ち行列の上限（超過は429）
+QUEUE_TIMEOUT = float(os.getenv("LLAMA_QUEUE_TIMEOUT", "300"))   # スロット待ちの上限秒数
+PREFIX_CACHE_MB = float(os.getenv("LLAMA_PREFIX_CACHE_MB", "512"))  # スロットあたりのKV状態キャッシュ上限
+
 # プロンプト読み込み（絶対パス化）
 prompt_path = os.path.abspath("prompts/aria_prompt.txt")
 try:
@@ -19,30 +36,371 @@ except Exception as e:
     print(f"[server] プロンプト読み込みエラー: {e}")
     base_prompt = ""
 
-# モデル初期化
-try:
-    llm = Llama(model_path=model_path, n_ctx=2048, n_threads=6)
-except Exception as e:
-    print(f"[server] モデル初期化エラー: {e}")
-    llm = None
 
+# === プレフィックスKVキャッシュ ===
+def _common_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    if not n:
+        return 0
+    diff = np.nonzero(np.asarray(a[:n]) != np.asarray(b[:n]))[0]
+    return int(diff[0]) if diff.size else n
+
+class PrefixCache:
+    """
+    スロットごとのKV状態キャッシュ
+    起動時に人格プロンプト（base_prompt）を評価した状態を保存し、リクエストごとに最長一致の状態を復元する
+    生成後の状態は会話プレフィックスとしてLRUに保存（人格プロンプトの状態も含めた合計サイズを上限内に保つ）
+    llama_cpp は復元済みの input_ids と一致する先頭トークンの評価を省略する
+    コンテキストに残っているトークン列は llama_cpp の内部属性を読まず、保存した状態から自前で追跡する
+    """
+
+    def __init__(self, llm: Llama, base_text: str, max_bytes: int) -> None:
+        self.llm = llm
+        self.max_bytes = max_bytes
+        self._states: "OrderedDict[bytes, Tuple[np.ndarray, Any]]" = OrderedDict()
+        self._bytes = 0
+        self.base_ids: Optional[np.ndarray] = None
+        self.base_state: Any = None
+        self._live_ids: Optional[np.ndarray] = None  # コンテキストに残っているトークン列（生成中・中断後は不明として None）
+        self.eval_ms_per_token = 0.0
+        self.enabled = True
+        self.lookups = 0
+        self.hits = 0
+        self.reused_tokens = 0
+        self.prompt_tokens = 0
+        self.saved_ms = 0.0
+        try:
+            tokens = llm.tokenize(base_text.encode("utf-8"), add_bos=True, special=True)
+            started = time.perf_counter()
+            llm.reset()
+            llm.eval(tokens)
+            self.eval_ms_per_token = 1000 * (time.perf_counter() - started) / max(1, len(tokens))
+            self.base_state = llm.save_state()
+            self.base_ids = np.asarray(tokens, dtype=np.int64)
+            self._live_ids = self.base_ids
+            self._bytes = self.base_state.llama_state_size
+        except Exception as e:
+            print(f"[server] プレフィックスキャッシュ初期化エラー: {e}")
+            self.enabled = False
+
+    def prepare(self, prompt: str) -> Dict[str, Any]:
+        """最長一致する状態を復元し、再利用トークン数などを返す"""
+        if not self.enabled:
+            return {"prefix_hit": False, "source": "disabled"}
+        tokens = np.asarray(self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True), dtype=np.int64)
+        # 直前のリクエストでコンテキストに残っている状態も候補
+        live_len = _common_prefix(self._live_ids, tokens) if self._live_ids is not None else 0
+        best_source, best_len, best_key = "live", live_len, None
+        self._live_ids = None  # この後の生成で変わる（store() で確定）
+        if self.base_ids is not None:
+            base_len = _common_prefix(self.base_ids, tokens)
+            if base_len > best_len:
+                best_source, best_len = "base", base_len
+        for key, (ids, _) in self._states.items():
+            length = _common_prefix(ids, tokens)
+            if length > best_len:
+                best_source, best_len, best_key = "lru", length, key
+        reused = min(best_len, len(tokens) - 1)
+        try:
+            if best_source == "base":
+                self.llm.load_state(self.base_state)
+            elif best_source == "lru":
+                self._states.move_to_end(best_key)
+                self.llm.load_state(self._states[best_key][1])
+        except Exception as e:
+            print(f"[server] KV状態復元エラー: {e}")
+            best_source, reused = "none", 0
+        saved_ms = reused * self.eval_ms_per_token
+        self.lookups += 1
+        self.hits += 1 if reused > 0 else 0
+        self.reused_tokens += max(0, reused)
+        self.prompt_tokens += len(tokens)
+        self.saved_ms += saved_ms
+        return {
+            "prefix_hit": reused > 0,
+            "source": best_source if reused > 0 else "none",
+            "prompt_tokens": int(len(tokens)),
+            "reused_tokens": int(max(0, reused)),
+            "saved_prompt_eval_ms": round(saved_ms, 1),
+            "hit_rate": round(self.hits / self.lookups, 3)
+        }
+
+    def store(self) -> None:
+        """生成後の状態を会話プレフィックスとして保存"""
+        if not self.enabled:
+            return
+        try:
+            state = self.llm.save_state()
+            ids = np.asarray(state.input_ids[:state.n_tokens], dtype=np.int64)
+            self._live_ids = ids
+            key = ids.tobytes()
+            if key in self._states:
+                self._bytes -= self._states.pop(key)[1].llama_state_size
+            self._states[key] = (ids, state)
+            self._bytes += state.llama_state_size
+            while self._bytes > self.max_bytes and self._states:
+                self._bytes -= self._states.popitem(last=False)[1][1].llama_state_size
+        except Exception as e:
+            print(f"[server] KV状態保存エラー: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._states),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "reused_token_ratio": round(self.reused_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            "saved_prompt_eval_ms": round(self.saved_ms, 1)
+        }
+
+# === 推論スロット ===
+class Slot:
+    """1つのモデルコンテキスト（同時に1リクエストだけが使う）"""
+
+    def __init__(self, slot_id: int, llm: Llama) -> None:
+        self.slot_id = slot_id
+        self.llm = llm
+        self.prefix_cache = PrefixCache(llm, f"<|system|>{base_prompt}<|end|>", int(PREFIX_CACHE_MB * 1024 * 1024))
+        self.busy = False
+        self.requests = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.last_tokens_per_sec = 0.0
+
+    def record(self, tokens: int, seconds: float) -> None:
+        self.requests += 1
+        self.tokens += tokens
+        self.seconds += seconds
+        self.last_tokens_per_sec = tokens / seconds if seconds > 0 else 0.0
+        metrics.observe_span("server_generate", seconds, slot=self.slot_id)
+        if tokens:
+            metrics.observe("aria_server_tokens_per_second", self.last_tokens_per_sec, "スロットごとの生成速度", metrics.TOKENS_PER_SEC_BUCKETS, slot=self.slot_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slot": self.slot_id,
+            "busy": self.busy,
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "tokens_per_sec": round(self.tokens / self.seconds, 2) if self.seconds else 0.0,
+            "last_tokens_per_sec": round(self.last_tokens_per_sec, 2),
+            "prefix_cache": self.prefix_cache.stats()
+        }
+
+class SchedulerBusy(Exception):
+    def __init__(self, queue_position: int, retry_after: float) -> None:
+        super().__init__(f"inference queue is full ({queue_position} waiting)")
+        self.queue_position = queue_position
+        self.retry_after = retry_after
+
+class _Job:
+    __slots__ = ("channel", "event", "slot")
+
+    def __init__(self, channel: str) -> None:
+        self.channel = channel
+        self.event = threading.Event()
+        self.slot: Optional[Slot] = None
+
+# === スケジューラ（チャンネル単位のラウンドロビン）===
+class InferenceScheduler:
+    """
+    空きスロットがあれば即割り当て、なければチャンネルごとの待ち行列に並べる
+    スロット解放時はチャンネルを順番に回して次のジョブを選ぶ（1チャンネルの連投で他が詰まらない）
+    """
+
+    def __init__(self, slots: List[Slot], max_queue: int = MAX_QUEUE) -> None:
+        self.slots = slots
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._free: List[Slot] = list(slots)
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queued = 0
+        self.rejected = 0
+
+    def _estimate_wait(self, position: int) -> float:
+        done = [s for s in self.slots if s.requests]
+        avg = sum(s.seconds for s in done) / sum(s.requests for s in done) if done else 30.0
+        return round(avg * position / max(1, len(self.slots)), 1)
+
+    def acquire(self, channel: str, timeout: float = QUEUE_TIMEOUT) -> Slot:
+        with self._lock:
+            if self._free and not self._queued:
+                slot = self._free.pop()
+                slot.busy = True
+                return slot
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy(self._queued + 1, self._estimate_wait(self._queued + 1))
+            job = _Job(channel)
+            self._queues.setdefault(channel, deque()).append(job)
+            self._queued += 1
+        if not job.event.wait(timeout):
+            with self._lock:
+                if job.slot is None:
+                    self._queues[channel].remove(job)
+                    if not self._queues[channel]:
+                        del self._queues[channel]
+                    self._queued -= 1
+                    self.rejected += 1
+                    raise SchedulerBusy(self._queued, self._estimate_wait(self._queued))
+        return job.slot
+
+    def release(self, slot: Slot) -> None:
+        with self._lock:
+            if self._queues:
+                channel, queue = next(iter(self._queues.items()))
+                job = queue.popleft()
+                del self._queues[channel]
+                if queue:
+                    self._queues[channel] = queue  # 末尾へ回す
+                self._queued -= 1
+                job.slot = slot
+                job.event.set()
+            else:
+                slot.busy = False
+                self._free.append(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slots": [s.stats() for s in self.slots],
+                "queued": self._queued,
+                "queued_by_channel": {c: len(q) for c, q in self._queues.items()},
+                "max_queue": self.max_queue,
+                "rejected": self.rejected
+            }
+
+# モデル初期化（スロットごとにコンテキストを確保。重みはmmapで共有）
+slots: List[Slot] = []
+for i in range(max(1, N_SLOTS)):
+    try:
+        slots.append(Slot(i, Llama(model_path=model_path, n_ctx=N_CTX, n_threads=THREADS_PER_SLOT)))
+    except Exception as e:
+        print(f"[server] モデル初期化エラー（slot {i}）: {e}")
+        break
+scheduler = InferenceScheduler(slots)
+
+def _scheduler_samples() -> List[metrics.Sample]:
+    """待ち行列の深さ・スロットごとの処理量とプレフィックスキャッシュ命中（スクレイプ時に読む）"""
+    stats = scheduler.stats()
+    samples: List[metrics.Sample] = [
+        ("aria_server_queue_depth", "gauge", "スロット待ちの件数", {}, stats["queued"]),
+        ("aria_server_queue_channels", "gauge", "待ちのあるチャンネル数", {}, len(stats["queued_by_channel"])),
+        ("aria_server_rejected", "gauge", "待ち行列あふれ・待ち時間切れで断った件数", {}, stats["rejected"])
+    ]
+    for slot in stats["slots"]:
+        values = {k: v for k, v in slot.items() if k != "slot"}
+        samples.extend(metrics.stats_samples("aria_server_slot", values, {"slot": slot["slot"]}))
+    return samples
+
+metrics.register_collector(_scheduler_samples)
+
+# コンテキスト詰め込みはモデル本体のトークナイザで数える
+if slots:
+    set_tokenizer(lambda text: slots[0].llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+def build_chat_prompt(messages: List[Dict[str, Any]]) -> str:
+    """人格プロンプト + 受け取った全メッセージをPhiテンプレートで描画（n_ctx に収まるよう古い順に削る）"""
+    history = [m for m in messages if m.get("role") in ("user", "assistant") and m.get("content")]
+    fitted = fit_messages([{"role": "system", "content": base_prompt}] + history, N_CTX - REPLY_RESERVE)
+    return render_phi(fitted)
+
+
+# === ストリーミング応答（SSE, OpenAI互換の delta 形式）===
+def stream_chat(slot: Slot, prompt: str, release: Callable[[], None]) -> Iterator[str]:
+    started = time.perf_counter()
+    tokens = 0
+    try:
+        cache_meta = slot.prefix_cache.prepare(prompt)
+        for chunk in slot.llm(prompt, temperature=0.7, max_tokens=1024, stream=True):
+            text = chunk["choices"][0]["text"]
+            tokens += 1
+            if text:
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': text}}]}, ensure_ascii=False)}\n\n"
+        slot.prefix_cache.store()
+        yield f"data: {json.dumps({'aria_cache': cache_meta})}\n\n"
+    except Exception as e:
+        print(f"[server] ストリーミング生成エラー: {e}")
+        yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+    finally:
+        slot.record(tokens, time.perf_counter() - started)
+        release()
+    yield "data: [DONE]\n\n"
 
 @app.route("/v1/chat/completions", methods=["POST"])
 def chat() -> Any:
-    if llm is None or not base_prompt:
+    if not slots or not base_prompt:
         return jsonify({"error": "Model or prompt not loaded."}), 500
     try:
         data = request.json
-        user_msg = data["messages"][-1]["content"]
-        prompt = f"{base_prompt}\n<|user|>\n{user_msg}\n<|assistant|>\n"
-        output = llm(prompt, temperature=0.7, max_tokens=1024)
+        with metrics.span("server_build_prompt"):
+            prompt = build_chat_prompt(data["messages"])
+        channel = str(data.get("channel") or request.headers.get("X-Channel-Id") or request.remote_addr)
+        try:
+            with metrics.span("server_queue_wait"):
+                slot = scheduler.acquire(channel)
+        except SchedulerBusy as busy:
+            metrics.inc("aria_server_requests_total", status="busy")
+            return jsonify({
+                "error": str(busy),
+                "queue_position": busy.queue_position,
+                "retry_after": busy.retry_after
+            }), 429, {"Retry-After": str(int(busy.retry_after) + 1)}
+        metrics.inc("aria_server_requests_total", status="stream" if data.get("stream") else "ok")
+        if data.get("stream"):
+            released = threading.Event()
+
+            def release() -> None:
+                # 生成完了時とレスポンスclose時の両方から呼ばれるため1回だけ解放
+                if not released.is_set():
+                    released.set()
+                    scheduler.release(slot)
+
+            response = Response(stream_chat(slot, prompt, release), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+            response.call_on_close(release)
+            return response
+        started = time.perf_counter()
+        try:
+            cache_meta = slot.prefix_cache.prepare(prompt)
+            output = slot.llm(prompt, temperature=0.7, max_tokens=1024)
+            slot.prefix_cache.store()
+        finally:
+            elapsed = time.perf_counter() - started
+            scheduler.release(slot)
+        tokens = output.get("usage", {}).get("completion_tokens", 0)
+        slot.record(tokens, elapsed)
         response_text = output["choices"][0]["text"].strip()
         return jsonify({
-            "choices": [{"message": {"content": response_text}}]
+            "choices": [{"message": {"content": response_text}}],
+            "usage": output.get("usage", {}),
+            "slot": slot.slot_id,
+            "aria_cache": cache_meta
         })
     except Exception as e:
+        metrics.inc("aria_server_requests_total", status="error")
         print(f"[server] 応答生成エラー: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/v1/slots", methods=["GET"])
+def slot_status() -> Any:
+    return jsonify(scheduler.stats())
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint() -> Any:
+    """Prometheus テキスト形式（区間・カウンタは ARIA_METRICS=1 のときだけ記録される）"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/debug/profile", methods=["GET", "POST"])
+def debug_profile() -> Any:
+    """?seconds=10 で計測開始（wait=1 なら終了まで待つ）、seconds なしで状態。結果は ARIA_PROFILE_DIR に保存"""
+    params = request.args.to_dict()
+    if request.headers.get("X-Debug-Token"):
+        params.setdefault("token", request.headers["X-Debug-Token"])
+    code, body = profiler.handle_request(params, "server")
+    return jsonify(body), code
+
 if __name__ == "__main__":
-    app.run(port=1234)
+    app.run(port=1234, threaded=True)
@@ -0,0 +1,12 @@
+# conftest.py
+# utils/ のモジュールはフラットに import される（Bot本体と同じ）ので、パスを通してから読み込む
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "utils"))
+sys.path.insert(0, os.path.join(ROOT, "translate_bot"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+os.environ.setdefault("VECTORIZER_CACHE_PATH", "")  # テストで memory/ に埋め込みキャッシュを作らない
@@ -0,0 +1,53 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+import ann_index
+
+BACKENDS = ["exact", "ivf"] + (["hnsw"] if importlib.util.find_spec("hnswlib") else [])
+
+
+def _unit_rows(n, dim=8, seed=0):
+    rows = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_rows_appended_after_snapshot_are_ignored(backend):
+    """索引が呼び出し側の mask / boosts より先に伸びても、範囲外の行を参照しない"""
+    index = ann_index.create_index(8, backend)
+    rows = _unit_rows(10)
+    index.add(rows[:6])
+    mask = np.ones(6, dtype=bool)
+    boosts = np.zeros(6, dtype=np.float32)
+    index.add(rows[6:])  # スナップショットを取った後の並行追記
+
+    ids, _ = index.search_boosted(rows[8], 3, boosts, mask)
+    assert ids.size and ids.max() < 6
+    for ids, _ in index.search_boosted_many(rows[7:9], 3, boosts, mask):
+        assert ids.size and ids.max() < 6
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_limit_without_arrays(backend):
+    index = ann_index.create_index(8, backend)
+    rows = _unit_rows(10)
+    index.add(rows)
+
+    ids, _ = index.search_boosted(rows[9], 5, boosts=lambda ids: np.zeros(len(ids), dtype=np.float32), limit=4)
+    assert set(ids.tolist()) <= {0, 1, 2, 3}
+    for ids, _ in index.search_boosted_many(rows[8:], 5, limit=4):
+        assert set(ids.tolist()) <= {0, 1, 2, 3}
+
+
+def test_incomplete_index_fails_on_creation():
+    class NoSearch(ann_index.VectorIndex):
+        def __len__(self):
+            return 0
+
+        def add(self, vectors):
+            pass
+
+    with pytest.raises(TypeError):
+        NoSearch(8)
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+import embedding_service
+import vectorizer
+
+
+@pytest.fixture
+def pending(monkeypatch):
+    """未計算が5件ある状態（init_vector_memory の呼び出しの limit を記録）"""
+    state = {"left": 5, "limits": []}
+    lock = threading.Lock()
+
+    def init_vector_memory(limit=None):
+        with lock:
+            state["limits"].append(limit)
+            count = state["left"] if limit is None else min(limit, state["left"])
+            state["left"] -= count
+            return count
+
+    monkeypatch.setattr(vectorizer, "init_vector_memory", init_vector_memory)
+    monkeypatch.setattr(vectorizer, "encode_text", lambda text: [0.0])
+    monkeypatch.setattr(embedding_service, "INIT_RETRY", 0.01)
+    return state
+
+
+def _wait_done(service):
+    for _ in range(500):
+        if service.init_done:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(service.backlog())
+
+
+def test_json_backend_inits_in_one_job(pending, monkeypatch):
+    monkeypatch.setattr(vectorizer, "use_sqlite", lambda: False)
+    service = embedding_service.EmbeddingService().start()
+    assert service.submit_init(chunk=2).result(timeout=5) == 5
+    _wait_done(service)
+    assert pending["limits"] == [None]
+    service.stop(timeout=5)
+
+
+def test_dropped_requeue_is_retried(pending, monkeypatch):
+    monkeypatch.setattr(vectorizer, "use_sqlite", lambda: True)
+    service = embedding_service.EmbeddingService(max_backlog=1)
+    service.submit_init(chunk=2)
+    _, step, _ = service._jobs.get_nowait()
+    service.submit_encode("busy")  # 続きを入れる前にキューを埋める
+    assert step() == 2
+    assert service.dropped == 1
+
+    service.start()
+    _wait_done(service)
+    assert service.initialized == 5
+    assert pending["limits"] == [2, 2, 2]
+    service.stop(timeout=5)
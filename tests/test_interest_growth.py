@@ -0,0 +1,69 @@
+import json
+import re
+
+import pytest
+
+import interest_growth
+import memory_store
+from interest_growth import INCREMENT, InterestState
+
+@pytest.fixture
+def sqlite_store(tmp_path, monkeypatch):
+    store = memory_store.MemoryStore(str(tmp_path / "aria_memory.sqlite"))
+    monkeypatch.setattr(memory_store, "BACKEND", "sqlite")
+    monkeypatch.setattr(memory_store, "_store", store)
+    return store
+
+def test_flush_keeps_updates_from_another_process_sqlite(sqlite_store):
+    ours, theirs = InterestState(delay=60), InterestState(delay=60)
+    ours.apply(["I had a dream"])
+    theirs.apply(["the future, tomorrow"])
+    theirs.flush()
+    ours.flush()
+    saved = sqlite_store.get_kv("interest")
+    assert saved["topics"]["dreams"] == pytest.approx(0.5 + INCREMENT)
+    assert saved["topics"]["future"] == pytest.approx(0.5 + INCREMENT)
+    assert ours.snapshot()["topics"]["future"] == pytest.approx(0.5 + INCREMENT)
+
+def test_flush_keeps_updates_from_another_process_json(tmp_path):
+    path = str(tmp_path / "aria_interest.json")
+    ours, theirs = InterestState(path, delay=60), InterestState(path, delay=60)
+    ours.apply(["I had a dream", "a dream again"])
+    theirs.apply(["I remember"])
+    theirs.flush()
+    ours.flush()
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["topics"]["dreams"] == pytest.approx(0.5 + 2 * INCREMENT)
+    assert saved["topics"]["memory"] == pytest.approx(0.5 + INCREMENT)
+
+def test_increments_are_capped():
+    interest = interest_growth.merge_increments(None, {("topics", "ai"): 1000})
+    assert interest["topics"]["ai"] == interest_growth.MAX_SCORE
+
+def _rebuild_matcher(monkeypatch):
+    matcher, names = interest_growth._build_matcher()
+    monkeypatch.setattr(interest_growth, "_matcher", matcher)
+    monkeypatch.setattr(interest_growth, "_group_names", names)
+
+def test_categories_sharing_a_keyword_all_hit(monkeypatch):
+    monkeypatch.setitem(interest_growth.TOPIC_KEYWORDS, "night", [r"nightmare"])
+    monkeypatch.setitem(interest_growth.STYLE_KEYWORDS, "gloomy", [r"nightmare"])
+    _rebuild_matcher(monkeypatch)
+    hits = interest_growth.match_categories("a nightmare")
+    assert hits["topics"] == {"dreams", "night"}
+    assert hits["style_affinity"] == {"gloomy"}
+
+def test_matches_per_pattern_search():
+    texts = [
+        "Is like a whisper in the silence, because I remember the future?",
+        "AI dreams of machine tomorrow, hence alone",
+        "nothing here"
+    ]
+    for text in texts:
+        expected = {"topics": set(), "style_affinity": set()}
+        for kind, table in (("topics", interest_growth.TOPIC_KEYWORDS), ("style_affinity", interest_growth.STYLE_KEYWORDS)):
+            for category, patterns in table.items():
+                if any(re.search(p, text, re.IGNORECASE) for p in patterns):
+                    expected[kind].add(category)
+        assert interest_growth.match_categories(text) == expected
@@ -0,0 +1,57 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import journal_index
+
+
+def _entry(i, dim=4):
+    vec = np.zeros(dim, dtype=np.float32)
+    vec[i % dim] = 1.0
+    return {"content": f"entry {i}", "vector": vec.tolist(), "style": "poetic", "symbolic_score": 0.5}
+
+
+def _write(path, entries, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    path = str(tmp_path / "aria_journal.jsonl")
+    _write(path, [_entry(i) for i in range(3)])
+    # 開いたまま（memmap中）のファイルは消せない環境を再現する
+    def remove(p):
+        raise PermissionError(f"{p} is in use")
+    monkeypatch.setattr(journal_index.os, "remove", remove)
+    return path
+
+
+def test_shrunk_journal_rebuilds_into_new_generation(journal):
+    index = journal_index.JournalIndex(journal)
+    held = index.snapshot()  # 呼び出し側が旧世代のビューを持ったまま
+    assert len(held[0]) == 3
+
+    _write(journal, [_entry(7)])
+    view = index.snapshot()
+
+    assert index.generation == 1
+    assert len(view[0]) == 1
+    assert index.load_entries([0])[0]["content"] == "entry 7"
+    assert len(held[0]) == 3  # 旧世代のファイルは書き換えない
+
+
+def test_generation_survives_reload(journal):
+    index = journal_index.JournalIndex(journal)
+    index.snapshot()
+    index.rebuild()
+    _write(journal, [_entry(3)], mode="a")
+    index.snapshot()
+
+    reloaded = journal_index.JournalIndex(journal)
+    assert reloaded.generation == index.generation
+    assert reloaded.snapshot()[0].shape == (4, 4)
+    assert os.path.basename(reloaded.vec_path) == f"aria_journal.g{index.generation}.vec.f32"
@@ -0,0 +1,20 @@
+import threading
+
+import memory_manager
+
+
+def test_stage_is_skipped_while_previous_runs_hold_its_workers():
+    release = threading.Event()
+    stuck = [memory_manager._submit_stage("rag", release.wait) for _ in range(memory_manager.STAGE_WORKERS)]
+    try:
+        assert all(f is not None for f in stuck)
+        assert memory_manager._submit_stage("rag", lambda: {}) is None
+        # 他のステージは影響を受けない
+        assert memory_manager._submit_stage("short_term", lambda: ["ok"]).result(timeout=5) == ["ok"]
+        assert memory_manager._await_stage("rag", None, 0.0, "fallback") == "fallback"
+        assert memory_manager.get_stage_stats()["rag"]["busy"] >= 1
+    finally:
+        release.set()
+    for future in stuck:
+        future.result(timeout=5)
+    assert memory_manager._submit_stage("rag", lambda: "again").result(timeout=5) == "again"
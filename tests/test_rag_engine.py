@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import rag_engine
+
+HITS_KEY = web.AppKey("hits", list)
+DELAYS = {"slow": 0.2, "hang": 0.5}  # 題名ごとの応答遅延（秒）
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time / time.monotonic を手で進める"""
+    now = {"t": 1000.0}
+    monkeypatch.setattr(rag_engine.time, "time", lambda: now["t"])
+    monkeypatch.setattr(rag_engine.time, "monotonic", lambda: now["t"])
+    return now
+
+
+def test_cache_hit_and_negative_ttl_expiry(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(rag_engine, "CACHE_TTL", 100.0)
+    monkeypatch.setattr(rag_engine, "NEGATIVE_TTL", 10.0)
+    cache = rag_engine.ResponseCache(str(tmp_path / "rag_cache.sqlite"))
+    cache.put("wikipedia", "Moon", ("Earth's satellite", "https://example/moon"))
+    cache.put("wikipedia", "Nothing", (None, None))
+
+    assert cache.get("wikipedia", "moon") == ("Earth's satellite", "https://example/moon")
+    assert cache.get("wikipedia", "nothing") == (None, None)
+    clock["t"] += 11
+    assert cache.get("wikipedia", "nothing") is None  # 「該当なし」は短い TTL で切れる
+    assert cache.get("wikipedia", "moon") is not None
+    clock["t"] += 100
+    assert cache.get("wikipedia", "moon") is None
+    assert cache.stats()["hits"] == 3
+
+
+def test_breaker_opens_then_half_opens(clock):
+    breaker = rag_engine.CircuitBreaker(failures=2, cooldown=30)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock["t"] += 30
+    assert breaker.allow()      # 冷却後に1回だけ試す
+    assert not breaker.allow()  # 試行中は他を通さない
+    breaker.record(False)
+    clock["t"] += 29
+    assert not breaker.allow()  # 失敗したので再び冷却
+    clock["t"] += 1
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+# === ローカルのスタブ情報源に対するエンジンの試験 ===
+async def _wikipedia(request):
+    title = request.match_info["title"]
+    request.app[HITS_KEY].append(title)
+    await asyncio.sleep(DELAYS.get(title, 0.0))
+    if title == "missing":
+        raise web.HTTPNotFound()
+    return web.json_response({"extract": f"about {title}", "content_urls": {"desktop": {"page": f"https://wiki/{title}"}}})
+
+
+async def _wikidata(request):
+    return web.json_response({"search": []})
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    cache_cls = rag_engine.ResponseCache
+    monkeypatch.setattr(rag_engine, "ResponseCache", lambda: cache_cls(str(tmp_path / "rag_cache.sqlite")))
+    return rag_engine.RAGEngine()
+
+
+def _run(monkeypatch, engine, scenario):
+    """スタブを立て、情報源URLを差し替えて scenario() を実行（結果, スタブへの到達題名）"""
+    async def main():
+        app = web.Application()
+        app[HITS_KEY] = []
+        app.router.add_get("/wiki/{title}", _wikipedia)
+        app.router.add_get("/wikidata", _wikidata)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        monkeypatch.setitem(rag_engine.SOURCE_URLS, "wikipedia", f"http://{host}:{port}/wiki")
+        monkeypatch.setitem(rag_engine.SOURCE_URLS, "wikidata", f"http://{host}:{port}/wikidata")
+        try:
+            return await scenario(), app[HITS_KEY]
+        finally:
+            if engine._session is not None:
+                await engine._session.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_fetch_uses_cache_for_hits_and_misses(monkeypatch, engine):
+    async def scenario():
+        return [await engine.fetch("wikipedia", q) for q in ("moon", "moon", "missing", "missing")]
+
+    results, hits = _run(monkeypatch, engine, scenario)
+    assert results[0] == results[1] == ("about moon", "https://wiki/moon")
+    assert results[2] == results[3] == (None, None)
+    assert hits == ["moon", "missing"]
+    assert engine.requests == 2
+
+
+def test_timeouts_are_counted_and_trip_the_breaker(monkeypatch, engine):
+    monkeypatch.setitem(rag_engine.SOURCE_TIMEOUTS, "wikipedia", 0.05)
+    engine.breakers["wikipedia"] = rag_engine.CircuitBreaker(failures=2, cooldown=60)
+
+    async def scenario():
+        return [await engine.fetch("wikipedia", "hang") for _ in range(3)]
+
+    results, hits = _run(monkeypatch, engine, scenario)
+    assert results == [(None, None)] * 3
+    assert engine.timeouts == 2
+    assert engine.skipped == 1  # 2回目の失敗で開き、3回目は問い合わせない
+    assert engine.breakers["wikipedia"].state == "open"
+    assert len(hits) == 2
+
+
+def test_search_prefers_priority_over_arrival(monkeypatch, engine):
+    async def scenario():
+        return await engine.search(["slow", "fast"])
+
+    hit, hits = _run(monkeypatch, engine, scenario)
+    assert hit == ("slow", "wikipedia", "about slow", "https://wiki/slow")
+    assert set(hits) == {"slow", "fast"}  # 両方に並行して問い合わせている
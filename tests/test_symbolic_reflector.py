@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import memory_store
+import symbolic_reflector
+
+DIM = 8
+
+def unit(i: int) -> list:
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[i] = 1.0
+    return vec.tolist()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = memory_store.MemoryStore(str(tmp_path / "aria_memory.sqlite"))
+    monkeypatch.setattr(memory_store, "BACKEND", "sqlite")
+    monkeypatch.setattr(memory_store, "_store", store)
+    monkeypatch.setattr(symbolic_reflector, "_vector_state", {
+        "stamp": None, "entries": [], "boosts": [], "index": None,
+        "last_id": 0, "pending": set(), "fills": -1, "pending_checked": 0.0
+    })
+    monkeypatch.setattr(symbolic_reflector, "encode_text", lambda text: unit(int(text)))
+    return store
+
+def contents(results):
+    return [r["content"] for r in results]
+
+def test_pending_row_is_indexed_after_its_embedding_is_filled(store):
+    store.append_vector("indexed", unit(0))
+    pending_id = store.append_vector("pending", None)
+    store.append_vector("later", unit(2))
+
+    assert "pending" not in contents(symbolic_reflector.reflect_vector_relevance("1", top_k=3))
+
+    store.set_vectors([(pending_id, unit(1))])
+    results = symbolic_reflector.reflect_vector_relevance("1", top_k=1)
+    assert contents(results) == ["pending"]
+
+def test_rows_after_a_pending_row_are_indexed_once(store):
+    pending_id = store.append_vector("pending", None)
+    store.append_vector("a", unit(0))
+    symbolic_reflector.reflect_vector_relevance("0", top_k=3)
+    store.set_vectors([(pending_id, unit(1))])
+    symbolic_reflector.reflect_vector_relevance("0", top_k=3)
+    assert sorted(contents(symbolic_reflector._vector_state["entries"])) == ["a", "pending"]
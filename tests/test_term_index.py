@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import term_index
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(term_index, "BLOOM_CAPACITY", 8)
+    monkeypatch.setattr(term_index, "JOURNAL_PATH", str(tmp_path / "aria_journal.jsonl"))
+    monkeypatch.setattr(term_index, "LONG_TERM_PATH", str(tmp_path / "compressed_memory.json"))
+    monkeypatch.setattr(term_index, "use_sqlite", lambda: False)
+    return term_index.TermIndex(str(tmp_path / "term_index"))
+
+
+def _guard_mapped(index, monkeypatch):
+    """マップ中のブルームファイルを削除・置換したら失敗させる（Windowsと同じ制約）"""
+    opened = []
+    original = term_index.BloomFilter.__init__
+
+    def tracking_init(self, path, *args, **kwargs):
+        original(self, path, *args, **kwargs)
+        opened.append((os.path.abspath(path), self))
+
+    def check(path):
+        for mapped, bloom in opened:
+            if mapped == os.path.abspath(path) and bloom._data is not None:
+                raise PermissionError(f"{path} is still mapped")
+
+    real_remove, real_replace = os.remove, os.replace
+
+    def remove(path):
+        check(path)
+        real_remove(path)
+
+    def replace(src, dst):
+        check(src)
+        check(dst)
+        real_replace(src, dst)
+
+    opened.append((os.path.abspath(index.bloom_path), index.bloom))
+    monkeypatch.setattr(term_index.BloomFilter, "__init__", tracking_init)
+    monkeypatch.setattr(term_index.os, "remove", remove)
+    monkeypatch.setattr(term_index.os, "replace", replace)
+
+
+def test_resize_releases_old_map(index, monkeypatch):
+    _guard_mapped(index, monkeypatch)
+    words = [f"word{i}" for i in range(20)]
+    index.add_texts([" ".join(words)])
+
+    assert index.header["capacity"] > 8
+    assert not os.path.exists(index.bloom_path + ".tmp")
+    assert index.contains_many(words[:3] + ["missing"]) == [True, True, True, False]
+
+
+def test_rebuild_releases_map(index, monkeypatch):
+    _guard_mapped(index, monkeypatch)
+    index.add_texts(["moon river"])
+
+    assert index.rebuild() == 0
+    assert index.contains("moon") is False
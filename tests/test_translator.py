@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import stub_server
+import translator
+
+
+def test_split_text_cuts_at_separators():
+    text = "alpha beta\ngamma delta"
+    parts = translator.split_text(text, limit=12)
+    assert "".join(parts) == text
+    assert parts[0] == "alpha beta\n"
+    assert all(len(p) <= 12 for p in parts)
+
+
+def test_split_text_without_separator_cuts_at_limit():
+    assert translator.split_text("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert translator.split_text("", limit=10) == []
+
+
+def test_char_budget_waits_for_refill(monkeypatch):
+    clock = {"now": 100.0}
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+        clock["now"] += delay
+
+    monkeypatch.setattr(translator.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(translator.asyncio, "sleep", sleep)
+
+    async def run():
+        budget = translator.CharBudget(per_minute=60)  # 1文字/秒
+        await budget.acquire(60)
+        await budget.acquire(5)
+        await budget.acquire(1000)  # 上限を超える要求は上限まで待てば通す
+        return budget
+
+    budget = asyncio.run(run())
+    assert slept == [pytest.approx(5.0), pytest.approx(60.0)]
+    assert budget.waited == pytest.approx(65.0)
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def _stub_app():
+    args = stub_server.build_parser().parse_args(["--translate-latency-ms", "0"])
+    return stub_server.create_app(args)
+
+
+def test_concurrent_texts_are_batched(monkeypatch):
+    monkeypatch.setattr(translator, "BATCH_WINDOW", 0.02)
+
+    async def run():
+        app = _stub_app()
+        runner, endpoint = await _serve(app)
+        client = translator.Translator(key="test", endpoint=endpoint)
+        try:
+            texts = ["one", "two", "three", "two"]
+            results = await asyncio.gather(*(client.translate(t, "ja") for t in texts))
+            again = await client.translate("one", "ja")
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return results, again, app[stub_server.CONFIG_KEY].requests, client
+
+    results, again, requests, client = asyncio.run(run())
+    assert results == ["[ja] one", "[ja] two", "[ja] three", "[ja] two"]
+    assert again == "[ja] one"
+    assert requests["translate"] == 1
+    assert requests["translate_texts"] == 3
+    assert client.coalesced == 1
+    assert client.cache.hits == 1
+
+
+def test_short_response_fails_every_text(monkeypatch):
+    monkeypatch.setattr(translator, "BATCH_WINDOW", 0.02)
+
+    async def short(request):
+        body = await request.json()
+        return web.json_response([{"translations": [{"text": "only one"}]}] * (len(body) - 1))
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/translate", short)
+        runner, endpoint = await _serve(app)
+        client = translator.Translator(key="test", endpoint=endpoint)
+        try:
+            return await asyncio.gather(*(client.translate(t, "ja") for t in ("a", "b")), return_exceptions=True)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
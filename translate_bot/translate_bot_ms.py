@@ -2,28 +2,44 @@
 
 import os
 import re
-import time
+import sys
+import asyncio
 import discord
-import aiohttp
 from discord.ext import commands
 from dotenv import load_dotenv
+from translator import Translator
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from admission import AdmissionController
+import metrics
+import profiler
  # === 1. .env 読み込み ===
 load_dotenv(".env.translate")
 TOKEN = os.getenv("DISCORD_TOKEN_TRANSLATE")
 MS_TRANSLATOR_KEY = os.getenv("MS_TRANSLATOR_KEY")
 MS_TRANSLATOR_REGION = os.getenv("MS_TRANSLATOR_REGION")
+translator = Translator(MS_TRANSLATOR_KEY, MS_TRANSLATOR_REGION)
 
 # === 2. Bot 設定 ===
+class TranslateBot(commands.Bot):
+    async def close(self) -> None:
+        await translator.close()
+        await super().close()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="?", intents=intents)
+bot = TranslateBot(command_prefix="?", intents=intents, help_command=None)
 
 # === 3. 除外ID（自分だけ）← アリアは除外しない
 IGNORE_USER_IDS = set()
+READY = False  # 初回の on_ready を済ませたか（再接続時は起動処理をしない）
 TRANSLATE_BOT_ID = 1398235270884888679
 
-# === 4. 最近の送信内容を記録してループ防止
-recent_messages: dict[str, float] = {}
+# === 4. 受付制御（同じ本文は一定時間無視してループ防止・チャンネル/ユーザー単位のレート制限）
+ADMISSION_CHANNEL_RATE = float(os.getenv("TRANSLATE_CHANNEL_RATE", "2"))
+ADMISSION_USER_RATE = float(os.getenv("TRANSLATE_USER_RATE", "1"))
+METRICS_PORT = int(os.getenv("TRANSLATE_METRICS_PORT", "9465"))  # ARIA_METRICS=1 のとき /metrics を公開
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if i}  # ?profile を使えるユーザー
 
 # === 5. 日本語・英語の文字比で言語判定
 def detect_language(text: str) -> str:
@@ -33,31 +49,79 @@ def detect_language(text: str) -> str:
         return "en"  # 絵文字だけなら英語と仮定
     return "ja" if ja > en else "en"
 
-# === 6. 翻訳API（Microsoft）
+# === 6. 翻訳API（Microsoft・接続共有 / まとめ送信 / キャッシュは translator.py）
 async def microsoft_translate(text: str, to_lang: str) -> str:
-    url = f"https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to={to_lang}"
-    headers = {
-        "Ocp-Apim-Subscription-Key": MS_TRANSLATOR_KEY,
-        "Ocp-Apim-Subscription-Region": MS_TRANSLATOR_REGION,
-        "Content-Type": "application/json"
-    }
-    body = [{"text": text}]
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=body) as resp:
-            try:
-                data = await resp.json()
-                return data[0]['translations'][0]['text']
-            except Exception as e:
-                raise RuntimeError(f"Translation API error: {e}")
+    return await translator.translate(text, to_lang)
 
 # === 7. 起動時処理
 @bot.event
 async def on_ready():
-    global IGNORE_USER_IDS
+    global IGNORE_USER_IDS, READY
     IGNORE_USER_IDS = {bot.user.id}
+    if READY:
+        return  # 再接続時
+    READY = True
+    metrics.start_http_server(METRICS_PORT)
     print(f"✅ TranslateBot logged in as {bot.user} (ID: {bot.user.id})")
 
-# === 8. メッセージ処理
+# === 管理者向け：一定時間プロファイルを取る（?profile 30）
+def is_admin(ctx: commands.Context) -> bool:
+    return ctx.author.id in ADMIN_USER_IDS
+
+@bot.command(name="profile")
+@commands.check(is_admin)
+async def profile_command(ctx: commands.Context, seconds: float = 10.0) -> None:
+    try:
+        session = profiler.start(seconds, label="translate_bot")
+    except profiler.ProfileBusy as busy:
+        await ctx.send(f"⏳ {busy}")
+        return
+    await ctx.send(f"🔬 プロファイル開始（{session.seconds:.0f}秒）")
+    await asyncio.to_thread(session.wait)
+    text = profiler.summary_text(session)
+    for i in range(0, len(text), 2000):
+        await ctx.send(text[i:i + 2000])
+
+@profile_command.error
+async def profile_error(ctx: commands.Context, error: commands.CommandError) -> None:
+    if not isinstance(error, commands.CheckFailure):
+        await ctx.send(f"❌ {error}")
+
+metrics.add_route("/debug/profile", profiler.http_route("translate_bot"))
+
+# === 8. メッセージ処理（処理中に同じチャンネルへ届いた発言はまとめて翻訳し、1通で返す）
+def translation_target(content: str) -> tuple[str, str]:
+    lang = detect_language(content)
+    to_lang = "ja" if lang == "en" else "en"
+    prefix = "🇺🇸→🇯🇵" if to_lang == "ja" else "🇯🇵→🇺🇸"
+    return to_lang, prefix
+
+async def translate_batch(channel_id: str, items: list[tuple[str, discord.Message]]) -> None:
+    channel = items[-1][1].channel
+    targets = [translation_target(content) for content, _ in items]
+    with metrics.span("translate"):
+        results = await asyncio.gather(
+            *(microsoft_translate(content, to_lang) for (content, _), (to_lang, _) in zip(items, targets)),
+            return_exceptions=True
+        )
+    lines = [
+        f"❌ Error: {result}" if isinstance(result, Exception) else f"{prefix} {result}"
+        for (_, prefix), result in zip(targets, results)
+    ]
+    text = "\n".join(lines)
+    for i in range(0, len(text), 2000):
+        await channel.send(text[i:i + 2000])
+
+admission = AdmissionController(
+    translate_batch,
+    channel_rate=ADMISSION_CHANNEL_RATE,
+    channel_burst=ADMISSION_CHANNEL_RATE * 5,
+    user_rate=ADMISSION_USER_RATE,
+    user_burst=ADMISSION_USER_RATE * 5
+)
+metrics.register_stats("aria_translate_admission", admission.stats)
+metrics.register_stats("aria_translator", translator.stats)
+
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.id in IGNORE_USER_IDS:
@@ -66,21 +130,13 @@ async def on_message(message: discord.Message):
     content = message.content.strip()
     if not content:
         return
+    if bot.user is not None and content.startswith(bot.command_prefix):
+        ctx = await bot.get_context(message)
+        if ctx.valid:  # 登録済みのコマンドだけ実行し、それ以外は通常の発言として扱う
+            await bot.invoke(ctx)
+            return
 
-    now = time.time()
-    if content in recent_messages and now - recent_messages[content] < 10:
-        return
-    recent_messages[content] = now
-
-    lang = detect_language(content)
-    to_lang = "ja" if lang == "en" else "en"
-    prefix = "🇺🇸→🇯🇵" if to_lang == "ja" else "🇯🇵→🇺🇸"
-
-    try:
-        translated = await microsoft_translate(content, to_lang)
-        await message.channel.send(f"{prefix} {translated}")
-    except Exception as e:
-        await message.channel.send(f"❌ Error: {e}")
+    admission.offer(str(message.channel.id), message.author.id, content, message)
 
 # === 9. 起動
 if __name__ == "__main__":
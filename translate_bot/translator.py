@@ -0,0 +1,241 @@
+# translator.py
+# Microsoft Translator への翻訳経路（接続を使い回し、同時に届いたメッセージを配列1回のリクエストにまとめ、結果をLRU+TTLで再利用）
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+DEFAULT_ENDPOINT = "https://api.cognitive.microsofttranslator.com"
+BATCH_WINDOW = float(os.getenv("TRANSLATE_BATCH_WINDOW", "0.05"))            # 同じ宛先言語の翻訳を待ち合わせる秒数
+MAX_TEXTS_PER_REQUEST = int(os.getenv("TRANSLATE_MAX_TEXTS", "1000"))         # APIの配列要素数の上限
+MAX_REQUEST_CHARS = int(os.getenv("TRANSLATE_MAX_REQUEST_CHARS", "50000"))    # 1リクエストの合計文字数の上限
+CHARS_PER_MINUTE = int(os.getenv("TRANSLATE_CHARS_PER_MINUTE", "33300"))      # 料金プランの文字数スロットル
+MAX_CONCURRENT = int(os.getenv("TRANSLATE_MAX_CONCURRENT", "4"))
+MAX_RETRIES = int(os.getenv("TRANSLATE_MAX_RETRIES", "3"))
+REQUEST_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "10"))
+CACHE_SIZE = int(os.getenv("TRANSLATE_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.getenv("TRANSLATE_CACHE_TTL", str(24 * 3600)))
+
+CacheKey = Tuple[str, str]  # (本文, 宛先言語)
+
+# === 翻訳キャッシュ（LRU + 有効期限）===
+class TranslationCache:
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL) -> None:
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: CacheKey, value: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+# === 文字数スロットル（トークンバケット）===
+class CharBudget:
+    """1分あたりの文字数を上限に、送信前に必要な文字数が貯まるまで待つ"""
+
+    def __init__(self, per_minute: int = CHARS_PER_MINUTE) -> None:
+        self.capacity = float(max(1, per_minute))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+
+    async def acquire(self, chars: int) -> None:
+        chars = min(float(chars), self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= chars:
+                self.tokens -= chars
+                return
+            delay = (chars - self.tokens) / self.rate
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+def split_text(text: str, limit: int = MAX_REQUEST_CHARS) -> List[str]:
+    """上限を超える本文を改行・空白の位置で分割（区切り文字は前の断片に残す）"""
+    parts = []
+    while len(text) > limit:
+        cut = max(text.rfind("\n", 0, limit), text.rfind(" ", 0, limit))
+        cut = cut + 1 if cut > 0 else limit
+        parts.append(text[:cut])
+        text = text[cut:]
+    return parts + [text] if text else parts
+
+# === 翻訳器 ===
+class Translator:
+    """
+    1つの ClientSession を使い回す。translate() の呼び出しは宛先言語ごとに BATCH_WINDOW 秒だけ待ち合わせ、
+    要素数・文字数の上限内で配列にまとめて送る。同じ本文の翻訳が進行中なら結果を共有する
+    エンドポイントは MS_TRANSLATOR_ENDPOINT で差し替え可能（ローカルのモックで検証できる）
+    """
+
+    def __init__(self, key: Optional[str] = None, region: Optional[str] = None, endpoint: Optional[str] = None) -> None:
+        self.key = key or os.getenv("MS_TRANSLATOR_KEY")
+        self.region = region or os.getenv("MS_TRANSLATOR_REGION")
+        self.endpoint = (endpoint or os.getenv("MS_TRANSLATOR_ENDPOINT") or DEFAULT_ENDPOINT).rstrip("/")
+        self.cache = TranslationCache()
+        self.budget = CharBudget()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: Dict[str, List[Tuple[str, "asyncio.Future[str]"]]] = {}
+        self._pending_chars: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._inflight: Dict[CacheKey, "asyncio.Future[str]"] = {}
+        self._tasks: "set[asyncio.Task[None]]" = set()
+        self.requests = 0
+        self.texts_sent = 0
+        self.chars_sent = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            headers = {"Content-Type": "application/json"}
+            if self.key:
+                headers["Ocp-Apim-Subscription-Key"] = self.key
+            if self.region:
+                headers["Ocp-Apim-Subscription-Region"] = self.region
+            connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=headers)
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+        return self._session
+
+    async def close(self) -> None:
+        for to_lang in list(self._timers):
+            self._flush(to_lang)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # === 受付 ===
+    async def translate(self, text: str, to_lang: str) -> str:
+        if len(text) > MAX_REQUEST_CHARS:
+            parts = await asyncio.gather(*(self.translate(part, to_lang) for part in split_text(text)))
+            return "".join(parts)
+        key = (text, to_lang)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._enqueue(text, to_lang, future)
+        return await asyncio.shield(future)
+
+    def _enqueue(self, text: str, to_lang: str, future: "asyncio.Future[str]") -> None:
+        pending = self._pending.setdefault(to_lang, [])
+        if pending and self._pending_chars[to_lang] + len(text) > MAX_REQUEST_CHARS:
+            self._flush(to_lang)  # 入りきらないので先に送る
+            pending = self._pending.setdefault(to_lang, [])
+        pending.append((text, future))
+        self._pending_chars[to_lang] = self._pending_chars.get(to_lang, 0) + len(text)
+        if len(pending) >= MAX_TEXTS_PER_REQUEST:
+            self._flush(to_lang)
+        elif to_lang not in self._timers:
+            self._timers[to_lang] = asyncio.get_running_loop().call_later(BATCH_WINDOW, self._flush, to_lang)
+
+    def _flush(self, to_lang: str) -> None:
+        timer = self._timers.pop(to_lang, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(to_lang, [])
+        self._pending_chars.pop(to_lang, None)
+        if items:
+            task = asyncio.ensure_future(self._send(to_lang, items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # === 送信 ===
+    async def _send(self, to_lang: str, items: List[Tuple[str, "asyncio.Future[str]"]]) -> None:
+        texts = [text for text, _ in items]
+        try:
+            translations = await self._request(texts, to_lang)
+            for (text, future), translated in zip(items, translations):  # 件数は _request で一致を確認済み
+                self.cache.put((text, to_lang), translated)
+                if not future.done():
+                    future.set_result(translated)
+        except Exception as e:
+            error = RuntimeError(f"Translation API error: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            for text, future in items:
+                if self._inflight.get((text, to_lang)) is future:
+                    del self._inflight[(text, to_lang)]
+                if not future.done():  # 送信タスクごと取り消された場合など、待ち手を残さない
+                    future.set_exception(RuntimeError("Translation API error: request aborted"))
+                if future.done() and not future.cancelled():
+                    future.exception()  # 待ち手がいない失敗で警告を出さない
+
+    async def _request(self, texts: List[str], to_lang: str) -> List[str]:
+        session = await self._get_session()
+        chars = sum(len(t) for t in texts)
+        url = f"{self.endpoint}/translate"
+        params = {"api-version": "3.0", "to": to_lang}
+        body = [{"text": t} for t in texts]
+        await self.budget.acquire(chars)
+        assert self._semaphore is not None
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._semaphore:
+                self.requests += 1
+                async with session.post(url, params=params, json=body, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        retry_after = resp.headers.get("Retry-After")
+                        status = resp.status
+                    else:
+                        resp.raise_for_status()
+                        data = await resp.json(content_type=None)
+                        if not isinstance(data, list) or len(data) != len(texts):
+                            raise RuntimeError(f"翻訳結果の件数が一致しません（送信 {len(texts)} / 受信 {len(data) if isinstance(data, list) else '-'}）")
+                        self.texts_sent += len(texts)
+                        self.chars_sent += chars
+                        return [item["translations"][0]["text"] for item in data]
+            if attempt == MAX_RETRIES:
+                break
+            self.retries += 1
+            delay = float(retry_after) if retry_after and retry_after.replace(".", "", 1).isdigit() else 2.0 ** attempt
+            print(f"[translator] HTTP {status}、{delay:.1f}秒後に再試行（{attempt + 1}/{MAX_RETRIES}）")
+            await asyncio.sleep(delay)
+        raise RuntimeError(f"HTTP {status}（再試行上限）")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "texts_sent": self.texts_sent,
+            "chars_sent": self.chars_sent,
+            "texts_per_request": self.texts_sent / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "throttled_seconds": round(self.budget.waited, 3),
+            "cache": self.cache.stats()
+        }
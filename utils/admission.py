@@ -0,0 +1,221 @@
+# admission.py
+# Botの受付制御：重複メッセージの抑止（時間輪で期限切れを掃除）・チャンネル/ユーザー単位のトークンバケット・
+# 飽和時の負荷制限（同じチャンネルの後続をまとめて1回にする / 捨てる）
+
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+DEDUP_TTL = float(os.getenv("ADMISSION_DEDUP_TTL", "10"))             # 同じ本文を無視する秒数
+DEDUP_RESOLUTION = float(os.getenv("ADMISSION_DEDUP_RESOLUTION", "1"))  # 時間輪の1スロットの秒数
+DEDUP_MAX = int(os.getenv("ADMISSION_DEDUP_MAX", "10000"))             # 覚えておく本文の上限件数
+CHANNEL_RATE = float(os.getenv("ADMISSION_CHANNEL_RATE", "0.5"))       # チャンネルごとの補充速度（件/秒）
+CHANNEL_BURST = float(os.getenv("ADMISSION_CHANNEL_BURST", "5"))
+USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "0.2"))             # ユーザーごとの補充速度（件/秒）
+USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "3"))
+MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", os.getenv("LLM_MAX_CONCURRENCY", "4")))
+MODE = os.getenv("ADMISSION_MODE", "coalesce")                          # 飽和時：coalesce（まとめる）/ drop（捨てる）
+COALESCE_MAX = int(os.getenv("ADMISSION_COALESCE_MAX", "8"))           # 1回にまとめる最大件数（超えた分は古い順に捨てる）
+BUCKET_MAX_KEYS = 4096
+
+ADMITTED = "admitted"
+DUPLICATE = "duplicate"
+RATE_LIMITED = "rate_limited"
+COALESCED = "coalesced"
+DROPPED = "dropped"
+
+# === 重複抑止（時間輪）===
+class TTLDedup:
+    """
+    ttl 秒以内に見た鍵を覚える。鍵は見た時刻のスロットに入り、輪が一周してそのスロットを
+    再利用するときにまとめて消えるので、掃除は時間経過に比例し、件数は max_entries で頭打ち
+    """
+
+    def __init__(self, ttl: float = DEDUP_TTL, resolution: float = DEDUP_RESOLUTION, max_entries: int = DEDUP_MAX) -> None:
+        self.ttl = ttl
+        self.resolution = max(1e-3, resolution)
+        self.max_entries = max(1, max_entries)
+        self._slots: List[Set[Hashable]] = [set() for _ in range(int(math.ceil(ttl / self.resolution)) + 1)]
+        self._seen: Dict[Hashable, float] = {}
+        self._tick: Optional[int] = None
+
+    def _slot(self, ts: float) -> Set[Hashable]:
+        return self._slots[int(ts // self.resolution) % len(self._slots)]
+
+    def _advance(self, now: float) -> None:
+        tick = int(now // self.resolution)
+        if self._tick is None:
+            self._tick = tick
+        for step in range(1, min(tick - self._tick, len(self._slots)) + 1):
+            slot = self._slots[(self._tick + step) % len(self._slots)]
+            for key in slot:
+                del self._seen[key]
+            slot.clear()
+        self._tick = max(self._tick, tick)
+
+    def _evict_oldest(self) -> None:
+        assert self._tick is not None
+        for step in range(1, len(self._slots) + 1):
+            slot = self._slots[(self._tick + step) % len(self._slots)]
+            if slot:
+                key = slot.pop()
+                del self._seen[key]
+                return
+
+    def seen(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """ttl 以内に同じ鍵を見ていれば True。そうでなければ今回の時刻で記録して False"""
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+        ts = self._seen.get(key)
+        if ts is not None:
+            if now - ts < self.ttl:
+                return True
+            self._slot(ts).discard(key)
+        self._seen[key] = now
+        self._slot(now).add(key)
+        while len(self._seen) > self.max_entries:
+            self._evict_oldest()
+        return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+# === トークンバケット（鍵ごと）===
+class TokenBuckets:
+    """鍵ごとに burst 個まで貯まり rate 件/秒で補充。長く使われない鍵は満杯と同じなので古い順に忘れる"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = BUCKET_MAX_KEYS) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def _level(self, key: Hashable, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def available(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self._level(key, now) >= 1.0
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        tokens = self._level(key, now)
+        if tokens < 1.0:
+            return False
+        self._buckets[key] = (tokens - 1.0, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return True
+
+# === 受付制御 ===
+Item = Tuple[str, Any]  # (本文, 元メッセージなど)
+Handler = Callable[[str, List[Item]], Awaitable[None]]
+
+class AdmissionController:
+    """
+    offer() で受付判定し、通ったものは handler(チャンネル, [(本文, 元メッセージ)...]) をタスクで実行する
+    同じチャンネルが処理中、または全体の同時実行数が max_in_flight に達しているときは
+    coalesce モードなら保留して、空いた時点で保留分をまとめて1回で渡す（drop モードなら捨てる）
+    Discordのイベントループ上だけで使う前提（ロックなし）
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        dedup_ttl: float = DEDUP_TTL,
+        channel_rate: float = CHANNEL_RATE,
+        channel_burst: float = CHANNEL_BURST,
+        user_rate: float = USER_RATE,
+        user_burst: float = USER_BURST,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        mode: str = MODE,
+        coalesce_max: int = COALESCE_MAX
+    ) -> None:
+        self.handler = handler
+        self.dedup = TTLDedup(dedup_ttl)
+        self.channel_buckets = TokenBuckets(channel_rate, channel_burst)
+        self.user_buckets = TokenBuckets(user_rate, user_burst)
+        self.max_in_flight = max(1, max_in_flight)
+        self.mode = mode if mode in ("coalesce", "drop") else "coalesce"
+        self.coalesce_max = max(1, coalesce_max)
+        self._busy: Set[str] = set()
+        self._pending: Dict[str, List[Item]] = {}
+        self._waiting: Deque[str] = deque()  # 保留があり、空き待ちのチャンネル
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self.counters = {ADMITTED: 0, DUPLICATE: 0, RATE_LIMITED: 0, COALESCED: 0, DROPPED: 0, "batches": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._busy)
+
+    def offer(self, channel: str, user: Hashable, content: str, payload: Any = None) -> str:
+        """受付結果（admitted / duplicate / rate_limited / coalesced / dropped）を返す"""
+        if self.dedup.seen(content):
+            return self._count(DUPLICATE)
+        now = time.monotonic()
+        if not (self.user_buckets.available(user, now) and self.channel_buckets.available(channel, now)):
+            return self._count(RATE_LIMITED)
+        self.user_buckets.take(user, now)
+        self.channel_buckets.take(channel, now)
+        item = (content, payload)
+        if channel not in self._busy and self.in_flight < self.max_in_flight:
+            self._start(channel, self._pending.pop(channel, []) + [item])
+            return self._count(ADMITTED)
+        if self.mode == "drop":
+            return self._count(DROPPED)
+        pending = self._pending.setdefault(channel, [])
+        pending.append(item)
+        if len(pending) > self.coalesce_max:
+            del pending[0]
+            self.counters[DROPPED] += 1
+        if channel not in self._busy and channel not in self._waiting:
+            self._waiting.append(channel)
+        return self._count(COALESCED)
+
+    def _count(self, decision: str) -> str:
+        self.counters[decision] += 1
+        return decision
+
+    def _start(self, channel: str, items: List[Item]) -> None:
+        self._busy.add(channel)
+        task = asyncio.ensure_future(self._run(channel, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, channel: str, items: List[Item]) -> None:
+        try:
+            while items:
+                self.counters["batches"] += 1
+                try:
+                    await self.handler(channel, items)
+                except Exception as e:
+                    print(f"[admission] 処理エラー: {e}")
+                items = self._pending.pop(channel, [])  # 処理中に届いた分をまとめて続けて処理
+        finally:
+            self._busy.discard(channel)
+            self._wake()
+
+    def _wake(self) -> None:
+        while self._waiting and self.in_flight < self.max_in_flight:
+            channel = self._waiting.popleft()
+            items = self._pending.pop(channel, None)
+            if items and channel not in self._busy:
+                self._start(channel, items)
+
+    async def drain(self) -> None:
+        """処理中・保留中のものがすべて終わるまで待つ（終了処理・計測用）"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "pending": sum(len(items) for items in self._pending.values()),
+            "dedup_entries": len(self.dedup)
+        }
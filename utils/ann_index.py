@@ -0,0 +1,335 @@
+# ann_index.py
+# 象徴層リコール用の近似最近傍索引（exact / IVF（純NumPy）/ HNSW（hnswlib, 任意））
+# すべて正規化済みベクトルの内積（= コサイン類似度）で検索する
+
+import os
+import time
+import argparse
+from abc import ABC, abstractmethod
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+import numpy as np
+from scoring import fused_scores, normalize, top_k_indices, top_k_rows
+
+ANN_BACKEND = os.getenv("ARIA_ANN_BACKEND", "exact")      # exact / ivf / hnsw
+IVF_NLIST = int(os.getenv("ARIA_ANN_NLIST", "0"))         # 0 → 件数から自動決定
+IVF_NPROBE = int(os.getenv("ARIA_ANN_NPROBE", "8"))       # 再現率とレイテンシのつまみ（IVF）
+HNSW_EF = int(os.getenv("ARIA_ANN_EF", "64"))             # 再現率とレイテンシのつまみ（HNSW）
+HNSW_M = int(os.getenv("ARIA_ANN_M", "16"))
+RERANK_OVERSAMPLE = int(os.getenv("ARIA_ANN_OVERSAMPLE", "20"))  # 加点再ランキング用の候補倍率
+
+Boosts = Union[np.ndarray, Callable[[np.ndarray], np.ndarray]]
+
+def view_limit(n: int, limit: Optional[int], *arrays: Any) -> int:
+    """
+    呼び出し側が見ている行数。索引は並行する追記で先に伸びることがあるため、
+    手元の mask / boosts（スナップショット由来）より後の行は検索対象から外す
+    """
+    sizes = [len(a) for a in arrays if isinstance(a, np.ndarray)]
+    if limit is not None:
+        sizes.append(limit)
+    return min([n] + sizes)
+
+class VectorIndex(ABC):
+    """索引の共通インターフェース（IDは追加順の連番。__len__ / add / search を実装しないサブクラスは生成時に失敗する）"""
+
+    exact = False
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def add(self, vectors: np.ndarray) -> None:
+        ...
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """コサイン類似度の上位k件（ID配列, スコア配列）"""
+
+    def sync(self, matrix: np.ndarray) -> None:
+        """追記のみの行列に追いつく（未登録の末尾行だけ追加）"""
+        if len(matrix) > len(self):
+            self.add(np.asarray(matrix[len(self):], dtype=np.float32))
+
+    def search_boosted(
+        self,
+        query: np.ndarray,
+        k: int,
+        boosts: Optional[Boosts] = None,
+        mask: Optional[np.ndarray] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        類似度 + 加点で上位k件を返す
+        近似索引では類似度上位の候補（k × RERANK_OVERSAMPLE）だけを加点して再ランキングする
+        limit（省略時は mask / boosts の長さ）以降の行は対象外
+        """
+        n = len(self)
+        if not n or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, scores = self.search(query, min(n, max(k * RERANK_OVERSAMPLE, 64)))
+        limit = view_limit(n, limit, mask, boosts)
+        if limit < n:
+            keep = ids < limit
+            ids, scores = ids[keep], scores[keep]
+        if mask is not None:
+            keep = mask[ids]
+            ids, scores = ids[keep], scores[keep]
+        if boosts is not None and ids.size:
+            scores = scores + (boosts(ids) if callable(boosts) else boosts[ids]).astype(np.float32)
+        order = top_k_indices(scores, k)
+        return ids[order], scores[order]
+
+    def search_boosted_many(
+        self,
+        queries: np.ndarray,
+        k: int,
+        boosts: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+        limit: Optional[int] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """複数クエリ (Q, D) をまとめて検索（加点はクエリ非依存の配列のみ）"""
+        return [self.search_boosted(q, k, boosts, mask, limit) for q in queries]
+
+# === 総当たり（検証用の厳密モード）===
+class ExactIndex(VectorIndex):
+    exact = True
+
+    def __init__(self, dim: int) -> None:
+        super().__init__(dim)
+        self._data = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._attached: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._attached) if self._attached is not None else self._size
+
+    def attach(self, matrix: np.ndarray) -> None:
+        """既存の正規化済み行列（memmap可）をコピーせずに参照する"""
+        self._attached = matrix
+
+    def sync(self, matrix: np.ndarray) -> None:
+        self.attach(matrix)
+
+    def add(self, vectors: np.ndarray) -> None:
+        if self._attached is not None:
+            self._data = np.array(self._attached, dtype=np.float32)
+            self._size = len(self._data)
+            self._attached = None
+        needed = self._size + len(vectors)
+        if needed > len(self._data):
+            grown = np.zeros((max(needed, 2 * len(self._data), 64), self.dim), dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:needed] = vectors
+        self._size = needed
+
+    def matrix(self) -> np.ndarray:
+        return self._attached if self._attached is not None else self._data[:self._size]
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.matrix() @ query
+        order = top_k_indices(scores, k)
+        return order, scores[order]
+
+    def search_boosted(
+        self,
+        query: np.ndarray,
+        k: int,
+        boosts: Optional[Boosts] = None,
+        mask: Optional[np.ndarray] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        n = view_limit(len(self), limit, mask, boosts)
+        if not n or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if callable(boosts):
+            boosts = boosts(np.arange(n))
+        scores = fused_scores(self.matrix()[:n], query, boosts, mask)
+        order = top_k_indices(scores, k)
+        return order, scores[order]
+
+    def search_boosted_many(
+        self,
+        queries: np.ndarray,
+        k: int,
+        boosts: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+        limit: Optional[int] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        n = view_limit(len(self), limit, mask, boosts)
+        if not n or k <= 0 or not len(queries):
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+        scores = fused_scores(self.matrix()[:n], queries, boosts, mask)
+        rows = top_k_rows(scores, k)
+        results = []
+        for row_scores, ids in zip(scores, rows):
+            ids = ids[np.isfinite(row_scores[ids])]
+            results.append((ids, row_scores[ids]))
+        return results
+
+# === IVF（純NumPy・球面k-means）===
+class IVFIndex(VectorIndex):
+    """
+    転置ファイル索引：ベクトルを最も近いセントロイドのリストに振り分け、
+    検索時は上位 nprobe 個のリストだけを総当たりする
+    学習前（件数が少ない間）は総当たり
+    """
+
+    def __init__(self, dim: int, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE) -> None:
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = max(1, nprobe)
+        self._store = ExactIndex(dim)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def _train(self) -> None:
+        data = self._store.matrix()
+        n = len(data)
+        nlist = self.nlist or int(min(4096, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(data[rng.choice(n, size=min(n, nlist * 64), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(10):
+            assign = self._assign(sample, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            filled = counts > 0
+            sums = centroids.copy()  # 空クラスタは前回のセントロイドを維持
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-8)
+        self._centroids = centroids.astype(np.float32)
+        self._lists = [[] for _ in range(nlist)]
+        self._list_arrays = [None] * nlist
+        self._insert(data, 0)
+        self._trained_size = n
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+    def _insert(self, vectors: np.ndarray, first_id: int) -> None:
+        assign = self._assign(vectors, self._centroids)
+        order = np.argsort(assign, kind="stable")
+        clusters, starts = np.unique(assign[order], return_index=True)
+        for c, group in zip(clusters, np.split(order + first_id, starts[1:])):
+            self._lists[c].extend(group.tolist())
+            self._list_arrays[c] = None
+
+    def add(self, vectors: np.ndarray) -> None:
+        first_id = len(self._store)
+        self._store.add(vectors)
+        n = len(self._store)
+        if self._centroids is None:
+            if n >= max(1024, (self.nlist or 16) * 39):
+                self._train()
+        elif n > 4 * self._trained_size:
+            self._train()  # 件数が大きく増えたらセントロイドを学習し直す
+        else:
+            self._insert(vectors, first_id)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._centroids is None:
+            return self._store.search(query, k)
+        probe = top_k_indices(self._centroids @ query, self.nprobe)
+        arrays = []
+        for c in probe:
+            if self._list_arrays[c] is None:
+                self._list_arrays[c] = np.array(self._lists[c], dtype=np.int64)
+            arrays.append(self._list_arrays[c])
+        candidates = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+        scores = self._store.matrix()[candidates] @ query
+        order = top_k_indices(scores, k)
+        return candidates[order], scores[order]
+
+# === HNSW（hnswlib がある場合のみ）===
+class HNSWIndex(VectorIndex):
+    def __init__(self, dim: int, ef: int = HNSW_EF, m: int = HNSW_M) -> None:
+        import hnswlib
+        super().__init__(dim)
+        self.ef = ef
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._index.init_index(max_elements=1024, ef_construction=200, M=m)
+        self._index.set_ef(ef)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vectors: np.ndarray) -> None:
+        needed = self._size + len(vectors)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, np.arange(self._size, needed))
+        self._size = needed
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, self._size)
+        self._index.set_ef(max(self.ef, k))
+        labels, distances = self._index.knn_query(query, k=k)
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+def create_index(dim: int, backend: Optional[str] = None) -> VectorIndex:
+    """設定された方式の索引を作成（hnswlib が無ければ IVF にフォールバック）"""
+    backend = backend or ANN_BACKEND
+    if backend == "hnsw":
+        try:
+            return HNSWIndex(dim)
+        except ImportError:
+            print("[ann_index] hnswlib が見つからないため IVF を使用")
+            backend = "ivf"
+    if backend == "ivf":
+        return IVFIndex(dim)
+    return ExactIndex(dim)
+
+def measure_recall(index: VectorIndex, matrix: np.ndarray, queries: np.ndarray, k: int = 3) -> float:
+    """総当たり結果に対する recall@k（索引の検証用）"""
+    hits = 0
+    for q in queries:
+        truth = set(top_k_indices(matrix @ q, k).tolist())
+        hits += len(truth & set(index.search(q, k)[0].tolist()))
+    return hits / (len(queries) * k) if len(queries) else 1.0
+
+# === ベンチマーク（python utils/ann_index.py --size 100000）===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ANN索引の再現率・レイテンシ計測")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    # 実際の埋め込みに近づけるため、話題クラスタの周りに散らばるデータを生成
+    centers = rng.standard_normal((max(1, args.size // 100), args.dim)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), args.size)] + 0.5 * rng.standard_normal((args.size, args.dim)).astype(np.float32)
+    data = normalize(data)
+    queries = normalize(data[rng.choice(args.size, args.queries, replace=False)] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    for name in ["exact", "ivf", "hnsw"]:
+        index = create_index(args.dim, name)
+        started = time.perf_counter()
+        index.add(data)
+        build_s = time.perf_counter() - started
+        started = time.perf_counter()
+        for q in queries:
+            index.search(q, args.k)
+        query_ms = 1000 * (time.perf_counter() - started) / args.queries
+        recall = measure_recall(index, data, queries, args.k)
+        print(f"{type(index).__name__:<10} build={build_s:.2f}s query={query_ms:.3f}ms recall@{args.k}={recall:.3f}")
+        if index.exact:
+            started = time.perf_counter()
+            index.search_boosted_many(queries, args.k)
+            batch_ms = 1000 * (time.perf_counter() - started) / args.queries
+            print(f"{'':<10} batched query={batch_ms:.3f}ms/件")
@@ -5,8 +5,12 @@ import os
 import json
 from datetime import datetime
 from typing import List, Optional, Dict, Any
+import metrics
 from vectorizer import encode_text
-from interest_growth import detect_and_update, init_interest, load_json
+from interest_growth import detect_and_update, load_interest
+from journal_index import get_journal_index
+from memory_store import get_memory_store, use_sqlite
+from term_index import get_term_index
 
 JOURNAL_PATH = os.path.abspath("memory/aria_journal.jsonl")
 INTEREST_PATH = os.path.abspath("memory/aria_interest.json")
@@ -27,6 +31,7 @@ def calculate_symbolic_score(entry: Dict[str, Any]) -> float:
     return round(min(total, 1.0), 3)
 
 # === 主記録関数 ===
+@metrics.timed("log_aria_journal")
 def log_aria_journal(
     summary: str,
     content: str,
@@ -39,7 +44,7 @@ def log_aria_journal(
     """Ariaの応答後に主観的な象徴記録を残す。"""
     try:
         vector = encode_text(content)
-        interest = load_json(INTEREST_PATH, init_interest())
+        interest = load_interest()
         inferred_topics: List[str] = []
         inferred_style: str = "neutral"
         if detect_and_update(content, interest):
@@ -58,8 +63,24 @@ def log_aria_journal(
             "meta": meta or {}
         }
         entry["symbolic_score"] = calculate_symbolic_score(entry)
+        if use_sqlite():
+            # 索引は次回照会時に journal テーブルの差分から更新される
+            emotion_vector = encode_text(" ".join(entry["emotion_tags"])) if entry["emotion_tags"] else None
+            row_id = get_memory_store().append_journal(entry, emotion_vector)
+            get_term_index().add_texts([entry["content"]], "journal_id", row_id - 1, row_id)
+            return
         os.makedirs(os.path.dirname(JOURNAL_PATH), exist_ok=True)
-        with open(JOURNAL_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(JOURNAL_PATH, "ab") as f:
+            offset = f.tell()
+            f.write(line)
     except Exception as err:
         print(f"[aria_journal] ログ記録エラー: {err}")
+        return
+    # バイナリ索引へ追記（失敗しても次回照会時に差分更新される）
+    try:
+        emotion_vector = encode_text(" ".join(entry["emotion_tags"])) if entry["emotion_tags"] else None
+        get_journal_index(JOURNAL_PATH).append_entry(entry, offset, len(line), emotion_vector)
+        get_term_index().add_texts([entry["content"]], "journal", offset, offset + len(line))
+    except Exception as err:
+        print(f"[aria_journal] 索引追記エラー: {err}")
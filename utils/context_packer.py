@@ -0,0 +1,166 @@
+# context_packer.py
+# 実際のモデルトークナイザでトークン数を数え、記憶・照射・RAG・詩的反映を優先度順にトークン予算内へ詰める
+# memory_manager（Bot側）と server.py（推論側）で共有する
+
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", os.path.abspath("model/Phi-4-mini-instruct.Q4_K_S.gguf"))
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1536"))   # プロンプト側の上限（n_ctx から応答分を引いた値）
+TOKEN_CACHE_SIZE = int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", "8192"))
+MESSAGE_OVERHEAD = 3       # <|role|> と <|end|> などテンプレート分
+MIN_TRUNCATED_TOKENS = 24  # これ未満しか残らないなら切り詰めずに省略
+
+# 優先度（先に並ぶほど先に予算を確保）
+PACK_PRIORITY = [s.strip() for s in os.getenv("CONTEXT_PACK_PRIORITY", "short_term,symbolic,rag,poetic").split(",") if s.strip()]
+TRUNCATABLE = {"symbolic", "rag", "poetic"}  # 会話履歴は途中で切らず、古いターンから落とす
+SECTION_ORDER = ["short_term", "symbolic", "rag", "poetic"]  # プロンプト上の並び
+
+Message = Dict[str, Any]
+
+# === トークナイザ ===
+_tokenize: Optional[Callable[[str], Sequence[int]]] = None
+_tokenizer_lock = threading.Lock()
+_tokenizer_loaded = False
+
+def set_tokenizer(tokenize: Optional[Callable[[str], Sequence[int]]]) -> None:
+    """トークナイザを差し替え（server.py はロード済みモデルの tokenize を渡す）"""
+    global _tokenize, _tokenizer_loaded
+    with _tokenizer_lock:
+        _tokenize = tokenize
+        _tokenizer_loaded = True
+    count_tokens.cache_clear()
+
+def _get_tokenizer() -> Optional[Callable[[str], Sequence[int]]]:
+    """語彙だけを読み込んだ llama_cpp モデルを使う（モデルが無ければ概算）"""
+    global _tokenize, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            _tokenizer_loaded = True
+            if os.path.exists(TOKENIZER_MODEL):
+                try:
+                    from llama_cpp import Llama
+                    vocab = Llama(model_path=TOKENIZER_MODEL, vocab_only=True, verbose=False)
+                    _tokenize = lambda text: vocab.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+                except Exception as e:
+                    print(f"[context_packer] トークナイザ読込エラー（概算で代用）: {e}")
+        return _tokenize
+
+def _raw_count(text: str) -> int:
+    tokenize = _get_tokenizer()
+    if tokenize is not None:
+        return len(tokenize(text))
+    return len(text.encode("utf-8")) // 3 + 1  # 概算（英語は約4字/トークン、和文は多め）
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def count_tokens(text: str) -> int:
+    """テキストのトークン数（同じ文字列の再計算はキャッシュ）"""
+    return _raw_count(text) if text else 0
+
+def message_tokens(message: Message) -> int:
+    return count_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """max_tokens に収まる最長の先頭部分（可能なら文末で切る）"""
+    if _raw_count(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _raw_count(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    sentence = cut.rsplit(".", 1)[0]
+    return sentence + "." if len(sentence) > len(cut) // 2 else cut
+
+def get_tokenizer_stats() -> Dict[str, Any]:
+    info = count_tokens.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "tokenizer": "model" if _tokenize is not None else "estimate",
+        "cache_size": info.currsize,
+        "cache_hits": info.hits,
+        "cache_misses": info.misses,
+        "hit_rate": info.hits / lookups if lookups else 0.0
+    }
+
+# === 優先度つきパッキング（Bot側）===
+last_pack_report: Dict[str, Any] = {}
+
+def pack_prompt(
+    system: Message,
+    sections: Dict[str, List[Message]],
+    user: Message,
+    budget: int = TOKEN_BUDGET,
+    priority: Optional[List[str]] = None
+) -> List[Message]:
+    """
+    system と user は必ず残し、残り予算を priority 順に各セクションへ割り当てる
+    short_term は新しいターンから詰め、入らなくなった時点でそれより古いターンを落とす
+    その他のセクションは入りきらなければ残り予算まで切り詰める
+    """
+    remaining = budget - message_tokens(system) - message_tokens(user)
+    priority = priority or PACK_PRIORITY
+    kept: Dict[str, Dict[int, Message]] = {name: {} for name in list(sections) + priority}
+    report: Dict[str, Any] = {"budget": budget, "sections": {}}
+    for name in priority:
+        items = sections.get(name) or []
+        order = range(len(items) - 1, -1, -1) if name == "short_term" else range(len(items))
+        used = dropped = 0
+        for i in order:
+            cost = message_tokens(items[i])
+            if cost <= remaining:
+                kept[name][i] = items[i]
+            elif name in TRUNCATABLE and remaining - MESSAGE_OVERHEAD >= MIN_TRUNCATED_TOKENS:
+                content = truncate_to_tokens(str(items[i].get("content", "")), remaining - MESSAGE_OVERHEAD)
+                kept[name][i] = {**items[i], "content": content}
+                cost = message_tokens(kept[name][i])
+            else:
+                dropped += 1
+                if name == "short_term":
+                    dropped += i  # これより古いターンもすべて落とす
+                    break
+                continue
+            remaining -= cost
+            used += cost
+        report["sections"][name] = {"tokens": used, "kept": len(kept[name]), "dropped": dropped}
+    report["remaining"] = remaining
+
+    prompt: List[Message] = [system]
+    for name in SECTION_ORDER + [n for n in sections if n not in SECTION_ORDER]:
+        prompt.extend(kept.get(name, {})[i] for i in sorted(kept.get(name, {})))
+    prompt.append(user)
+    last_pack_report.clear()
+    last_pack_report.update(report)
+    return prompt
+
+# === 履歴の切り詰めとPhiチャットテンプレート（server側）===
+def fit_messages(messages: List[Message], budget: int) -> List[Message]:
+    """先頭の system と最後の発話を残し、古いメッセージから落として予算内に収める"""
+    if not messages:
+        return []
+    head = [messages[0]] if messages[0].get("role") == "system" else []
+    body = messages[len(head):]
+    last = body[-1:] if body else []
+    remaining = budget - sum(message_tokens(m) for m in head + last)
+    if remaining < 0 and last:
+        overflow = truncate_to_tokens(str(last[0].get("content", "")), max(MIN_TRUNCATED_TOKENS, budget - sum(message_tokens(m) for m in head) - MESSAGE_OVERHEAD))
+        last = [{**last[0], "content": overflow}]
+        remaining = 0
+    middle: List[Message] = []
+    for message in reversed(body[:-1]):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        middle.append(message)
+        remaining -= cost
+    return head + middle[::-1] + last
+
+def render_phi(messages: List[Message]) -> str:
+    """Phi系のチャットテンプレートでプロンプト文字列を生成（末尾は応答開始タグ）"""
+    parts = [f"<|{m.get('role', 'user')}|>{m.get('content', '')}<|end|>" for m in messages]
+    return "".join(parts) + "<|assistant|>"
@@ -0,0 +1,228 @@
+# dialog_store.py
+# 対話ログの追記専用セグメントストア（一定サイズで新しいセグメントへ切替、行オフセット索引で末尾から直接シーク）
+
+import os
+import json
+import struct
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+MEMORY_DIR = os.path.abspath("memory")
+DIALOG_DIR = os.getenv("ARIA_DIALOG_DIR", os.path.join(MEMORY_DIR, "dialog"))
+SEGMENT_BYTES = int(os.getenv("ARIA_DIALOG_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+READ_CHUNK = 64  # 逆順読みで一度に読むオフセット数
+
+OFFSET = struct.Struct("<q")
+Record = Dict[str, Any]
+
+class DialogStore:
+    """
+    dialog-000001.jsonl, dialog-000002.jsonl ... に1行1レコードで追記し、
+    各セグメントの .idx に行頭オフセット（int64）を並べる
+    シーケンス番号はストア全体での通し番号（0始まり）
+    """
+
+    def __init__(self, directory: str = DIALOG_DIR, segment_bytes: int = SEGMENT_BYTES) -> None:
+        self.directory = directory
+        self.segment_bytes = max(1024, segment_bytes)
+        self.state_path = os.path.join(directory, "state.json")
+        self._lock = threading.RLock()
+        self._segments: List[Dict[str, Any]] = []  # name, first_seq, count
+        self._state: Dict[str, Any] = {"compacted_seq": -1, "legacy_imported": False}
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # === 起動時の復元 ===
+    def _paths(self, name: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, name)
+        return base + ".jsonl", base + ".idx"
+
+    def _open(self) -> None:
+        names = sorted(f[:-6] for f in os.listdir(self.directory) if f.startswith("dialog-") and f.endswith(".jsonl"))
+        first_seq = 0
+        for i, name in enumerate(names):
+            log_path, idx_path = self._paths(name)
+            count = os.path.getsize(idx_path) // OFFSET.size if os.path.exists(idx_path) else 0
+            if i == len(names) - 1:
+                count = self._repair(log_path, idx_path, count)  # 書き込み途中で落ちた場合に備え、最後のセグメントだけ検証
+            self._segments.append({"name": name, "first_seq": first_seq, "count": count})
+            first_seq += count
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    self._state.update(json.load(f))
+            except Exception as e:
+                print(f"[dialog_store] 状態読込エラー: {e}")
+
+    def _index_matches(self, log_path: str, idx_path: str, count: int) -> bool:
+        size = os.path.getsize(log_path)
+        if not count:
+            return size == 0
+        if os.path.getsize(idx_path) != count * OFFSET.size:
+            return False
+        with open(idx_path, "rb") as f:
+            f.seek(-OFFSET.size, os.SEEK_END)
+            last = OFFSET.unpack(f.read(OFFSET.size))[0]
+        with open(log_path, "rb") as f:
+            f.seek(last)
+            line = f.readline()
+        return line.endswith(b"\n") and last + len(line) == size
+
+    def _repair(self, log_path: str, idx_path: str, count: int) -> int:
+        """索引の件数とログ末尾が食い違っていれば、そのセグメントの索引だけ作り直す（途中で切れた最終行は捨てる）"""
+        if self._index_matches(log_path, idx_path, count):
+            return count
+        offsets = []
+        end = 0
+        with open(log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offsets.append(end)
+                end += len(line)
+        if end != os.path.getsize(log_path):
+            with open(log_path, "r+b") as f:
+                f.truncate(end)
+        with open(idx_path, "wb") as f:
+            f.write(b"".join(OFFSET.pack(o) for o in offsets))
+        print(f"[dialog_store] 索引を再構築: {os.path.basename(log_path)}（{len(offsets)}件）")
+        return len(offsets)
+
+    # === 書き込み ===
+    def append(self, record: Record) -> int:
+        """1レコードを追記してシーケンス番号を返す"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if not self._segments or self._active_size() >= self.segment_bytes:
+                self._roll()
+            segment = self._segments[-1]
+            log_path, idx_path = self._paths(segment["name"])
+            with open(log_path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            with open(idx_path, "ab") as f:
+                f.write(OFFSET.pack(offset))
+            segment["count"] += 1
+            return segment["first_seq"] + segment["count"] - 1
+
+    def _active_size(self) -> int:
+        log_path, _ = self._paths(self._segments[-1]["name"])
+        return os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+    def _roll(self) -> None:
+        number = int(self._segments[-1]["name"].split("-")[1]) + 1 if self._segments else 1
+        name = f"dialog-{number:06d}"
+        for path in self._paths(name):
+            open(path, "ab").close()
+        self._segments.append({"name": name, "first_seq": len(self), "count": 0})
+
+    # === 読み出し ===
+    def __len__(self) -> int:
+        with self._lock:
+            return self._segments[-1]["first_seq"] + self._segments[-1]["count"] if self._segments else 0
+
+    def _read_segment(self, segment: Dict[str, Any], start: int, stop: int) -> List[Record]:
+        """セグメント内の [start, stop) 行を、先頭オフセットへシークして連続読み"""
+        if stop <= start:
+            return []
+        log_path, idx_path = self._paths(segment["name"])
+        with open(idx_path, "rb") as f:
+            f.seek(start * OFFSET.size)
+            offset = OFFSET.unpack(f.read(OFFSET.size))[0]
+        records = []
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            for _ in range(stop - start):
+                try:
+                    records.append(json.loads(f.readline()))
+                except Exception as e:
+                    print(f"[dialog_store] 行読込エラー: {e}")
+                    records.append({})
+        return records
+
+    def read_range(self, start: int, stop: Optional[int] = None) -> List[Tuple[int, Record]]:
+        """シーケンス番号 [start, stop) のレコード"""
+        with self._lock:
+            segments = [dict(s) for s in self._segments]
+        stop = len(self) if stop is None else stop
+        result = []
+        for segment in segments:
+            lo = max(start, segment["first_seq"])
+            hi = min(stop, segment["first_seq"] + segment["count"])
+            if lo < hi:
+                records = self._read_segment(segment, lo - segment["first_seq"], hi - segment["first_seq"])
+                result.extend(zip(range(lo, hi), records))
+        return result
+
+    def iter_reverse(self, stop_seq: int = -1) -> Iterator[Tuple[int, Record]]:
+        """末尾から新しい順に (seq, record) を返す（seq <= stop_seq に達したら終了）"""
+        with self._lock:
+            segments = [dict(s) for s in self._segments]
+        for segment in reversed(segments):
+            hi = segment["count"]
+            while hi > 0:
+                lo = max(0, hi - READ_CHUNK, stop_seq + 1 - segment["first_seq"])
+                if lo >= hi:
+                    return
+                records = self._read_segment(segment, lo, hi)
+                for i in range(len(records) - 1, -1, -1):
+                    yield segment["first_seq"] + lo + i, records[i]
+                hi = lo
+
+    def tail(self, n: int) -> List[Record]:
+        """最新 n 件（古い順）"""
+        records = []
+        for _, record in self.iter_reverse():
+            if len(records) >= n:
+                break
+            records.append(record)
+        return records[::-1]
+
+    # === 圧縮済み位置などの状態 ===
+    @property
+    def compacted_seq(self) -> int:
+        return int(self._state.get("compacted_seq", -1))
+
+    def set_state(self, **values: Any) -> None:
+        with self._lock:
+            self._state.update(values)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+
+    def import_legacy(self, path: str) -> int:
+        """
+        旧 dialog_log.jsonl を一度だけ取り込む（元ファイルは残す）
+        {"user", "aria"} 形式と、role/content の1発話1行形式の両方に対応
+        """
+        if self._state.get("legacy_imported") or not os.path.exists(path):
+            return 0
+        imported = 0
+        pending: Optional[Dict[str, Any]] = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except Exception:
+                    continue
+                if "user" in entry or "aria" in entry:
+                    self.append(entry)
+                    imported += 1
+                elif entry.get("role") == "user":
+                    if pending:
+                        self.append(pending)
+                        imported += 1
+                    pending = {"id": "", "timestamp": entry.get("timestamp"), "user": entry.get("content", ""), "aria": "", "topic": ""}
+                elif entry.get("role") == "assistant":
+                    record = pending or {"id": "", "timestamp": entry.get("timestamp"), "user": "", "topic": ""}
+                    record["aria"] = entry.get("content", "")
+                    self.append(record)
+                    imported += 1
+                    pending = None
+        if pending:
+            self.append(pending)
+            imported += 1
+        self.set_state(legacy_imported=True)
+        print(f"[dialog_store] 旧ダイアログログを取り込み: {imported}件")
+        return imported
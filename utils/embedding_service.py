@@ -0,0 +1,149 @@
+# embedding_service.py
+# vectorizerのモデル（get_model()）を1プロセス1つだけ保持し、エンコード／追記ジョブをキューで処理する常駐ワーカー
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import vectorizer
+
+MAX_BACKLOG = 1000  # 溜め込める最大ジョブ数（超過分は破棄）
+INIT_CHUNK = int(os.getenv("VECTORIZER_INIT_CHUNK", "256"))  # 未計算ベクトルを1ジョブで処理する件数（SQLiteのみ）
+INIT_RETRY = float(os.getenv("VECTORIZER_INIT_RETRY", "1.0"))  # キュー満杯で続きを投入できなかったときの再試行間隔（秒）
+
+Job = Tuple[str, Callable[[], Any], Future]
+
+class EmbeddingService:
+    """
+    単一スレッドでジョブを順次処理する埋め込みワーカー
+    呼び出し側は Future を受け取るだけで待たない（Discord応答をブロックしない）
+    """
+
+    def __init__(self, max_backlog: int = MAX_BACKLOG) -> None:
+        self._jobs: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=max_backlog)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._running_kind: Optional[str] = None
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.initialized = 0       # init で埋めたベクトル数
+        self.init_done = False
+
+    # === 起動・停止 ===
+    def start(self) -> "EmbeddingService":
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """残りのジョブを処理し終えてから停止"""
+        if self._thread is None:
+            return
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    # === ジョブ投入 ===
+    def _submit(self, kind: str, func: Callable[[], Any]) -> Future:
+        return self._enqueue(kind, func)[0]
+
+    def _enqueue(self, kind: str, func: Callable[[], Any]) -> Tuple[Future, bool]:
+        """(Future, キューに入ったか)"""
+        future: Future = Future()
+        try:
+            self._jobs.put_nowait((kind, func, future))
+        except queue.Full:
+            self.dropped += 1
+            print(f"[embedding_service] キュー満杯のため{kind}ジョブを破棄")
+            future.set_exception(RuntimeError("embedding backlog full"))
+            return future, False
+        return future, True
+
+    def submit_encode(self, text: str) -> Future:
+        """テキストをエンコード（結果は list[float]）"""
+        return self._submit("encode", lambda: vectorizer.encode_text(text))
+
+    def submit_batch_encode(self, texts: List[str]) -> Future:
+        """複数テキストを一括エンコード（結果は list[list[float]]）"""
+        return self._submit("batch_encode", lambda: vectorizer.batch_encode(texts))
+
+    def submit_append(self, text: str, emotion_score: float = 0.0) -> Future:
+        """vector_memory.json への追記（旧 --mode append サブプロセスの代替）"""
+        return self._submit("append", lambda: vectorizer.append_vector_memory(text, emotion_score))
+
+    def submit_init(self, chunk: int = INIT_CHUNK) -> Future:
+        """
+        未計算エントリのベクトル化（旧 起動時サブプロセスの代替）
+        SQLiteでは chunk 件ずつ別ジョブに分けて投入し直すので、途中に届いた encode / append は待たされない
+        （JSONは1回ごとに vector_memory.json 全体を読み書きするので分けずに1ジョブで済ませる）
+        返す Future は最初の chunk の件数
+        """
+        if not vectorizer.use_sqlite():
+            chunk = 0
+
+        def requeue() -> None:
+            if not self._enqueue("init", step)[1]:
+                print(f"[embedding_service] 初期化の続きを{INIT_RETRY}秒後に再投入")
+                timer = threading.Timer(INIT_RETRY, requeue)
+                timer.daemon = True
+                timer.start()
+
+        def step() -> int:
+            count = vectorizer.init_vector_memory(limit=chunk if chunk > 0 else None)
+            self.initialized += count
+            if chunk > 0 and count >= chunk:
+                requeue()
+            else:
+                self.init_done = True
+            return count
+        self.init_done = False
+        return self._submit("init", step)
+
+    # === 状態確認 ===
+    def backlog(self) -> Dict[str, Any]:
+        return {
+            "queued": self._jobs.qsize(),
+            "running": self._running_kind,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "initialized": self.initialized,
+            "init_done": self.init_done,
+            "alive": bool(self._thread and self._thread.is_alive())
+        }
+
+    # === ワーカーループ ===
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            kind, func, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._running_kind = kind
+            try:
+                future.set_result(func())
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[embedding_service] {kind}ジョブエラー: {e}")
+                future.set_exception(e)
+            finally:
+                self._running_kind = None
+
+# === プロセス内シングルトン ===
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+def get_embedding_service() -> EmbeddingService:
+    """起動済みの共有サービスを返す（初回呼び出し時に起動）"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService().start()
+        return _service
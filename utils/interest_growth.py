@@ -4,14 +4,19 @@
 import os
 import json
 import re
+import copy
+import atexit
+import threading
 from datetime import datetime
 
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional, Set, Tuple
+from memory_store import get_memory_store, use_sqlite
 
 # 絶対パス化
 INTEREST_PATH = os.path.abspath("memory/aria_interest.json")
 SYMBOLIC_TRACE_PATH = os.path.abspath("memory/symbolic_trace.json")
+FLUSH_DELAY = float(os.getenv("ARIA_INTEREST_FLUSH_DELAY", "2.0"))  # 変更をまとめて保存するまでの秒数
 
 INCREMENT = 0.02
 MAX_SCORE = 1.0
@@ -52,51 +57,166 @@ def load_json(path: str, default: Optional[Any] = None) -> Any:
         print(f"[interest_growth] JSONロードエラー: {e}")
     return default
 
+# === 全カテゴリを1回の走査で判定する照合器 ===
+def _build_matcher() -> Tuple["re.Pattern[str]", Dict[str, Tuple[str, str]]]:
+    """
+    カテゴリごとに名前付きグループを持つ任意の先読みを並べ、位置ごとに全カテゴリを照合する
+    （同じ位置から始まる別カテゴリの語、例えば同じキーワードを持つ2カテゴリも両方拾える）
+    先頭の全カテゴリの選択は、どれにも当たらない位置を1回の照合で読み飛ばすためのもの
+    """
+    names: Dict[str, Tuple[str, str]] = {}
+    alternatives, lookaheads = [], []
+    for kind, table in (("topics", TOPIC_KEYWORDS), ("style_affinity", STYLE_KEYWORDS)):
+        for category, patterns in table.items():
+            name = f"g{len(names)}"
+            names[name] = (kind, category)
+            body = "|".join(f"(?:{p})" for p in patterns)
+            alternatives.append(f"(?:{body})")
+            lookaheads.append(f"(?:(?=(?P<{name}>{body})))?")
+    return re.compile(f"(?=(?:{'|'.join(alternatives)})){''.join(lookaheads)}", re.IGNORECASE), names
+
+_matcher, _group_names = _build_matcher()
+
+def match_categories(text: str) -> Dict[str, Set[str]]:
+    """本文に現れたトピック・スタイルのカテゴリ"""
+    hits: Dict[str, Set[str]] = {"topics": set(), "style_affinity": set()}
+    for m in _matcher.finditer(text):
+        for name, value in m.groupdict().items():
+            if value is not None:
+                kind, category = _group_names[name]
+                hits[kind].add(category)
+    return hits
+
 # 記録反映
+def merge_increments(interest: Optional[Dict[str, Any]], increments: Dict[Tuple[str, str], int]) -> Dict[str, Any]:
+    """カテゴリごとの加点回数を関心状態に足し込む（1回ずつ上限で切るのと同じ結果）"""
+    interest = interest if isinstance(interest, dict) else init_interest()
+    for (kind, category), hits in increments.items():
+        table = interest.setdefault(kind, {})
+        table[category] = min(MAX_SCORE, table.get(category, 0.5) + hits * INCREMENT)
+    interest["last_updated"] = datetime.now().isoformat()
+    return interest
+
 def detect_and_update(text: str, interest: Dict[str, Any]) -> bool:
     updated = False
-
-    for category, patterns in TOPIC_KEYWORDS.items():
-        if any(re.search(p, text, re.IGNORECASE) for p in patterns):
-            interest["topics"][category] = min(MAX_SCORE, interest["topics"].get(category, 0.5) + INCREMENT)
-            updated = True
-
-    for style, patterns in STYLE_KEYWORDS.items():
-        if any(re.search(p, text, re.IGNORECASE) for p in patterns):
-            interest["style_affinity"][style] = min(MAX_SCORE, interest["style_affinity"].get(style, 0.5) + INCREMENT)
+    for kind, categories in match_categories(text).items():
+        for category in categories:
+            interest[kind][category] = min(MAX_SCORE, interest[kind].get(category, 0.5) + INCREMENT)
             updated = True
-
     return updated
 
+# === メモリ上の関心状態（まとめて原子的に保存）===
+class InterestState:
+    """
+    関心スコアはメモリ上で更新し、最初の変更から FLUSH_DELAY 秒後に1回だけ保存する
+    保存時は保存先の最新値を読み直し、溜まった加点回数だけを足し込む（他プロセスの更新を失わない）
+    SQLiteバックエンドでは update_kv の1トランザクション、JSONでは再読込 + 一時ファイル + os.replace。終了時にも書き出す
+    """
+
+    def __init__(self, path: str = INTEREST_PATH, delay: float = FLUSH_DELAY) -> None:
+        self.path = path
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._interest: Optional[Dict[str, Any]] = None
+        self._pending: Dict[Tuple[str, str], int] = {}  # 未保存の加点回数
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self.updates = 0
+        self.flushes = 0
+
+    def _load(self) -> Dict[str, Any]:
+        if self._interest is None:
+            try:
+                data = get_memory_store().get_kv("interest") if use_sqlite() else load_json(self.path)
+            except Exception as e:
+                print(f"[interest_growth] 読込エラー: {e}")
+                data = None
+            self._interest = data if isinstance(data, dict) else init_interest()
+        return self._interest
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return copy.deepcopy(self._load())
+
+    def apply(self, texts: Iterable[Optional[str]]) -> bool:
+        with self._lock:
+            interest = self._load()
+            increments: Dict[Tuple[str, str], int] = {}
+            for text in texts:
+                if text:
+                    for kind, categories in match_categories(text).items():
+                        for category in categories:
+                            increments[(kind, category)] = increments.get((kind, category), 0) + 1
+            updated = bool(increments)
+            if updated:
+                merge_increments(interest, increments)
+                for key, hits in increments.items():
+                    self._pending[key] = self._pending.get(key, 0) + hits
+                self.updates += 1
+                self._dirty = True
+                if self._timer is None:
+                    self._timer = threading.Timer(self.delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            return updated
+
+    def flush(self) -> None:
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            pending = dict(self._pending)
+            try:
+                if use_sqlite():
+                    merged = get_memory_store().update_kv("interest", lambda current: merge_increments(current, pending))
+                else:
+                    merged = merge_increments(load_json(self.path), pending)
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump(merged, f, ensure_ascii=False, indent=2)
+                    os.replace(tmp_path, self.path)
+                self._interest = merged  # 他プロセスの更新も取り込んだ値に置き換える
+                self._pending = {}
+                self._dirty = False
+                self.flushes += 1
+            except Exception as e:
+                print(f"[interest_growth] 保存エラー: {e}")
+
+_state: Optional[InterestState] = None
+_state_lock = threading.Lock()
+
+def get_interest_state() -> InterestState:
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = InterestState()
+            atexit.register(_state.flush)
+        return _state
+
+def load_interest() -> Dict[str, Any]:
+    """現在の関心状態のコピー"""
+    return get_interest_state().snapshot()
+
+# 象徴層ログの最新行（ファイルが変わったときだけ読み直す）
+_trace_cache: Dict[str, Any] = {"stamp": None, "content": ""}
+
+def _latest_symbolic() -> str:
+    try:
+        st = os.stat(SYMBOLIC_TRACE_PATH)
+    except OSError:
+        return ""
+    stamp = (st.st_mtime_ns, st.st_size)
+    if stamp != _trace_cache["stamp"]:
+        symbolic = load_json(SYMBOLIC_TRACE_PATH, [])
+        latest = symbolic[-1] if isinstance(symbolic, list) and symbolic else {}
+        _trace_cache.update(stamp=stamp, content=latest.get("content", "") if isinstance(latest, dict) else "")
+    return _trace_cache["content"]
+
 # メイン処理
 def update_interest(text: Optional[str] = None) -> bool:
-    interest = load_json(INTEREST_PATH, init_interest())
-    updated = False
-
-    # ユーザー入力
-    if text:
-        updated |= detect_and_update(text, interest)
-
-    # 象徴層ログ
-    symbolic = load_json(SYMBOLIC_TRACE_PATH, [])
-    if isinstance(symbolic, list) and symbolic:
-        latest = symbolic[-1]
-        content = latest.get("content", "")
-        if content:
-            updated |= detect_and_update(content, interest)
-
-    # 保存
-    if updated:
-        interest["last_updated"] = datetime.now().isoformat()
-        try:
-            os.makedirs(os.path.dirname(INTEREST_PATH), exist_ok=True)
-            with open(INTEREST_PATH, "w", encoding="utf-8") as f:
-                json.dump(interest, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[interest_growth] 保存エラー: {e}")
-        return True
-
-    return False
+    # ユーザー入力 + 象徴層ログ
+    return get_interest_state().apply([text, _latest_symbolic()])
 
 # テスト実行
 if __name__ == "__main__":
@@ -0,0 +1,353 @@
+# journal_index.py
+# aria_journal.jsonl のベクトル・メタ情報をバイナリ索引（memmap）として保持し、JSONを解析せずに照会する
+
+import os
+import sys
+import glob
+import json
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from vectorizer import batch_encode
+from ann_index import VectorIndex, create_index
+from scoring import normalize
+from memory_store import MemoryStore, from_blob, get_memory_store, use_sqlite
+
+JOURNAL_PATH = os.path.abspath("memory/aria_journal.jsonl")
+
+# スタイルは1バイトのコードで保持（未知のスタイルは0）
+STYLE_CODES = {"unknown": 0, "neutral": 1, "poetic": 2, "logical": 3, "metaphorical": 4, "questioning": 5}
+
+META_DTYPE = np.dtype([
+    ("offset", "<i8"),          # jsonl内の行頭バイト位置
+    ("length", "<i4"),          # 行のバイト長
+    ("symbolic_score", "<f4"),
+    ("style", "u1"),
+    ("poetic_mode", "?"),       # meta.poetic_mode
+    ("has_emotion", "?")
+])
+
+class JournalIndex:
+    """
+    ジャーナルのサイドカー索引
+      *.vec.f32  : 正規化済み本文ベクトル（count × dim）
+      *.emo.f32  : 正規化済み感情タグベクトル（タグなしはゼロ行）
+      *.meta.bin : META_DTYPE の固定長レコード
+      *.idx.json : 次元・件数・索引済みジャーナルのバイト数・世代
+    再構築のたびに世代を上げて別名のファイル（*.g{世代}.vec.f32 など）へ書き直す
+    （呼び出し側のスナップショットが古い世代を memmap したままでも、削除・切り詰めをしなくて済む）
+    """
+
+    def __init__(self, journal_path: str = JOURNAL_PATH) -> None:
+        self.base = os.path.splitext(journal_path)[0]
+        self.journal_path = journal_path
+        self.header_path = self.base + ".idx.json"
+        self._lock = threading.Lock()
+        self.dim = 0
+        self.count = 0
+        self.journal_bytes = 0
+        self.generation = 0
+        self._view: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._ann: Optional[VectorIndex] = None
+        self._load_header()
+        self._set_paths()
+        self._remove_stale()
+
+    def _set_paths(self) -> None:
+        suffix = f".g{self.generation}" if self.generation else ""  # 世代0は従来のファイル名
+        self.vec_path = self.base + suffix + ".vec.f32"
+        self.emo_path = self.base + suffix + ".emo.f32"
+        self.meta_path = self.base + suffix + ".meta.bin"
+
+    def _remove_stale(self) -> None:
+        """現世代以外の索引ファイルを削除（まだ memmap されているものは次の機会に回す）"""
+        current = {self.vec_path, self.emo_path, self.meta_path}
+        for ext in (".vec.f32", ".emo.f32", ".meta.bin"):
+            for path in [self.base + ext] + glob.glob(glob.escape(self.base) + ".g*" + ext):
+                if path in current or not os.path.exists(path):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # === ヘッダ ===
+    def _load_header(self) -> None:
+        try:
+            if os.path.exists(self.header_path):
+                with open(self.header_path, "r", encoding="utf-8") as f:
+                    header = json.load(f)
+                self.dim = int(header.get("dim", 0))
+                self.count = int(header.get("count", 0))
+                self.journal_bytes = int(header.get("journal_bytes", 0))
+                self.generation = int(header.get("generation", 0))
+        except Exception as e:
+            print(f"[journal_index] ヘッダ読込エラー: {e}")
+            self.dim = self.count = self.journal_bytes = 0
+
+    def _save_header(self) -> None:
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self.count, "journal_bytes": self.journal_bytes, "generation": self.generation}, f)
+        os.replace(tmp_path, self.header_path)
+
+    # === 書き込み ===
+    def _reset(self) -> None:
+        """次の世代の空の索引に切り替える（旧世代のファイルは消せれば消す）"""
+        self._view = None
+        self._ann = None
+        self.dim = self.count = self.journal_bytes = 0
+        self.generation += 1
+        self._set_paths()
+        self._remove_stale()
+        try:
+            self._save_header()
+        except OSError as e:
+            print(f"[journal_index] ヘッダ保存エラー: {e}")
+
+    def _write_rows(self, rows: List[Tuple[Dict[str, Any], int, int]], emotion_vectors: Dict[str, List[float]]) -> None:
+        vecs, emos, metas = [], [], []
+        for entry, offset, length in rows:
+            vec = np.asarray(entry.get("vector") or [], dtype=np.float32)
+            if vec.size == 0:
+                continue
+            if not self.dim:
+                self.dim = int(vec.size)
+            if vec.size != self.dim:
+                continue
+            tags = " ".join(entry.get("emotion_tags") or [])
+            emo = np.asarray(emotion_vectors.get(tags) or [], dtype=np.float32) if tags else np.zeros(0, dtype=np.float32)
+            has_emotion = emo.size == self.dim
+            vecs.append(normalize(vec))
+            emos.append(normalize(emo) if has_emotion else np.zeros(self.dim, dtype=np.float32))
+            metas.append((
+                offset, length, float(entry.get("symbolic_score", 0.0)),
+                STYLE_CODES.get(entry.get("style") or "unknown", 0),
+                bool((entry.get("meta") or {}).get("poetic_mode")), has_emotion
+            ))
+        if vecs:
+            # 中断で残った不完全な末尾を切り詰めてから追記（切り詰めはマップを外してから。外せなければ refresh が次の世代で作り直す）
+            for path, row_bytes, data in (
+                (self.vec_path, self.dim * 4, np.stack(vecs).astype(np.float32)),
+                (self.emo_path, self.dim * 4, np.stack(emos).astype(np.float32)),
+                (self.meta_path, META_DTYPE.itemsize, np.array(metas, dtype=META_DTYPE))
+            ):
+                with open(path, "ab") as f:
+                    if f.tell() != self.count * row_bytes:
+                        self._view = None
+                        self._ann = None
+                        f.truncate(self.count * row_bytes)
+                    f.write(data.tobytes())
+            self.count += len(vecs)
+        self._view = None
+
+    def _index_range(self, start: int) -> None:
+        """ジャーナルの start バイト目以降を読み、索引へ追加"""
+        rows: List[Tuple[Dict[str, Any], int, int]] = []
+        with open(self.journal_path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # 書き込み途中の行は次回に回す
+                try:
+                    rows.append((json.loads(raw), offset, len(raw)))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    pass
+                offset += len(raw)
+        tag_texts = sorted({" ".join(e.get("emotion_tags") or []) for e, _, _ in rows if e.get("emotion_tags")})
+        emotion_vectors = dict(zip(tag_texts, batch_encode(tag_texts)))
+        self._write_rows(rows, emotion_vectors)
+        self.journal_bytes = offset
+        self._save_header()
+
+    def refresh(self) -> None:
+        """ジャーナル本体との差分だけ索引を更新（縮んだ・壊れた場合は再構築）"""
+        with self._lock:
+            size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            if size == self.journal_bytes:
+                return
+            try:
+                if size < self.journal_bytes:
+                    self._reset()
+                self._index_range(self.journal_bytes)
+            except Exception as e:
+                print(f"[journal_index] 索引更新エラー: {e}")
+                self._reset()
+
+    def rebuild(self) -> int:
+        with self._lock:
+            self._reset()
+        self.refresh()
+        return self.count
+
+    def append_entry(self, entry: Dict[str, Any], offset: int, length: int, emotion_vector: Optional[List[float]] = None) -> None:
+        """log_aria_journal が書いた1行を索引に追加（取りこぼしがあれば差分更新）"""
+        with self._lock:
+            if offset == self.journal_bytes:
+                try:
+                    tags = " ".join(entry.get("emotion_tags") or [])
+                    self._write_rows([(entry, offset, length)], {tags: emotion_vector or []})
+                    self.journal_bytes = offset + length
+                    self._save_header()
+                    return
+                except Exception as e:
+                    print(f"[journal_index] 索引追記エラー: {e}")
+        self.refresh()
+
+    # === 読み出し ===
+    def snapshot(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """(本文ベクトル, 感情ベクトル, メタ) の memmap ビュー。空なら None"""
+        self.refresh()
+        with self._lock:
+            if not self.count or not self.dim:
+                return None
+            if self._view is None or len(self._view[2]) != self.count:
+                self._view = (
+                    np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)),
+                    np.memmap(self.emo_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)),
+                    np.memmap(self.meta_path, dtype=META_DTYPE, mode="r", shape=(self.count,))
+                )
+            return self._view
+
+    def ann(self) -> Optional[VectorIndex]:
+        """本文ベクトルの近傍索引（新しい行だけ逐次追加）"""
+        view = self.snapshot()
+        if view is None:
+            return None
+        with self._lock:
+            if self._ann is None or self._ann.dim != self.dim or len(self._ann) > len(view[0]):
+                self._ann = create_index(self.dim)
+            self._ann.sync(view[0])
+            return self._ann
+
+    def load_entries(self, rows: List[int]) -> List[Dict[str, Any]]:
+        """指定行のジャーナルエントリだけをオフセットから読み出す"""
+        view = self.snapshot()
+        if view is None:
+            return []
+        meta = view[2]
+        entries: List[Dict[str, Any]] = []
+        try:
+            with open(self.journal_path, "rb") as f:
+                for row in rows:
+                    f.seek(int(meta[row]["offset"]))
+                    entries.append(json.loads(f.read(int(meta[row]["length"]))))
+        except Exception as e:
+            print(f"[journal_index] エントリ読込エラー: {e}")
+        return entries
+
+class SQLiteJournalIndex(JournalIndex):
+    """
+    ARIA_MEMORY_BACKEND=sqlite 用：journal テーブルのベクトルBLOBからメモリ上に索引を作る
+    meta の offset にはテーブルの id を入れる（サイドカーファイルは使わない）
+    """
+
+    def __init__(self, store: MemoryStore) -> None:
+        self.store = store
+        self.journal_path = store.path
+        self._lock = threading.Lock()
+        self._view = None
+        self._ann = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.dim = self.count = self.last_id = 0
+        self._vecs = self._emos = np.zeros((0, 0), dtype=np.float32)
+        self._meta = np.zeros(0, dtype=META_DTYPE)
+        self._view = None
+        self._ann = None
+
+    def _grow(self, needed: int) -> None:
+        if needed <= len(self._meta):
+            return
+        size = max(needed, 2 * len(self._meta), 64)
+        for name in ("_vecs", "_emos"):
+            grown = np.zeros((size, self.dim), dtype=np.float32)
+            if self.count:
+                grown[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, grown)
+        meta = np.zeros(size, dtype=META_DTYPE)
+        meta[:self.count] = self._meta[:self.count]
+        self._meta = meta
+
+    def refresh(self) -> None:
+        with self._lock:
+            try:
+                rows = self.store.journal_since(self.last_id)
+            except Exception as e:
+                print(f"[journal_index] 索引更新エラー: {e}")
+                return
+            if not rows:
+                return
+            vecs, emos, metas = [], [], []
+            for row_id, style, score, poetic_mode, vector, emotion_vector in rows:
+                vec = from_blob(vector)
+                if vec.size == 0 or (self.dim and vec.size != self.dim):
+                    continue
+                self.dim = self.dim or int(vec.size)
+                emo = from_blob(emotion_vector)
+                has_emotion = emo.size == self.dim
+                vecs.append(normalize(vec))
+                emos.append(normalize(emo) if has_emotion else np.zeros(self.dim, dtype=np.float32))
+                metas.append((row_id, 0, float(score or 0.0), STYLE_CODES.get(style or "unknown", 0), bool(poetic_mode), has_emotion))
+            self.last_id = int(rows[-1][0])
+            if vecs:
+                self._grow(self.count + len(vecs))
+                end = self.count + len(vecs)
+                self._vecs[self.count:end] = np.stack(vecs)
+                self._emos[self.count:end] = np.stack(emos)
+                self._meta[self.count:end] = np.array(metas, dtype=META_DTYPE)
+                self.count = end
+                self._view = None
+
+    def rebuild(self) -> int:
+        with self._lock:
+            self._reset()
+        self.refresh()
+        return self.count
+
+    def append_entry(self, entry: Dict[str, Any], offset: int, length: int, emotion_vector: Optional[List[float]] = None) -> None:
+        self.refresh()
+
+    def snapshot(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        self.refresh()
+        with self._lock:
+            if not self.count or not self.dim:
+                return None
+            if self._view is None:
+                self._view = (self._vecs[:self.count], self._emos[:self.count], self._meta[:self.count])
+            return self._view
+
+    def load_entries(self, rows: List[int]) -> List[Dict[str, Any]]:
+        view = self.snapshot()
+        if view is None:
+            return []
+        try:
+            return self.store.load_journal([int(view[2][row]["offset"]) for row in rows])
+        except Exception as e:
+            print(f"[journal_index] エントリ読込エラー: {e}")
+            return []
+
+# === プロセス内で共有する索引 ===
+_indexes: Dict[str, JournalIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_journal_index(journal_path: str = JOURNAL_PATH) -> JournalIndex:
+    """SQLiteバックエンドでは journal_path に関わらず journal テーブルの索引を返す"""
+    key = "sqlite" if use_sqlite() else journal_path
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = SQLiteJournalIndex(get_memory_store()) if use_sqlite() else JournalIndex(journal_path)
+        return _indexes[key]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="aria_journal.jsonl のバイナリ索引を再構築")
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    args = parser.parse_args()
+    if not use_sqlite() and not os.path.exists(args.journal):
+        print(f"❌ ジャーナルがありません: {args.journal}")
+        sys.exit(1)
+    print(f"✅ 索引再構築：{get_journal_index(args.journal).rebuild()}件")
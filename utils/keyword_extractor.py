@@ -0,0 +1,165 @@
+# keyword_extractor.py
+# YAKE によるキーワード抽出（言語ごとに抽出器を使い回し、同じ入力は結果を再利用、大量の過去ログはプロセスプールで一括処理）
+
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from yake import KeywordExtractor
+
+MEMORY_DIR = os.path.abspath("memory")
+PREINDEX_STATE_PATH = os.path.join(MEMORY_DIR, "keyword_preindex.json")
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "4096"))
+KEYWORD_WORKERS = int(os.getenv("KEYWORD_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+POOL_THRESHOLD = int(os.getenv("KEYWORD_POOL_THRESHOLD", "64"))  # これ未満の件数ならプロセスを起こさない
+NGRAM = 2
+TOP = 3
+
+_CJK = re.compile(r"[　-鿿]")
+
+def detect_language(text: str) -> str:
+    return "ja" if _CJK.search(text) else "en"
+
+# === 抽出器の使い回し（スレッドごと・言語ごと）===
+_local = threading.local()
+
+def _get_extractor(lang: str, n: int, top: int) -> KeywordExtractor:
+    extractors: Optional[Dict[Tuple[str, int, int], KeywordExtractor]] = getattr(_local, "extractors", None)
+    if extractors is None:
+        extractors = _local.extractors = {}
+    key = (lang, n, top)
+    if key not in extractors:
+        extractors[key] = KeywordExtractor(lan=lang, n=n, top=top)
+    return extractors[key]
+
+def _extract(text: str, lang: Optional[str] = None, n: int = NGRAM, top: int = TOP) -> List[str]:
+    lang = lang or detect_language(text)
+    return [kw[0] for kw in _get_extractor(lang, n, top).extract_keywords(text)]
+
+# === 結果のメモ化（LRU）===
+_memo: "OrderedDict[Tuple[str, Optional[str], int, int], List[str]]" = OrderedDict()
+_memo_lock = threading.Lock()
+_memo_stats = {"hits": 0, "misses": 0}
+
+def _memo_get(key: Tuple[str, Optional[str], int, int]) -> Optional[List[str]]:
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            _memo_stats["hits"] += 1
+            return list(_memo[key])
+        _memo_stats["misses"] += 1
+        return None
+
+def _memo_put(key: Tuple[str, Optional[str], int, int], keywords: List[str]) -> None:
+    with _memo_lock:
+        _memo[key] = list(keywords)
+        _memo.move_to_end(key)
+        while len(_memo) > KEYWORD_CACHE_SIZE:
+            _memo.popitem(last=False)
+
+def extract_keywords(text: str, lang: Optional[str] = None, n: int = NGRAM, top: int = TOP) -> List[str]:
+    key = (text.strip(), lang, n, top)
+    cached = _memo_get(key)
+    if cached is not None:
+        return cached
+    keywords = _extract(key[0], lang, n, top)
+    _memo_put(key, keywords)
+    return keywords
+
+def _extract_chunk(args: Tuple[List[str], Optional[str], int, int]) -> List[List[str]]:
+    texts, lang, n, top = args
+    return [_extract(text, lang, n, top) for text in texts]
+
+def extract_keywords_batch(
+    texts: List[str],
+    lang: Optional[str] = None,
+    n: int = NGRAM,
+    top: int = TOP,
+    workers: int = KEYWORD_WORKERS
+) -> List[List[str]]:
+    """
+    まとめて抽出（重複は1回だけ・メモ済みは再利用）
+    未処理が POOL_THRESHOLD 件以上あればプロセスプールへ分配する
+    """
+    keys = [(text.strip(), lang, n, top) for text in texts]
+    results: Dict[Tuple[str, Optional[str], int, int], List[str]] = {}
+    pending: List[Tuple[str, Optional[str], int, int]] = []
+    for key in dict.fromkeys(keys):
+        cached = _memo_get(key)
+        if cached is None:
+            pending.append(key)
+        else:
+            results[key] = cached
+    if pending:
+        pending_texts = [key[0] for key in pending]
+        if workers > 1 and len(pending) >= POOL_THRESHOLD:
+            size = max(1, len(pending_texts) // (workers * 4))
+            chunks = [(pending_texts[i:i + size], lang, n, top) for i in range(0, len(pending_texts), size)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                extracted = [kws for chunk in pool.map(_extract_chunk, chunks) for kws in chunk]
+        else:
+            extracted = _extract_chunk((pending_texts, lang, n, top))
+        for key, keywords in zip(pending, extracted):
+            _memo_put(key, keywords)
+            results[key] = keywords
+    return [list(results[key]) for key in keys]
+
+def get_keyword_stats() -> Dict[str, float]:
+    with _memo_lock:
+        total = _memo_stats["hits"] + _memo_stats["misses"]
+        return {**_memo_stats, "size": len(_memo), "hit_rate": _memo_stats["hits"] / total if total else 0.0}
+
+# === 過去の対話からの事前照射（オフライン）===
+def preindex_dialog(workers: int = KEYWORD_WORKERS, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    前回以降の対話ターンからキーワードを一括抽出し、未知語の照射結果を RAG の応答キャッシュへ先に入れておく
+    処理済みの位置は keyword_preindex.json に残す
+    """
+    from memory_core import get_dialog_store
+    from rag_engine import are_new_terms, get_rag_engine, sources_for
+
+    state = {"seq": 0}
+    if os.path.exists(PREINDEX_STATE_PATH):
+        with open(PREINDEX_STATE_PATH, "r", encoding="utf-8") as f:
+            state.update(json.load(f))
+    store = get_dialog_store()
+    stop = len(store) if limit is None else min(len(store), state["seq"] + limit)
+    rows = store.read_range(state["seq"], stop)
+    texts = [entry.get("user", "") for _, entry in rows if entry.get("user")]
+    keywords = sorted({kw for kws in extract_keywords_batch(texts, workers=workers) for kw in kws})
+    new_terms = [kw for kw, is_new in zip(keywords, are_new_terms(keywords)) if is_new]
+
+    engine = get_rag_engine()
+
+    async def prefetch() -> int:
+        results = await asyncio.gather(*(engine.fetch(source, word) for word in new_terms for source in sources_for(word)))
+        return sum(1 for summary, _ in results if summary)
+
+    found = engine.run(prefetch()) if new_terms else 0
+    os.makedirs(MEMORY_DIR, exist_ok=True)
+    with open(PREINDEX_STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump({"seq": stop}, f)
+    return {"turns": len(texts), "keywords": len(keywords), "new_terms": len(new_terms), "cached_summaries": found}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="キーワード抽出 / 過去対話の事前照射")
+    parser.add_argument("--preindex", action="store_true", help="対話ログの未処理分を一括抽出し、RAG応答キャッシュを温める")
+    parser.add_argument("--workers", type=int, default=KEYWORD_WORKERS)
+    parser.add_argument("--limit", type=int, default=None, help="1回に処理する最大ターン数")
+    parser.add_argument("text", nargs="*")
+    args = parser.parse_args()
+    if args.preindex:
+        counts = preindex_dialog(args.workers, args.limit)
+        print("✅ 事前照射：" + "、".join(f"{k}={v}" for k, v in counts.items()))
+    elif args.text:
+        print(extract_keywords(" ".join(args.text)))
+    else:
+        for line in sys.stdin:
+            print(json.dumps(extract_keywords(line), ensure_ascii=False))
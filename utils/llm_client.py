@@ -0,0 +1,195 @@
+# llm_client.py
+# LLMサーバー（/v1/chat/completions）への非同期クライアント：接続プール・同時実行上限・タイムアウト・再試行
+
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "180"))         # 1リクエストあたりの上限秒数
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "1.0"))         # 再試行の初期待機秒数（指数的に増加）
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMError(RuntimeError):
+    pass
+
+class LLMClient:
+    """
+    Discordのイベントループを塞がずにLLMへ問い合わせるクライアント
+    セッションは最初の呼び出し時に作成し、keep-alive接続を使い回す
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+        retries: int = LLM_RETRIES,
+        backoff: float = LLM_BACKOFF
+    ) -> None:
+        self.url = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._latency_total = 0.0
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _check_status(self, resp: aiohttp.ClientResponse, attempt: int) -> None:
+        """再試行対象のステータスなら LLMError（Retry-After を保持）"""
+        if resp.status in RETRY_STATUSES and attempt < self.retries:
+            error = LLMError(f"HTTP {resp.status}")
+            retry_after = resp.headers.get("Retry-After")
+            error.retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            raise error
+        resp.raise_for_status()
+
+    async def _backoff(self, attempt: int, error: Exception) -> None:
+        if attempt >= self.retries:
+            raise LLMError(f"LLM request failed: {error}") from error
+        delay = getattr(error, "retry_after", None) or self.backoff * (2 ** attempt) * (0.5 + random.random())
+        self.retried += 1
+        print(f"[llm_client] 再試行 {attempt + 1}/{self.retries}（{delay:.1f}秒後）: {error}")
+        await asyncio.sleep(delay)
+
+    async def _post(self, session: aiohttp.ClientSession, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """再試行付きでPOSTし、JSON応答を返す"""
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.post(self.url, json=payload) as resp:
+                    self._check_status(resp, attempt)
+                    return await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, LLMError) as e:
+                await self._backoff(attempt, e)
+        raise LLMError("LLM request failed")
+
+    async def chat(self, payload: Dict[str, Any]) -> str:
+        """チャット補完を実行して応答テキストを返す"""
+        session = await self._get_session()
+        semaphore = self._semaphore
+        self.waiting += 1
+        queued = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        metrics.observe_span("llm_queue_wait", started - queued)
+        try:
+            data = await self._post(session, payload)
+            reply = data["choices"][0]["message"]["content"].strip()
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+        self.completed += 1
+        elapsed = time.perf_counter() - started
+        self._latency_total += elapsed
+        metrics.observe_span("llm_chat", elapsed)
+        tokens = data.get("usage", {}).get("completion_tokens")
+        if tokens and elapsed > 0:
+            metrics.observe("aria_llm_tokens_per_second", tokens / elapsed, "LLM応答の生成速度", metrics.TOKENS_PER_SEC_BUCKETS)
+        return reply
+
+    async def stream_chat(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        stream=True でSSEを受け取り、届いたトークン片を順に返す
+        再試行は最初のトークンが届く前に限る（途中で切れた場合はそのまま例外）
+        """
+        session = await self._get_session()
+        semaphore = self._semaphore
+        self.waiting += 1
+        queued = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        metrics.observe_span("llm_queue_wait", started - queued)
+        received = False
+        first_token_at = 0.0
+        deltas = 0
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with session.post(self.url, json={**payload, "stream": True}) as resp:
+                        self._check_status(resp, attempt)
+                        async for raw in resp.content:
+                            line = raw.decode("utf-8").strip()
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            event = json.loads(data)
+                            if "error" in event:
+                                raise LLMError(f"LLM stream error: {event['error']}")
+                            if "choices" not in event:
+                                continue  # aria_cache などのメタ情報
+                            delta = event["choices"][0].get("delta", {}).get("content", "")
+                            if delta:
+                                if not received:
+                                    first_token_at = time.perf_counter()
+                                    metrics.observe("aria_llm_time_to_first_token_seconds", first_token_at - started, "最初のトークンが届くまでの秒数")
+                                received = True
+                                deltas += 1
+                                yield delta
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, LLMError) as e:
+                    if received:
+                        raise LLMError(f"LLM stream interrupted: {e}") from e
+                    await self._backoff(attempt, e)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+        self.completed += 1
+        finished = time.perf_counter()
+        self._latency_total += finished - started
+        metrics.observe_span("llm_stream", finished - started)
+        if deltas > 1 and finished > first_token_at:
+            # 最初のトークン以降の生成速度（SSEの1イベント ≒ 1トークン）
+            metrics.observe("aria_llm_tokens_per_second", (deltas - 1) / (finished - first_token_at), "LLM応答の生成速度", metrics.TOKENS_PER_SEC_BUCKETS)
+
+    def metrics(self) -> Dict[str, Any]:
+        """待ち行列の深さ・処理中件数・平均レイテンシ"""
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_latency_s": self._latency_total / self.completed if self.completed else 0.0
+        }
@@ -4,17 +4,80 @@
 import os
 import json
 import uuid
+import textwrap
+import threading
+from collections import deque
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+from context_packer import count_tokens
+from dialog_store import DialogStore
+from memory_store import SQLiteDialogLog, get_memory_store, use_sqlite
+from term_index import get_term_index
 
 # ファイルパス定義（絶対パス化）
 MEMORY_DIR = os.path.abspath("memory")
-DIALOG_LOG = os.path.join(MEMORY_DIR, "dialog_log.jsonl")
+DIALOG_LOG = os.path.join(MEMORY_DIR, "dialog_log.jsonl")  # 旧形式（初回のみ dialog/ へ取り込む）
 EMOTION_LOG = os.path.join(MEMORY_DIR, "emotion_vec.json")
 SHORT_TERM = os.path.join(MEMORY_DIR, "short_term_memory.json")
 LONG_TERM = os.path.join(MEMORY_DIR, "compressed_memory.json")
 TTL_HALF_LIFE = 60 * 60 * 24 * 3  # 3日
 
+# === 対話ストアと短期記憶ウィンドウ ===
+_store: Optional[Union[DialogStore, SQLiteDialogLog]] = None
+_window: Deque[Tuple[int, Dict[str, Any], int]] = deque()  # (seq, entry, tokens) 古い順
+_window_tokens = 0
+_window_loaded = False
+_window_lock = threading.RLock()
+
+def get_dialog_store() -> Union[DialogStore, SQLiteDialogLog]:
+    global _store
+    with _window_lock:
+        if _store is None:
+            if use_sqlite():
+                _store = SQLiteDialogLog(get_memory_store())
+            else:
+                _store = DialogStore()
+                _store.import_legacy(DIALOG_LOG)
+        return _store
+
+def _entry_tokens(entry: Dict[str, Any]) -> int:
+    return count_tokens(entry.get("user", "")) + count_tokens(entry.get("aria", ""))
+
+def _load_window(store: DialogStore, max_tokens: int) -> None:
+    """起動後最初の1回だけ、末尾から予算分（未圧縮の範囲内）を読み込む"""
+    global _window_tokens, _window_loaded
+    for seq, entry in store.iter_reverse(stop_seq=store.compacted_seq):
+        tokens = _entry_tokens(entry)
+        if _window and _window_tokens + tokens > max_tokens:
+            break
+        _window.appendleft((seq, entry, tokens))
+        _window_tokens += tokens
+    _window_loaded = True
+
+def get_short_term() -> List[Dict[str, str]]:
+    """短期記憶（会話ターン）。ウィンドウ未読込なら保存済みのファイルを返す"""
+    with _window_lock:
+        if _window_loaded:
+            return _window_messages()
+    try:
+        if use_sqlite():
+            data = get_memory_store().get_kv("short_term", [])
+        else:
+            with open(SHORT_TERM, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        return data if isinstance(data, list) else []
+    except Exception:
+        return []
+
+def _window_messages() -> List[Dict[str, str]]:
+    messages = []
+    for _, entry, _ in _window:
+        if entry.get("user"):
+            messages.append({"role": "user", "content": entry["user"]})
+        if entry.get("aria"):
+            messages.append({"role": "assistant", "content": entry["aria"]})
+    return messages
+
 # === ダイアログと感情ログ ===
 def log_dialog(
     user_text: str,
@@ -35,9 +98,14 @@ def log_dialog(
         "aria": bot_text,
         "topic": topic or ""
     }
+    global _window_tokens
     try:
-        with open(DIALOG_LOG, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        seq = get_dialog_store().append(entry)
+        with _window_lock:
+            if _window_loaded:
+                tokens = _entry_tokens(entry)
+                _window.append((seq, entry, tokens))
+                _window_tokens += tokens
     except Exception as e:
         print(f"[memory_core] ダイアログ記録エラー: {e}")
 
@@ -50,62 +118,91 @@ def log_dialog(
         except Exception as e:
             print(f"[memory_core] 感情記録エラー: {e}")
 
-# === トークン数上限内で短期記憶を抽出し、残りを長期記憶化 ===
-def trim_memory(max_tokens: int = 2000) -> None:
+# === 長期記憶への追記 ===
+def _append_long_term(entries: List[Dict[str, Any]]) -> None:
     """
-    トークン数上限内で短期記憶を抽出し、残りを長期記憶化
+    compressed_memory.json（JSON配列）の末尾 ] の直前へ新しい要素だけを書き足す
+    既存部分は読み直さない（配列として読めない場合のみ全体を書き直す）
     """
-    if not os.path.exists(DIALOG_LOG):
+    body = ",\n".join(textwrap.indent(json.dumps(e, ensure_ascii=False, indent=2), "  ") for e in entries)
+    if not os.path.exists(LONG_TERM) or os.path.getsize(LONG_TERM) == 0:
+        with open(LONG_TERM, "w", encoding="utf-8") as f:
+            f.write("[\n" + body + "\n]")
         return
+    with open(LONG_TERM, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        end = tail.rstrip().rfind(b"]")
+        head = tail[:end].rstrip() if end >= 0 else b""
+        if end >= 0 and (head.endswith(b"}") or head.endswith(b"[")):
+            f.seek(size - len(tail) + len(head))
+            sep = b"\n" if head.endswith(b"[") else b",\n"
+            f.write(sep + body.encode("utf-8") + b"\n]")
+            f.truncate()
+            return
+    print("[memory_core] 長期記憶の末尾が配列形式でないため全体を書き直します")
+    try:
+        with open(LONG_TERM, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+    except Exception:
+        existing = []
+    with open(LONG_TERM, "w", encoding="utf-8") as f:
+        json.dump((existing if isinstance(existing, list) else []) + entries, f, ensure_ascii=False, indent=2)
+
+# === トークン数上限内で短期記憶を保持し、あふれた分だけを長期記憶化 ===
+def trim_memory(max_tokens: int = 2000) -> None:
+    """
+    短期記憶はメモリ上のウィンドウで保持し、上限からあふれた古いターンだけを長期記憶へ追記
+    圧縮済み位置（compacted_seq）より前は二度と読まないため、履歴の長さに依存しない
+    """
+    global _window_tokens
     try:
-        with open(DIALOG_LOG, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        store = get_dialog_store()
     except Exception as e:
         print(f"[memory_core] ダイアログ読込エラー: {e}")
         return
 
-    short_term, long_term = [], []
-    token_count = 0
+    with _window_lock:
+        if not _window_loaded:
+            _load_window(store, max_tokens)
+        while len(_window) > 1 and _window_tokens > max_tokens:
+            _window_tokens -= _window.popleft()[2]
+        window_start = _window[0][0] if _window else len(store)
+        short_term = _window_messages()
+        compact_from = store.compacted_seq + 1
 
-    for line in reversed(lines):
-        try:
-            entry = json.loads(line)
-            user = entry.get("user", "")
-            aria = entry.get("aria", "")
-            tokens = len(user) + len(aria)
-            if token_count + tokens <= max_tokens:
-                short_term.insert(0, {"role": "user", "content": user})
-                short_term.append({"role": "assistant", "content": aria})
-                token_count += tokens
-            else:
-                long_term.insert(0, {
-                    "id": entry.get("id", ""),
-                    "content": f"{user} / {aria}",
-                    "timestamp": entry.get("timestamp"),
-                    "topic": entry.get("topic", "")
-                })
-        except Exception as e:
-            print(f"[memory_core] 記憶分割エラー: {e}")
-            continue
+    long_term = []
+    if compact_from < window_start:
+        for _, entry in store.read_range(compact_from, window_start):
+            long_term.append({
+                "id": entry.get("id", ""),
+                "content": f"{entry.get('user', '')} / {entry.get('aria', '')}",
+                "timestamp": entry.get("timestamp"),
+                "topic": entry.get("topic", "")
+            })
 
     try:
-        with open(SHORT_TERM, "w", encoding="utf-8") as f:
-            json.dump(short_term, f, ensure_ascii=False, indent=2)
+        if use_sqlite():
+            get_memory_store().set_kv("short_term", short_term)
+        else:
+            with open(SHORT_TERM, "w", encoding="utf-8") as f:
+                json.dump(short_term, f, ensure_ascii=False, indent=2)
     except Exception as e:
         print(f"[memory_core] 短期記憶保存エラー: {e}")
 
     if long_term:
-        existing = []
-        if os.path.exists(LONG_TERM):
-            try:
-                with open(LONG_TERM, "r", encoding="utf-8") as f:
-                    existing = json.load(f)
-            except Exception as e:
-                print(f"[memory_core] 長期記憶読込エラー: {e}")
-        combined = existing + long_term
         try:
-            with open(LONG_TERM, "w", encoding="utf-8") as f:
-                json.dump(combined, f, ensure_ascii=False, indent=2)
+            contents = [e["content"] for e in long_term]
+            if use_sqlite():
+                get_memory_store().compact_dialog(long_term, window_start - 1)
+                get_term_index().add_texts(contents)
+            else:
+                start = os.path.getsize(LONG_TERM) if os.path.exists(LONG_TERM) else 0
+                _append_long_term(long_term)
+                store.set_state(compacted_seq=window_start - 1)
+                get_term_index().add_texts(contents, "long_term", start, os.path.getsize(LONG_TERM))
         except Exception as e:
             print(f"[memory_core] 長期記憶保存エラー: {e}")
 
@@ -4,15 +4,43 @@
 
 import os
 import json
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from symbolic_reflector import recall_symbolic_memories
 from poetic_reflector import generate_poetic_reflection
+from context_packer import pack_prompt
+from memory_core import get_short_term
+from memory_store import get_memory_store, use_sqlite
+import metrics
+import profiler
 from aria_journal import log_aria_journal  # �ǉ�
 
 MEMORY_DIR = os.path.abspath("memory")
 
+# 各ステージの締切（build_prompt開始からの秒数）。超過したステージは結果なしで続行
+STAGE_TIMEOUTS: Dict[str, float] = {
+    "short_term": float(os.getenv("ARIA_STAGE_TIMEOUT_SHORT_TERM", "0.5")),
+    "symbolic": float(os.getenv("ARIA_STAGE_TIMEOUT_SYMBOLIC", "3.0")),
+    "rag": float(os.getenv("ARIA_STAGE_TIMEOUT_RAG", "0.5")),
+    "poetic": float(os.getenv("ARIA_STAGE_TIMEOUT_POETIC", "3.0"))
+}
+
+STAGE_WORKERS = int(os.getenv("ARIA_STAGE_WORKERS", "2"))  # ステージごとの同時実行数（締切超過で裏に残った実行を含む）
+
+# ステージごとに別プールにして、締切を過ぎても走り続ける遅いステージが他のステージのスレッドを奪わないようにする
+_stage_pools: Dict[str, ThreadPoolExecutor] = {
+    name: ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix=f"prompt-{name}") for name in STAGE_TIMEOUTS
+}
+_stage_inflight: Dict[str, int] = {name: 0 for name in STAGE_TIMEOUTS}
+_journal_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aria-journal")  # 記録はクリティカルパス外で直列に
+_timing_lock = threading.Lock()
+last_stage_timings: Dict[str, Dict[str, Any]] = {}
+_stage_totals: Dict[str, Dict[str, float]] = {}
+
 def load_json(path: str, fallback: Optional[Any] = None) -> Any:
     try:
         if os.path.exists(path):
@@ -22,63 +50,173 @@ def load_json(path: str, fallback: Optional[Any] = None) -> Any:
         print(f"[memory_manager] JSONロードエラー: {e}")
     return fallback if fallback is not None else []
 
-# ���S�g���~���O
-def safe_trim(text: str, limit: int = 500) -> str:
-    """
-    指定文字数で安全にトリム（文末で切る）
-    """
-    return text if len(text) <= limit else text[:limit].rsplit(".", 1)[0] + "."
+# === ステージ実行・計測 ===
+def _load_rag() -> Dict[str, Any]:
+    if use_sqlite():
+        store = get_memory_store()
+        return {"rag": store.get_kv("rag_summary", {}), "origin": store.get_kv("rag_origin_trace", {})}
+    return {
+        "rag": load_json(os.path.join(MEMORY_DIR, "rag_summary.json"), {}),
+        "origin": load_json(os.path.join(MEMORY_DIR, "rag_origin_trace.json"), {})
+    }
+
+def _timed(name: str, func: Callable[[], Any]) -> Callable[[], Any]:
+    def run() -> Any:
+        started = time.perf_counter()
+        try:
+            with profiler.section(name):
+                return func()
+        finally:
+            _record_timing(name, time.perf_counter() - started)
+    return run
+
+def _submit_stage(name: str, func: Callable[[], Any]) -> Optional[Future]:
+    """ステージを投入（前回までの実行がまだ全ワーカーを占めていれば投入せず None）"""
+    with _timing_lock:
+        if _stage_inflight[name] >= STAGE_WORKERS:
+            return None
+        _stage_inflight[name] += 1
+
+    timed = _timed(name, func)
+
+    def run() -> Any:
+        try:
+            return timed()
+        finally:
+            with _timing_lock:
+                _stage_inflight[name] -= 1
+    return _stage_pools[name].submit(run)
 
-# === ���C���\���v�����v�g�\�z ===
+def _record_timing(name: str, elapsed: float, status: Optional[str] = None) -> None:
+    """status なし: 所要時間を記録 / status あり: 締切判定の結果を記録"""
+    if status is None:
+        metrics.observe_span(name, elapsed)
+    else:
+        metrics.inc("aria_stage_results_total", stage=name, status=status)
+    with _timing_lock:
+        entry = last_stage_timings.setdefault(name, {})
+        totals = _stage_totals.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "timeouts": 0, "errors": 0, "busy": 0})
+        if status is None:
+            entry["ms"] = round(1000 * elapsed, 2)
+            totals["count"] += 1
+            totals["total_ms"] += 1000 * elapsed
+            totals["max_ms"] = max(totals["max_ms"], 1000 * elapsed)
+        else:
+            entry["status"] = status
+            if status == "timeout":
+                totals["timeouts"] += 1
+            elif status == "error":
+                totals["errors"] += 1
+            elif status == "busy":
+                totals["busy"] += 1
+
+def _await_stage(name: str, future: Optional[Future], started: float, fallback: Any) -> Any:
+    """締切までに終わらなければ fallback で続行（スレッドは裏で完走させる）"""
+    if future is None:
+        _record_timing(name, 0.0, "busy")
+        print(f"[memory_manager] {name}ステージは前回の実行が終わっていないため省略")
+        return fallback
+    remaining = STAGE_TIMEOUTS.get(name, 1.0) - (time.perf_counter() - started)
+    try:
+        result = future.result(timeout=max(0.0, remaining))
+        _record_timing(name, 0.0, "ok")
+        return result
+    except FutureTimeout:
+        _record_timing(name, 0.0, "timeout")
+        print(f"[memory_manager] {name}ステージが締切超過のため省略")
+    except Exception as e:
+        _record_timing(name, 0.0, "error")
+        print(f"[memory_manager] {name}ステージエラー: {e}")
+    return fallback
+
+def get_stage_stats() -> Dict[str, Dict[str, Any]]:
+    """ステージ別の直近・累計計測値"""
+    with _timing_lock:
+        return {
+            name: {
+                "last": dict(last_stage_timings.get(name, {})),
+                "count": int(t["count"]),
+                "avg_ms": round(t["total_ms"] / t["count"], 2) if t["count"] else 0.0,
+                "max_ms": round(t["max_ms"], 2),
+                "timeouts": int(t["timeouts"]),
+                "errors": int(t["errors"]),
+                "busy": int(t["busy"])
+            }
+            for name, t in _stage_totals.items()
+        }
+
+def _log_poetic_journal(poetic: Dict[str, Any], rag: Dict[str, Any]) -> None:
+    started = time.perf_counter()
+    log_aria_journal(
+        summary="Reflection from poetic layer",
+        content=poetic["content"],
+        topics=rag.get("query", "").split() if "query" in rag else [],
+        style="poetic",
+        emotion_tags=[],
+        source="memory_manager"
+    )
+    _record_timing("journal", time.perf_counter() - started)
+
+# === メイン構文プロンプト構築 ===
+@profiler.profiled("build_prompt")
 def build_prompt(system_prompt: str, user_input: str) -> List[Dict[str, Any]]:
     """
-    プロンプトを構築（短期記憶・象徴層・RAG・詩的反映を統合）
+    プロンプトを構築（短期記憶・象徴層・RAG・詩的反映を並行取得して統合）
     """
-    prompt: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}]
+    started = time.perf_counter()
+    futures = {
+        "short_term": _submit_stage("short_term", get_short_term),
+        "symbolic": _submit_stage("symbolic", lambda: recall_symbolic_memories(user_input)),
+        "rag": _submit_stage("rag", _load_rag),
+        "poetic": _submit_stage("poetic", lambda: generate_poetic_reflection(user_input))
+    }
+
+    sections: Dict[str, List[Dict[str, Any]]] = {}
 
     # [1] 短期記憶
-    memory = load_json(os.path.join(MEMORY_DIR, "short_term_memory.json"), [])
-    prompt.extend(memory)
+    memory = _await_stage("short_term", futures["short_term"], started, [])
+    sections["short_term"] = memory if isinstance(memory, list) else []
 
     # [2] 象徴層記憶
-    reused = recall_symbolic_memories(user_input)
+    reused = _await_stage("symbolic", futures["symbolic"], started, [])
+    sections["symbolic"] = []
     for entry in reused:
         content = entry.get("content") or entry.get("text")
         if content:
-            prompt.append({
+            sections["symbolic"].append({
                 "role": "assistant",
                 "content": f"[Symbolic Echo]\n{content}"
             })
 
-    # [3] RAG要約
-    rag = load_json(os.path.join(MEMORY_DIR, "rag_summary.json"), {})
-    origin = load_json(os.path.join(MEMORY_DIR, "rag_origin_trace.json"), {})
+    # [3] RAG要約（長さはトークン予算に合わせて packer が切り詰める）
+    loaded = _await_stage("rag", futures["rag"], started, {"rag": {}, "origin": {}})
+    rag, origin = loaded["rag"], loaded["origin"]
+    sections["rag"] = []
     if isinstance(rag, dict) and isinstance(origin, dict):
-        summary = safe_trim(rag.get("summary", ""), limit=500)
+        summary = rag.get("summary", "")
         source = origin.get("source", "")
         if summary:
-            prompt.append({
+            sections["rag"].append({
                 "role": "assistant",
                 "content": f"[Knowledge Reference]\n{summary}\n\n出典: <{source}>"
             })
 
     # [4] 詩的リフレクション
-    poetic = generate_poetic_reflection()
-    if poetic:
-        prompt.append(poetic)
+    poetic = _await_stage("poetic", futures["poetic"], started, None)
+    sections["poetic"] = [poetic] if poetic else []
 
-    # [5] ユーザー入力
-    prompt.append({"role": "user", "content": user_input})
+    # [5] トークン予算内に優先度順で詰める（system とユーザー入力は必ず残す）
+    pack_started = time.perf_counter()
+    prompt = pack_prompt(
+        {"role": "system", "content": system_prompt},
+        sections,
+        {"role": "user", "content": user_input}
+    )
+    _record_timing("pack", time.perf_counter() - pack_started)
+    _record_timing("build_prompt", time.perf_counter() - started)
 
-    # [6] Ariaジャーナル記録
+    # [6] Ariaジャーナル記録（バックグラウンドで直列実行）
     if poetic:
-        log_aria_journal(
-            summary="Reflection from poetic layer",
-            content=poetic["content"],
-            topics=rag.get("query", "").split() if "query" in rag else [],
-            style="poetic",
-            emotion_tags=[],
-            source="memory_manager"
-        )
+        _journal_pool.submit(_log_poetic_journal, poetic, rag if isinstance(rag, dict) else {})
 
     return prompt
@@ -0,0 +1,458 @@
+# memory_store.py
+# memory/ 以下の記憶をまとめて保持する SQLite（WALモード）ストア
+# 書き込みは1本のライタースレッドに集約してまとめてコミットし、複数プロセスからの同時書き込みもロックで直列化する
+
+import os
+import sys
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MEMORY_DIR = os.path.abspath("memory")
+BACKEND = os.getenv("ARIA_MEMORY_BACKEND", "json").lower()  # json | sqlite
+DB_PATH = os.getenv("ARIA_MEMORY_DB", os.path.join(MEMORY_DIR, "aria_memory.sqlite"))
+BUSY_TIMEOUT = float(os.getenv("ARIA_MEMORY_BUSY_TIMEOUT", "10"))  # 他プロセスの書き込み待ち上限（秒）
+WRITE_BATCH = int(os.getenv("ARIA_MEMORY_WRITE_BATCH", "64"))       # 1コミットにまとめる最大操作数
+READ_CHUNK = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialog (
+    seq INTEGER PRIMARY KEY, id TEXT, timestamp TEXT, user TEXT, aria TEXT, topic TEXT
+);
+CREATE INDEX IF NOT EXISTS dialog_timestamp ON dialog(timestamp);
+CREATE INDEX IF NOT EXISTS dialog_topic ON dialog(topic);
+
+CREATE TABLE IF NOT EXISTS long_term (
+    row INTEGER PRIMARY KEY, id TEXT, content TEXT, timestamp TEXT, topic TEXT
+);
+CREATE INDEX IF NOT EXISTS long_term_timestamp ON long_term(timestamp);
+CREATE INDEX IF NOT EXISTS long_term_topic ON long_term(topic);
+
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY, timestamp TEXT, summary TEXT, content TEXT, topics TEXT, style TEXT,
+    emotion_tags TEXT, source TEXT, meta TEXT, symbolic_score REAL, poetic_mode INTEGER,
+    vector BLOB, emotion_vector BLOB
+);
+CREATE INDEX IF NOT EXISTS journal_timestamp ON journal(timestamp);
+CREATE INDEX IF NOT EXISTS journal_score ON journal(symbolic_score);
+
+CREATE TABLE IF NOT EXISTS vectors (
+    id INTEGER PRIMARY KEY, timestamp TEXT, content TEXT, emotion_score REAL, embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS vectors_timestamp ON vectors(timestamp);
+CREATE INDEX IF NOT EXISTS vectors_score ON vectors(emotion_score);
+
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY, value TEXT, updated TEXT
+);
+"""
+
+# === SQL（固定文字列にしてステートメントキャッシュを効かせる）===
+SQL_DIALOG_INSERT = "INSERT INTO dialog (id, timestamp, user, aria, topic) VALUES (?, ?, ?, ?, ?)"
+SQL_DIALOG_MAX = "SELECT COALESCE(MAX(seq), 0) FROM dialog"
+SQL_DIALOG_RANGE = "SELECT seq, id, timestamp, user, aria, topic FROM dialog WHERE seq >= ? AND seq < ? ORDER BY seq"
+SQL_DIALOG_REVERSE = "SELECT seq, id, timestamp, user, aria, topic FROM dialog WHERE seq > ? AND seq < ? ORDER BY seq DESC LIMIT ?"
+SQL_LONG_TERM_INSERT = "INSERT INTO long_term (id, content, timestamp, topic) VALUES (?, ?, ?, ?)"
+SQL_JOURNAL_INSERT = (
+    "INSERT INTO journal (timestamp, summary, content, topics, style, emotion_tags, source, meta,"
+    " symbolic_score, poetic_mode, vector, emotion_vector) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_JOURNAL_SINCE = "SELECT id, style, symbolic_score, poetic_mode, vector, emotion_vector FROM journal WHERE id > ? ORDER BY id"
+SQL_VECTOR_INSERT = "INSERT INTO vectors (timestamp, content, emotion_score, embedding) VALUES (?, ?, ?, ?)"
+SQL_VECTOR_SINCE = "SELECT id, timestamp, content, emotion_score, embedding FROM vectors WHERE id > ? ORDER BY id"  # 埋め込み未計算の行も返す
+SQL_VECTOR_FILLED = "SELECT id, timestamp, content, emotion_score, embedding FROM vectors WHERE id IN ({}) AND embedding IS NOT NULL ORDER BY id"
+SQL_VECTOR_PENDING = "SELECT id, content FROM vectors WHERE embedding IS NULL ORDER BY id"
+SQL_VECTOR_SET = "UPDATE vectors SET embedding = ? WHERE id = ?"
+SQL_KV_GET = "SELECT value FROM kv WHERE key = ?"
+SQL_KV_SET = "INSERT INTO kv (key, value, updated) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated = excluded.updated"
+SQL_CONTENT_SINCE = {
+    "journal": "SELECT id, content FROM journal WHERE id > ? ORDER BY id",
+    "long_term": "SELECT row, content FROM long_term WHERE row > ? ORDER BY row"
+}
+
+def use_sqlite() -> bool:
+    return BACKEND == "sqlite"
+
+def to_blob(vector: Optional[Sequence[float]]) -> Optional[bytes]:
+    if vector is None or len(vector) == 0:
+        return None
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def from_blob(blob: Optional[bytes]) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32) if blob else np.zeros(0, dtype=np.float32)
+
+class MemoryStore:
+    """
+    読み込みはスレッドごとの接続で並行に行い、書き込みはライタースレッドへ集約
+    ライターはキューに溜まった操作を1トランザクション（BEGIN IMMEDIATE）で実行し、
+    各操作は SAVEPOINT で囲むので1件の失敗が他の操作を巻き込まない
+    """
+
+    def __init__(self, path: str = DB_PATH) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._queue: "queue.Queue[Tuple[Callable[[sqlite3.Connection], Any], Future]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self.commits = 0
+        self.writes = 0
+        self.vector_fills = 0  # set_vectors の回数（読み手が未計算行の再確認に使う）
+        self._connection().executescript(SCHEMA)
+
+    # === 接続 ===
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # === 書き込み（まとめてコミット）===
+    def submit(self, op: Callable[[sqlite3.Connection], Any]) -> Future:
+        future: Future = Future()
+        self._queue.put((op, future))
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name="memory-store-writer", daemon=True)
+                self._writer.start()
+        return future
+
+    def write(self, op: Callable[[sqlite3.Connection], Any]) -> Any:
+        """操作をライターに渡し、コミット後の戻り値を返す"""
+        return self.submit(op).result()
+
+    def _run_writer(self) -> None:
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())  # 待たずに、溜まっている分だけ同じコミットへ
+                except queue.Empty:
+                    break
+            results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        results.append((future, op(conn), None))
+                        conn.execute("RELEASE op")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        conn.execute("RELEASE op")
+                        results.append((future, None, e))
+                conn.execute("COMMIT")
+                self.commits += 1
+                self.writes += len(batch)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                print(f"[memory_store] コミットエラー: {e}")
+                results = [(future, None, e) for _, future in batch]
+            for future, value, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(value)
+
+    def flush(self) -> None:
+        """それまでに投入した書き込みのコミットを待つ"""
+        self.write(lambda conn: None)
+
+    # === key-value（短期記憶・関心・RAG要約など小さなJSON）===
+    def get_kv(self, key: str, default: Any = None) -> Any:
+        row = self._connection().execute(SQL_KV_GET, (key,)).fetchone()
+        if row is None:
+            return default
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return default
+
+    def set_kv(self, key: str, value: Any) -> None:
+        text = json.dumps(value, ensure_ascii=False)
+        self.write(lambda conn: conn.execute(SQL_KV_SET, (key, text, datetime.now().isoformat())))
+
+    def update_kv(self, key: str, update: Callable[[Any], Any], default: Any = None) -> Any:
+        """読み出し→更新→保存を1トランザクション内で行う（他プロセスの更新を失わない）"""
+        def op(conn: sqlite3.Connection) -> Any:
+            row = conn.execute(SQL_KV_GET, (key,)).fetchone()
+            value = json.loads(row[0]) if row else default
+            value = update(value)
+            conn.execute(SQL_KV_SET, (key, json.dumps(value, ensure_ascii=False), datetime.now().isoformat()))
+            return value
+        return self.write(op)
+
+    # === 対話ログ ===
+    def append_dialog(self, entry: Dict[str, Any]) -> int:
+        params = (entry.get("id", ""), entry.get("timestamp"), entry.get("user", ""), entry.get("aria", ""), entry.get("topic", ""))
+        return self.write(lambda conn: conn.execute(SQL_DIALOG_INSERT, params).lastrowid)
+
+    def dialog_max_seq(self) -> int:
+        return int(self._connection().execute(SQL_DIALOG_MAX).fetchone()[0])
+
+    @staticmethod
+    def _dialog_row(row: Tuple[Any, ...]) -> Tuple[int, Dict[str, Any]]:
+        return row[0], {"id": row[1], "timestamp": row[2], "user": row[3], "aria": row[4], "topic": row[5]}
+
+    def dialog_range(self, start: int, stop: int) -> List[Tuple[int, Dict[str, Any]]]:
+        return [self._dialog_row(r) for r in self._connection().execute(SQL_DIALOG_RANGE, (start, stop))]
+
+    def dialog_reverse(self, stop_seq: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """新しい順に (seq, entry)。seq <= stop_seq に達したら終了"""
+        upper = self.dialog_max_seq() + 1
+        while True:
+            rows = self._connection().execute(SQL_DIALOG_REVERSE, (stop_seq, upper, READ_CHUNK)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._dialog_row(row)
+            upper = rows[-1][0]
+
+    # === 長期記憶 ===
+    def append_long_term(self, entries: List[Dict[str, Any]]) -> None:
+        params = [(e.get("id", ""), e.get("content", ""), e.get("timestamp"), e.get("topic", "")) for e in entries]
+        self.write(lambda conn: conn.executemany(SQL_LONG_TERM_INSERT, params))
+
+    def compact_dialog(self, entries: List[Dict[str, Any]], compacted_seq: int) -> None:
+        """長期記憶への追記と圧縮済み位置の更新を同じトランザクションで行う"""
+        params = [(e.get("id", ""), e.get("content", ""), e.get("timestamp"), e.get("topic", "")) for e in entries]
+        state = json.dumps({"compacted_seq": compacted_seq})
+        def op(conn: sqlite3.Connection) -> None:
+            conn.executemany(SQL_LONG_TERM_INSERT, params)
+            conn.execute(SQL_KV_SET, ("dialog_state", state, datetime.now().isoformat()))
+        self.write(op)
+
+    def contents_since(self, table: str, last_id: int) -> List[Tuple[int, str]]:
+        """journal / long_term の id > last_id の (id, content)（語索引の差分更新用）"""
+        return self._connection().execute(SQL_CONTENT_SINCE[table], (last_id,)).fetchall()
+
+    # === ジャーナル ===
+    @staticmethod
+    def _journal_params(entry: Dict[str, Any], emotion_vector: Optional[Sequence[float]]) -> Tuple[Any, ...]:
+        return (
+            entry.get("timestamp"), entry.get("summary", ""), entry.get("content", ""),
+            json.dumps(entry.get("topics") or [], ensure_ascii=False), entry.get("style") or "unknown",
+            json.dumps(entry.get("emotion_tags") or [], ensure_ascii=False), entry.get("source", ""),
+            json.dumps(entry.get("meta") or {}, ensure_ascii=False), float(entry.get("symbolic_score", 0.0)),
+            int(bool((entry.get("meta") or {}).get("poetic_mode"))), to_blob(entry.get("vector")), to_blob(emotion_vector)
+        )
+
+    def append_journal(self, entry: Dict[str, Any], emotion_vector: Optional[Sequence[float]] = None) -> int:
+        params = self._journal_params(entry, emotion_vector)
+        return self.write(lambda conn: conn.execute(SQL_JOURNAL_INSERT, params).lastrowid)
+
+    def journal_since(self, last_id: int) -> List[Tuple[Any, ...]]:
+        """id > last_id の (id, style, symbolic_score, poetic_mode, vector, emotion_vector)"""
+        return self._connection().execute(SQL_JOURNAL_SINCE, (last_id,)).fetchall()
+
+    def load_journal(self, ids: List[int]) -> List[Dict[str, Any]]:
+        """指定 id のエントリ（ids の順）"""
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        rows = self._connection().execute(
+            f"SELECT id, timestamp, summary, content, topics, style, emotion_tags, source, meta, symbolic_score, vector"
+            f" FROM journal WHERE id IN ({marks})", ids
+        ).fetchall()
+        by_id = {}
+        for row in rows:
+            by_id[row[0]] = {
+                "timestamp": row[1], "summary": row[2], "content": row[3], "topics": json.loads(row[4] or "[]"),
+                "style": row[5], "emotion_tags": json.loads(row[6] or "[]"), "source": row[7],
+                "meta": json.loads(row[8] or "{}"), "symbolic_score": row[9], "vector": from_blob(row[10]).tolist()
+            }
+        return [by_id[i] for i in ids if i in by_id]
+
+    # === ベクトル記憶 ===
+    def append_vector(self, content: str, embedding: Optional[Sequence[float]], emotion_score: float = 0.0, timestamp: Optional[str] = None) -> int:
+        params = (timestamp or datetime.now().isoformat(), content, float(emotion_score), to_blob(embedding))
+        return self.write(lambda conn: conn.execute(SQL_VECTOR_INSERT, params).lastrowid)
+
+    def vectors_since(self, last_id: int) -> List[Tuple[Any, ...]]:
+        return self._connection().execute(SQL_VECTOR_SINCE, (last_id,)).fetchall()
+
+    def vectors_filled(self, ids: Sequence[int]) -> List[Tuple[Any, ...]]:
+        """ids のうち埋め込みが入った行"""
+        rows: List[Tuple[Any, ...]] = []
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows.extend(self._connection().execute(SQL_VECTOR_FILLED.format(",".join("?" * len(chunk))), chunk).fetchall())
+        return rows
+
+    def pending_vectors(self, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        if limit is None:
+            return self._connection().execute(SQL_VECTOR_PENDING).fetchall()
+        return self._connection().execute(SQL_VECTOR_PENDING + " LIMIT ?", (limit,)).fetchall()
+
+    def set_vectors(self, items: List[Tuple[int, Sequence[float]]]) -> None:
+        params = [(to_blob(vec), row_id) for row_id, vec in items]
+        self.write(lambda conn: conn.executemany(SQL_VECTOR_SET, params))
+        self.vector_fills += 1
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("dialog", "long_term", "journal", "vectors", "kv")}
+        return {**counts, "commits": self.commits, "writes": self.writes, "queued": self._queue.qsize()}
+
+class SQLiteDialogLog:
+    """memory_core から DialogStore と同じ形で使う対話ログ（seq は0始まり）"""
+
+    def __init__(self, store: "MemoryStore") -> None:
+        self.store = store
+
+    def append(self, record: Dict[str, Any]) -> int:
+        return self.store.append_dialog(record) - 1
+
+    def __len__(self) -> int:
+        return self.store.dialog_max_seq()
+
+    def read_range(self, start: int, stop: Optional[int] = None) -> List[Tuple[int, Dict[str, Any]]]:
+        stop = len(self) if stop is None else stop
+        return [(seq - 1, entry) for seq, entry in self.store.dialog_range(start + 1, stop + 1)]
+
+    def iter_reverse(self, stop_seq: int = -1) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for seq, entry in self.store.dialog_reverse(stop_seq + 1):
+            yield seq - 1, entry
+
+    def tail(self, n: int) -> List[Dict[str, Any]]:
+        records = []
+        for _, record in self.iter_reverse():
+            if len(records) >= n:
+                break
+            records.append(record)
+        return records[::-1]
+
+    @property
+    def compacted_seq(self) -> int:
+        return int(self.store.get_kv("dialog_state", {}).get("compacted_seq", -1))
+
+    def set_state(self, **values: Any) -> None:
+        self.store.update_kv("dialog_state", lambda state: {**(state or {}), **values}, {})
+
+    def import_legacy(self, path: str) -> int:
+        return 0  # 旧ファイルの取り込みは migrate() で行う
+
+# === プロセス内で共有するストア ===
+_store: Optional[MemoryStore] = None
+_store_lock = threading.Lock()
+
+def get_memory_store() -> MemoryStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MemoryStore()
+        return _store
+
+# === JSONファイルからの一括移行 ===
+def _read_json(path: str, default: Any) -> Any:
+    try:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[memory_store] {os.path.basename(path)} 読込エラー: {e}")
+    return default
+
+def _read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict):
+                yield entry
+
+def migrate(store: MemoryStore, memory_dir: str = MEMORY_DIR, force: bool = False) -> Dict[str, int]:
+    """
+    既存の JSON / JSONL を1回だけ取り込む（元ファイルは残す）
+    移行済みなら force=True のときだけ再実行
+    """
+    if store.get_kv("migrated_at") and not force:
+        print("[memory_store] 移行済みです（--force で再実行）")
+        return {}
+    from dialog_store import DialogStore
+    if force:
+        store.write(lambda conn: [conn.execute(f"DELETE FROM {table}") for table in ("dialog", "long_term", "journal", "vectors", "kv")])
+
+    path = lambda name: os.path.join(memory_dir, name)
+    counts: Dict[str, int] = {}
+
+    # 対話ログ：セグメント化済みストア（旧 dialog_log.jsonl はここで取り込まれる）
+    dialog = DialogStore(os.path.join(memory_dir, "dialog"))
+    dialog.import_legacy(path("dialog_log.jsonl"))
+    rows = [entry for _, entry in dialog.read_range(0)]
+    params = [(e.get("id", ""), e.get("timestamp"), e.get("user", ""), e.get("aria", ""), e.get("topic", "")) for e in rows]
+    store.write(lambda conn: conn.executemany(SQL_DIALOG_INSERT, params))
+    store.set_kv("dialog_state", {"compacted_seq": dialog.compacted_seq})
+    counts["dialog"] = len(rows)
+
+    long_term = _read_json(path("compressed_memory.json"), [])
+    long_term = [e for e in long_term if isinstance(e, dict)] if isinstance(long_term, list) else []
+    store.append_long_term(long_term)
+    counts["long_term"] = len(long_term)
+
+    journal = list(_read_jsonl(path("aria_journal.jsonl")))
+    if journal:
+        tagged = sorted({" ".join(e.get("emotion_tags") or []) for e in journal if e.get("emotion_tags")})
+        emotion_vectors: Dict[str, List[float]] = {}
+        if tagged:
+            from vectorizer import batch_encode
+            emotion_vectors = dict(zip(tagged, batch_encode(tagged)))
+        params = [MemoryStore._journal_params(e, emotion_vectors.get(" ".join(e.get("emotion_tags") or []))) for e in journal]
+        store.write(lambda conn: conn.executemany(SQL_JOURNAL_INSERT, params))
+    counts["journal"] = len(journal)
+
+    vectors = _read_json(path("vector_memory.json"), [])
+    vectors = [e for e in vectors if isinstance(e, dict)] if isinstance(vectors, list) else []
+    params = [
+        (e.get("timestamp"), e.get("content") or e.get("text") or "", float(e.get("emotion_score", 0.0)), to_blob(e.get("embedding")))
+        for e in vectors
+    ]
+    store.write(lambda conn: conn.executemany(SQL_VECTOR_INSERT, params))
+    counts["vectors"] = len(vectors)
+
+    for key, name in (
+        ("short_term", "short_term_memory.json"), ("interest", "aria_interest.json"),
+        ("rag_summary", "rag_summary.json"), ("rag_origin_trace", "rag_origin_trace.json")
+    ):
+        value = _read_json(path(name), None)
+        if value is not None:
+            store.set_kv(key, value)
+            counts[key] = 1
+
+    store.set_kv("migrated_at", datetime.now().isoformat())
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="memory/ の SQLite ストア")
+    parser.add_argument("--migrate", action="store_true", help="既存の JSON ファイルを取り込む")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+    store = MemoryStore()
+    if args.migrate:
+        counts = migrate(store, force=args.force)
+        if not counts:
+            sys.exit(1)
+        print("✅ 移行完了：" + "、".join(f"{k}={v}" for k, v in counts.items()))
+        print("   ARIA_MEMORY_BACKEND=sqlite で有効化されます")
+    print(json.dumps(store.stats(), ensure_ascii=False))
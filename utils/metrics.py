@@ -0,0 +1,250 @@
+# metrics.py
+# 軽量な計測層：区間タイマー（span）・カウンタ・ゲージ・ヒストグラムと Prometheus テキスト形式の出力
+# ARIA_METRICS=1 のときだけ記録する（無効時の span() は共有の空オブジェクトを返すだけ）
+# キャッシュ命中数・待ち行列の深さなど既存の stats() は、出力時にだけ読むコレクタとして登録する
+
+import os
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+ENABLED = os.getenv("ARIA_METRICS", "0").lower() not in ("", "0", "false", "no")
+METRICS_HOST = os.getenv("ARIA_METRICS_HOST", "127.0.0.1")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKENS_PER_SEC_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, str, str, Dict[str, Any], float]  # (名前, 型, 説明, ラベル, 値)
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: Iterable[Tuple[str, str]]) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    def __init__(self, name: str, kind: str, description: str, buckets: Sequence[float] = ()) -> None:
+        self.name = name
+        self.kind = kind  # counter / gauge / histogram
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.values: Dict[LabelKey, Any] = {}  # ヒストグラムは [各バケット件数..., 合計, 件数]
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def _get(self, name: str, kind: str, description: str, buckets: Sequence[float] = ()) -> _Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = _Metric(name, kind, description, buckets)
+        return metric
+
+    def inc(self, name: str, value: float, labels: Dict[str, Any], description: str = "") -> None:
+        key = _label_key(labels)
+        with self._lock:
+            metric = self._get(name, "counter", description)
+            metric.values[key] = metric.values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, labels: Dict[str, Any], description: str = "") -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._get(name, "gauge", description).values[key] = float(value)
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any], description: str = "", buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            metric = self._get(name, "histogram", description, buckets)
+            counts = metric.values.get(key)
+            if counts is None:
+                counts = metric.values[key] = [0] * len(metric.buckets) + [0.0, 0]
+            i = bisect.bisect_left(metric.buckets, value)
+            if i < len(metric.buckets):
+                counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus テキスト形式（version 0.0.4）"""
+        lines: List[str] = []
+        with self._lock:
+            metrics = [(m.name, m.kind, m.description, m.buckets, dict(m.values)) for m in self._metrics.values()]
+            collectors = list(self._collectors)
+        for name, kind, description, buckets, values in metrics:
+            if description:
+                lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in values.items():
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(key)} {value[-1]}")
+        declared = set()
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"[metrics] コレクタエラー: {e}")
+                continue
+            for name, kind, description, labels, value in samples:
+                if name not in declared:
+                    declared.add(name)
+                    if description:
+                        lines.append(f"# HELP {name} {description}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# === 記録（無効時は何もしない）===
+def inc(name: str, value: float = 1.0, description: str = "", **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY.inc(name, value, labels, description)
+
+def set_gauge(name: str, value: float, description: str = "", **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY.set(name, value, labels, description)
+
+def observe(name: str, value: float, description: str = "", buckets: Sequence[float] = LATENCY_BUCKETS, **labels: Any) -> None:
+    if ENABLED:
+        REGISTRY.observe(name, value, labels, description, buckets)
+
+def observe_span(name: str, seconds: float, **labels: Any) -> None:
+    """計測済みの所要時間を span と同じヒストグラムに入れる"""
+    if ENABLED:
+        REGISTRY.observe("aria_span_seconds", seconds, {"span": name, **labels}, "区間ごとの所要時間（秒）")
+
+class _Span:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name: str, labels: Dict[str, Any]) -> None:
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        labels = {"span": self.name, **self.labels}
+        REGISTRY.observe("aria_span_seconds", time.perf_counter() - self.started, labels, "区間ごとの所要時間（秒）")
+        if exc_type is not None:
+            REGISTRY.inc("aria_span_errors_total", 1.0, labels, "例外で終わった区間の数")
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **labels: Any) -> Any:
+    """with span("build_prompt"): ... の区間を aria_span_seconds{span=...} に記録"""
+    return _Span(name, labels) if ENABLED else _NOOP_SPAN
+
+def timed(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """関数全体を span で包むデコレータ（無効時は元の関数をそのまま返す）"""
+    def decorate(func: Callable[..., Any]) -> Callable[..., Any]:
+        if not ENABLED:
+            return func
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorate
+
+# === 既存の stats() を出力時に読むコレクタ ===
+def stats_samples(prefix: str, stats: Dict[str, Any], labels: Optional[Dict[str, Any]] = None) -> List[Sample]:
+    """数値・真偽値の項目をゲージに展開（入れ子の dict は名前をつなげる）"""
+    samples: List[Sample] = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, (bool, int, float)):
+            samples.append((name, "gauge", "", labels or {}, float(value)))
+        elif isinstance(value, dict):
+            samples.extend(stats_samples(name, value, labels))
+    return samples
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, Any]]) -> None:
+    """stats() の戻り値を prefix_項目名 のゲージとして公開（スクレイプ時だけ呼ばれる）"""
+    REGISTRY.register_collector(lambda: stats_samples(prefix, stats()))
+
+def register_collector(collector: Callable[[], Iterable[Sample]]) -> None:
+    REGISTRY.register_collector(collector)
+
+def render() -> str:
+    return REGISTRY.render()
+
+# === Bot用のローカルHTTPエンドポイント ===
+Route = Callable[[Dict[str, List[str]]], Tuple[int, str, bytes]]  # クエリ → (ステータス, Content-Type, 本文)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_routes: Dict[str, Route] = {"/metrics": lambda query: (200, CONTENT_TYPE, render().encode("utf-8"))}
+
+def add_route(path: str, route: Route) -> None:
+    _routes[path] = route
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        route = _routes.get(url.path)
+        if route is None:
+            status, content_type, body = 404, "text/plain; charset=utf-8", b"not found\n"
+        else:
+            try:
+                status, content_type, body = route(parse_qs(url.query))
+            except Exception as e:
+                status, content_type, body = 500, "text/plain; charset=utf-8", f"{e}\n".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # アクセスログは出さない
+
+def start_http_server(port: int, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """/metrics を返すHTTPサーバーを別スレッドで起動（計測が無効なら起動しない）"""
+    if not ENABLED:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[metrics] HTTPサーバー起動エラー: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 metrics: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,242 @@
+# onnx_encoder.py
+# SentenceTransformer を ONNX Runtime（CPU）で動かす埋め込みエンコーダ（動的int8量子化・トークナイザは1つを使い回す）
+# torch / transformers を読み込まないので、起動時間と常駐メモリが小さい
+# 例: python utils/onnx_encoder.py export        … model/onnx/all-MiniLM-L6-v2/ に書き出し＋int8量子化＋同等性チェック
+#     python utils/onnx_encoder.py verify        … PyTorch 版とのコサイン類似度（既定 0.99 以上で合格）
+
+import os
+import sys
+import json
+import argparse
+import threading
+import importlib.util
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+ONNX_DIR = os.path.abspath(os.getenv("VECTORIZER_ONNX_DIR", os.path.join("model", "onnx", MODEL_NAME)))
+QUANTIZED = os.getenv("VECTORIZER_ONNX_QUANTIZED", "1") != "0"  # int8 版を使う
+THREADS = int(os.getenv("VECTORIZER_ONNX_THREADS", "0"))           # 0 = ONNX Runtime の既定
+BATCH_SIZE = 32
+MIN_COSINE = 0.99
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+META_FILE = "encoder.json"
+
+# 同等性チェック用の文（英語・日本語・短文・長文を混ぜる）
+SAMPLE_TEXTS = [
+    "The moonlight drifts across the quiet water.",
+    "What if every memory were a small promise of tomorrow?",
+    "I remember the letter you wrote me in childhood, folded like a paper bird.",
+    "The algorithm listens to the signal between silence and noise.",
+    "Solitude is a room with an open window.",
+    "hi",
+    "Because the future is a seed, therefore we water it with questions.",
+    "夢の中で月が静かに揺れていた。",
+    "明日のことを考えると、少しだけ胸が温かくなる。",
+    "Aria, do you dream when nobody is talking to you? " * 6
+]
+
+def model_file(model_dir: str = ONNX_DIR, quantized: bool = QUANTIZED) -> str:
+    return os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+
+def variant(quantized: bool = QUANTIZED) -> str:
+    """キャッシュキー用（量子化の有無で埋め込みがわずかに変わるため分ける）"""
+    return "onnx-int8" if quantized else "onnx-fp32"
+
+def unavailable_reason(model_dir: str = ONNX_DIR, quantized: bool = QUANTIZED) -> Optional[str]:
+    """ONNX 版が使えない理由（使えるなら None）。ライブラリは読み込まずに調べる"""
+    for module in ("onnxruntime", "tokenizers"):
+        if importlib.util.find_spec(module) is None:
+            return f"{module} が未インストール"
+    for path in (model_file(model_dir, quantized), os.path.join(model_dir, TOKENIZER_FILE), os.path.join(model_dir, META_FILE)):
+        if not os.path.exists(path):
+            return f"{path} がありません（python utils/onnx_encoder.py export で作成）"
+    return None
+
+# === 実行時エンコーダ ===
+class OnnxEncoder:
+    """
+    SentenceTransformer.encode と同じ呼び方で使える ONNX 版
+    （トークナイズ → Transformer本体 → プーリング → 正規化。本体以外は numpy で行う）
+    """
+
+    def __init__(self, model_dir: str = ONNX_DIR, quantized: bool = QUANTIZED, threads: int = THREADS) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        self.dim = int(self.meta["dim"])
+        self.pooling = self.meta.get("pooling", "mean")
+        self.normalize = bool(self.meta.get("normalize", True))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(int(self.meta.get("max_seq_length", 256)))
+        self.tokenizer.enable_padding(pad_id=int(self.meta.get("pad_id", 0)), pad_token=self.meta.get("pad_token", "[PAD]"))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_file(model_dir, quantized), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self._lock = threading.Lock()  # Tokenizer のパディング設定は共有なので、エンコードは直列に
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts: Union[str, Sequence[str]], batch_size: int = BATCH_SIZE, convert_to_numpy: bool = True, **kwargs: Any) -> np.ndarray:
+        single = isinstance(texts, str)
+        items = [texts] if single else list(texts)
+        out = np.zeros((len(items), self.dim), dtype=np.float32)
+        order = sorted(range(len(items)), key=lambda i: len(items[i]))  # 長さの近い文を同じバッチにして詰め物を減らす
+        with self._lock:
+            for start in range(0, len(order), batch_size):
+                chunk = order[start:start + batch_size]
+                out[chunk] = self._encode_batch([items[i] for i in chunk])
+        return out[0] if single else out
+
+# === 書き出し・量子化（torch / sentence_transformers / onnxruntime が必要）===
+def export(model_name: str = MODEL_NAME, model_dir: str = ONNX_DIR, quantize: bool = True, opset: int = 14) -> Dict[str, Any]:
+    """Transformer 本体を ONNX に書き出し、トークナイザとプーリング設定を並べて保存"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.eval()
+    sample = tokenizer(["export sample", "a slightly longer export sample sentence"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class _Body(torch.nn.Module):
+        def __init__(self) -> None:
+            super().__init__()
+            self.model = auto_model
+
+        def forward(self, *inputs: Any) -> Any:
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, FP32_FILE)
+    axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Body(), tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=opset, do_constant_folding=True
+        )
+    tokenizer.save_pretrained(model_dir)  # tokenizer.json（fast tokenizer）を含む
+
+    pooling, normalize = "mean", False
+    for module in model:
+        if type(module).__name__ == "Pooling":
+            config = module.get_config_dict()
+            pooling = "cls" if config.get("pooling_mode_cls_token") and not config.get("pooling_mode_mean_tokens") else "mean"
+        elif type(module).__name__ == "Normalize":
+            normalize = True
+    meta = {
+        "model_name": model_name,
+        "dim": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling,
+        "normalize": normalize,
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "inputs": input_names,
+        "opset": opset
+    }
+    with open(os.path.join(model_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(model_dir, INT8_FILE), weight_type=QuantType.QInt8)
+
+    meta["files"] = {
+        name: round(os.path.getsize(os.path.join(model_dir, name)) / 2**20, 1)
+        for name in (FP32_FILE, INT8_FILE) if os.path.exists(os.path.join(model_dir, name))
+    }
+    return meta
+
+def verify(model_name: str = MODEL_NAME, model_dir: str = ONNX_DIR, quantized: bool = QUANTIZED,
+           texts: Optional[List[str]] = None, threshold: float = MIN_COSINE) -> Dict[str, Any]:
+    """PyTorch 版と同じ文をエンコードして、文ごとのコサイン類似度を比べる"""
+    from sentence_transformers import SentenceTransformer
+
+    texts = texts or SAMPLE_TEXTS
+    reference = SentenceTransformer(model_name, device="cpu").encode(texts, convert_to_numpy=True)
+    candidate = OnnxEncoder(model_dir, quantized).encode(texts)
+    ref = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    cand = candidate / np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    cosines = (ref * cand).sum(axis=1)
+    worst = int(np.argmin(cosines))
+    return {
+        "variant": variant(quantized),
+        "texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "worst_text": texts[worst][:80],
+        "threshold": threshold,
+        "passed": bool(cosines.min() >= threshold)
+    }
+
+def _load_texts(path: Optional[str]) -> Optional[List[str]]:
+    """1行1文、または JSONL（content / text を使う）"""
+    if not path:
+        return None
+    texts: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line)
+                    line = entry.get("content") or entry.get("text") or ""
+                except json.JSONDecodeError:
+                    pass
+            if line:
+                texts.append(line)
+    return texts or None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="埋め込みモデルの ONNX 書き出し・同等性チェック")
+    parser.add_argument("mode", choices=["export", "verify"])
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--dir", default=ONNX_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="int8 量子化をしない（verify では fp32 版を比べる）")
+    parser.add_argument("--texts", default=None, help="verify に使う文のファイル（1行1文 または JSONL）")
+    parser.add_argument("--threshold", type=float, default=MIN_COSINE)
+    args = parser.parse_args()
+
+    if args.mode == "export":
+        print(json.dumps(export(args.model, args.dir, quantize=not args.no_quantize), ensure_ascii=False, indent=2))
+    results = [
+        verify(args.model, args.dir, quantized, _load_texts(args.texts), args.threshold)
+        for quantized in ([False] if args.no_quantize else [False, True])
+    ]
+    for result in results:
+        mark = "✅" if result["passed"] else "❌"
+        print(f"{mark} {result['variant']}: min={result['min_cosine']} mean={result['mean_cosine']} (>= {result['threshold']})")
+    sys.exit(0 if all(r["passed"] for r in results) else 1)
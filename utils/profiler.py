@@ -0,0 +1,293 @@
+# profiler.py
+# 稼働中のプロセスを再起動せずに一定時間だけプロファイルする
+# サンプリング: 別スレッドが全スレッドのスタックを定期採取し、folded 形式（flamegraph.pl / speedscope で読める）で保存
+# 割り当て: tracemalloc の開始・終了スナップショットの差分（全体と build_prompt・リフレクタ関連ファイル）
+# 区間: section() / profiled() で囲んだ build_prompt・各ステージの呼び出し回数・所要時間（計測中だけ記録）
+
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.path.abspath(os.getenv("ARIA_PROFILE_DIR", os.path.join("memory", "profiles")))
+SAMPLE_INTERVAL = float(os.getenv("ARIA_PROFILE_INTERVAL", "0.005"))   # スタック採取の間隔（秒）
+MAX_SECONDS = float(os.getenv("ARIA_PROFILE_MAX_SECONDS", "300"))       # 1回の計測の上限
+TRACEMALLOC_FRAMES = int(os.getenv("ARIA_PROFILE_TRACEMALLOC_FRAMES", "16"))
+INCLUDE_IDLE = os.getenv("ARIA_PROFILE_IDLE", "0") != "0"               # 待機中のスレッドも数える（壁時計プロファイル）
+DEBUG_TOKEN = os.getenv("ARIA_DEBUG_TOKEN", "")                          # 設定時は /debug/profile に token が必要
+TOP_ALLOCATIONS = 40
+
+# 割り当て差分を個別に出すファイル（build_prompt とリフレクタの経路）
+FOCUS_FILES = (
+    "memory_manager.py", "symbolic_reflector.py", "poetic_reflector.py",
+    "context_packer.py", "vectorizer.py", "ann_index.py"
+)
+# 末端がここにあるスタックは待機中とみなす
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socketserver.py", "base_events.py")
+
+class ProfileBusy(Exception):
+    """計測中に別の計測を開始しようとした"""
+
+# === 計測セッション ===
+class ProfileSession:
+    def __init__(self, seconds: float, label: str, interval: float = SAMPLE_INTERVAL, out_dir: str = PROFILE_DIR) -> None:
+        self.seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        self.label = label
+        self.interval = max(interval, 0.001)
+        self.out_dir = out_dir
+        self.id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}"
+        self.started_at = datetime.now().isoformat()
+        self.elapsed = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.sections: Dict[str, Dict[str, float]] = {}
+        self.files: Dict[str, str] = {}
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{label}", daemon=True)
+
+    # --- 区間の記録（section() から呼ばれる）---
+    def record_section(self, name: str, seconds: float, traced_delta: int) -> None:
+        with self._lock:
+            entry = self.sections.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "traced_delta_bytes": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["traced_delta_bytes"] += traced_delta
+
+    # --- サンプリング ---
+    def _sample(self, own: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not INCLUDE_IDLE and os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)).replace(";", ":"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        started_tracing = not tracemalloc.is_tracing()
+        try:
+            if started_tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            baseline = tracemalloc.take_snapshot()
+            started = time.perf_counter()
+            deadline = started + self.seconds
+            while not self._stop.is_set() and time.perf_counter() < deadline:
+                self._sample(own)
+                self._stop.wait(self.interval)
+            self.elapsed = time.perf_counter() - started
+            final = tracemalloc.take_snapshot()
+            self._write(baseline, final)
+        except Exception as e:
+            self.error = str(e)
+            print(f"[profiler] 計測エラー: {e}")
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            _finish(self)
+            self._done.set()
+
+    # --- 保存 ---
+    def _write(self, baseline: tracemalloc.Snapshot, final: tracemalloc.Snapshot) -> None:
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, self.id)
+
+        self.files["folded"] = base + ".folded"
+        with open(self.files["folded"], "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        focus = [tracemalloc.Filter(True, f"*{os.sep}{name}", all_frames=True) for name in FOCUS_FILES]
+        self.files["alloc"] = base + ".alloc.txt"
+        with open(self.files["alloc"], "w", encoding="utf-8") as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f"# tracemalloc {self.id}  traced={current / 1e6:.1f}MB peak={peak / 1e6:.1f}MB\n")
+            f.write(f"\n## 全体（開始時からの増減・上位{TOP_ALLOCATIONS}）\n")
+            for stat in final.filter_traces(ignore).compare_to(baseline.filter_traces(ignore), "lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+            f.write(f"\n## build_prompt / リフレクタ経路（{', '.join(FOCUS_FILES)} を通る割り当て）\n")
+            for stat in final.filter_traces(focus).compare_to(baseline.filter_traces(focus), "traceback")[:TOP_ALLOCATIONS]:
+                f.write(f"\n{stat}\n")
+                for line in stat.traceback.format(limit=8):
+                    f.write(f"{line}\n")
+
+        self.files["summary"] = base + ".json"
+        with open(self.files["summary"], "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    # --- 参照 ---
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return not self._done.is_set()
+
+    def top_frames(self, n: int = 5) -> List[Tuple[str, int]]:
+        """末端（自己時間）の多い関数"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            sections = {
+                name: {
+                    "calls": int(s["calls"]),
+                    "avg_ms": round(1000 * s["seconds"] / s["calls"], 2) if s["calls"] else 0.0,
+                    "max_ms": round(1000 * s["max_seconds"], 2),
+                    "traced_delta_kb": round(s["traced_delta_bytes"] / 1024, 1)  # 同時に動く他スレッドの分も含む目安
+                }
+                for name, s in self.sections.items()
+            }
+        return {
+            "id": self.id,
+            "label": self.label,
+            "running": self.running,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "elapsed": round(self.elapsed, 3),
+            "interval": self.interval,
+            "samples": self.samples,
+            "sections": sections,
+            "top_frames": self.top_frames(10),
+            "files": dict(self.files),
+            "error": self.error
+        }
+
+# === 計測の開始・状態 ===
+_state_lock = threading.Lock()
+_active: Optional[ProfileSession] = None
+_last: Optional[ProfileSession] = None
+
+def _finish(session: ProfileSession) -> None:
+    global _active, _last
+    with _state_lock:
+        if _active is session:
+            _active = None
+        _last = session
+
+def start(seconds: float, label: str = "profile", interval: float = SAMPLE_INTERVAL) -> ProfileSession:
+    """計測を別スレッドで開始してすぐ返す（同時に1つまで）"""
+    global _active
+    with _state_lock:
+        if _active is not None:
+            raise ProfileBusy(f"計測中です（{_active.id}）")
+        session = ProfileSession(seconds, label, interval)
+        _active = session
+    session._thread.start()
+    return session
+
+def status() -> Dict[str, Any]:
+    with _state_lock:
+        active, last = _active, _last
+    return {
+        "active": active.summary() if active else None,
+        "last": last.summary() if last else None,
+        "dir": PROFILE_DIR
+    }
+
+def summary_text(session: ProfileSession) -> str:
+    """Discord向けの短い報告"""
+    if session.error:
+        return f"❌ プロファイル失敗: {session.error}"
+    lines = [f"🔬 {session.id}: {session.samples} samples / {session.elapsed:.1f}s"]
+    for name, s in sorted(session.summary()["sections"].items(), key=lambda kv: -kv[1]["avg_ms"] * kv[1]["calls"]):
+        lines.append(f"・{name}: {s['calls']}回 平均{s['avg_ms']}ms 最大{s['max_ms']}ms")
+    for frame, count in session.top_frames(5):
+        lines.append(f"・{frame}: {100 * count / max(1, session.samples):.0f}%")
+    lines.extend(f"📁 {path}" for path in session.files.values())
+    return "\n".join(lines)
+
+# === 区間計測（計測していないときは何もしない）===
+class _Section:
+    __slots__ = ("session", "name", "started", "traced")
+
+    def __init__(self, session: ProfileSession, name: str) -> None:
+        self.session = session
+        self.name = name
+        self.started = 0.0
+        self.traced = 0
+
+    def __enter__(self) -> "_Section":
+        self.traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        elapsed = time.perf_counter() - self.started
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else self.traced
+        self.session.record_section(self.name, elapsed, traced - self.traced)
+
+class _NoopSection:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSection":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+_NOOP_SECTION = _NoopSection()
+
+def section(name: str) -> Any:
+    """with section("poetic"): ... の区間を計測中のセッションに記録"""
+    session = _active
+    return _Section(session, name) if session is not None else _NOOP_SECTION
+
+def profiled(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """関数全体を section で包むデコレータ（計測中かどうかは呼び出しごとに判定）"""
+    def decorate(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# === HTTP から（/debug/profile?seconds=10&wait=1）===
+def handle_request(params: Dict[str, str], label: str) -> Tuple[int, Dict[str, Any]]:
+    """seconds なし: 状態 / seconds あり: 開始（wait=1 なら終わるまで待って結果を返す）"""
+    if DEBUG_TOKEN and params.get("token") != DEBUG_TOKEN:
+        return 403, {"error": "forbidden"}
+    if "seconds" not in params:
+        return 200, status()
+    try:
+        session = start(float(params["seconds"]), label, float(params.get("interval", SAMPLE_INTERVAL)))
+    except ProfileBusy as busy:
+        return 409, {"error": str(busy), **status()}
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if params.get("wait", "0") not in ("", "0", "false"):
+        session.wait()
+        return 200, session.summary()
+    return 202, session.summary()
+
+def http_route(label: str) -> Callable[[Dict[str, List[str]]], Tuple[int, str, bytes]]:
+    """metrics.add_route 用のルート"""
+    def route(query: Dict[str, List[str]]) -> Tuple[int, str, bytes]:
+        code, body = handle_request({k: v[-1] for k, v in query.items()}, label)
+        return code, "application/json; charset=utf-8", json.dumps(body, ensure_ascii=False).encode("utf-8")
+    return route
@@ -1,146 +1,400 @@
 # rag_engine.py
 # 意味語抽出→未知語確認→Wikipedia / ORKG / DBpedia / arXiv / Wikidataから照射→記録まで一括
+# 照射は専用イベントループ上の非同期エンジンで行い、キーワード×情報源を並行に問い合わせる
 
 
 import os
+import sys
 import json
-import requests
-from yake import KeywordExtractor
-from SPARQLWrapper import SPARQLWrapper, JSON
-from typing import List, Tuple, Optional
+import time
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Callable, Coroutine, Dict, List, Tuple, Optional
+from urllib.parse import quote
+
+import aiohttp
+from keyword_extractor import extract_keywords
+from memory_store import get_memory_store, use_sqlite
+from term_index import get_term_index
 
 # === ファイルパス（絶対パス化） ===
 MEMORY_DIR = os.path.abspath("memory")
 SUMMARY_PATH = os.path.join(MEMORY_DIR, "rag_summary.json")
 ORIGIN_TRACE_PATH = os.path.join(MEMORY_DIR, "rag_origin_trace.json")
-JOURNAL_PATH = os.path.join(MEMORY_DIR, "aria_journal.json")
-LONG_TERM_PATH = os.path.join(MEMORY_DIR, "compressed_memory.json")
+CACHE_PATH = os.getenv("RAG_CACHE_PATH", os.path.join(MEMORY_DIR, "rag_cache.sqlite"))
 
-# === キーワード抽出 ===
-def extract_keywords(text: str, lang: Optional[str] = None) -> List[str]:
-    lang = lang or ("ja" if any("\u3000" <= c <= "\u9fff" for c in text) else "en")
-    extractor = KeywordExtractor(lan=lang, n=2, top=3)
-    return [kw[0] for kw in extractor.extract_keywords(text)]
+# === 照射設定（URLは差し替え可能：ローカルのモックサーバーで検証できる）===
+SOURCE_URLS = {
+    "wikipedia": os.getenv("RAG_WIKIPEDIA_URL", "https://en.wikipedia.org/api/rest_v1/page/summary"),
+    "orkg": os.getenv("RAG_ORKG_URL", "https://www.orkg.org/api/papers"),
+    "dbpedia": os.getenv("RAG_DBPEDIA_URL", "https://dbpedia.org/sparql"),
+    "arxiv": os.getenv("RAG_ARXIV_URL", "http://export.arxiv.org/api/query"),
+    "wikidata": os.getenv("RAG_WIKIDATA_URL", "https://www.wikidata.org/w/api.php")
+}
+SOURCE_TIMEOUTS = {  # 情報源ごとの上限秒数
+    name: float(os.getenv(f"RAG_TIMEOUT_{name.upper()}", default))
+    for name, default in (("wikipedia", "3"), ("orkg", "4"), ("dbpedia", "4"), ("arxiv", "5"), ("wikidata", "3"))
+}
+TOTAL_TIMEOUT = float(os.getenv("RAG_TOTAL_TIMEOUT", "8"))        # 1回の照射全体の上限秒数
+MAX_CONNECTIONS = int(os.getenv("RAG_MAX_CONNECTIONS", "8"))
+FANOUT = int(os.getenv("RAG_FANOUT", "2"))                        # 1キーワードあたりに問い合わせる情報源の数
+CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", str(7 * 24 * 3600)))
+NEGATIVE_TTL = float(os.getenv("RAG_NEGATIVE_TTL", "3600"))       # 「該当なし」の応答を覚えておく秒数
+BREAKER_FAILURES = int(os.getenv("RAG_BREAKER_FAILURES", "3"))    # 連続失敗でその情報源を一時停止
+BREAKER_COOLDOWN = float(os.getenv("RAG_BREAKER_COOLDOWN", "60"))
+USER_AGENT = "Stellabiblia-RAG/1.0"
 
-# === 未知語判定（ジャーナル + 圧縮記憶）===
-def is_new_term(keyword: str) -> bool:
-    sources = []
-    for path in [JOURNAL_PATH, LONG_TERM_PATH]:
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    sources += [entry.get("content", "") for entry in data if isinstance(entry, dict)]
-            except Exception as e:
-                print(f"[RAG] {path}読込エラー: {e}")
-    return all(keyword.lower() not in src.lower() for src in sources)
-
-# === 各種照射API ===
-def fetch_from_wikipedia(query: str) -> Tuple[Optional[str], Optional[str]]:
-    url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{query.replace(' ', '_')}"
-    try:
-        resp = requests.get(url, headers={"User-Agent": "Stellabiblia-RAG/1.0"})
-        if resp.status_code == 200:
-            d = resp.json()
-            return d.get("extract", ""), d.get("content_urls", {}).get("desktop", {}).get("page", "")
-    except Exception as e:
-        print(f"[Wiki] {e}")
-    return None, None
+Result = Tuple[Optional[str], Optional[str]]  # (要約, 出典URL)
 
-def fetch_from_orkg(query: str) -> Tuple[Optional[str], Optional[str]]:
-    url = f"https://www.orkg.org/api/papers?query={query}"
+# === 未知語判定（ジャーナル + 圧縮記憶の語索引）===
+def are_new_terms(keywords: List[str]) -> List[bool]:
+    """抽出したキーワードをまとめて照会（記憶に現れない語なら True）"""
     try:
-        resp = requests.get(url)
-        if resp.status_code == 200:
-            d = resp.json()
-            if d.get("content"):
-                p = d["content"][0]
-                return p.get("title", "") + "\n\n" + p.get("research_fields", [{}])[0].get("label", ""), p.get("url", "")
+        return [not known for known in get_term_index().contains_many(keywords)]
     except Exception as e:
-        print(f"[ORKG] {e}")
+        print(f"[RAG] 語索引照会エラー: {e}")
+        return [True] * len(keywords)
+
+def is_new_term(keyword: str) -> bool:
+    return are_new_terms([keyword])[0]
+
+# === 各情報源のリクエスト組み立てと応答解析 ===
+def _wikipedia_request(query: str) -> Tuple[str, Dict[str, str]]:
+    return f"{SOURCE_URLS['wikipedia']}/{quote(query.replace(' ', '_'))}", {}
+
+def _wikipedia_parse(d: Any) -> Result:
+    return d.get("extract", "") or None, d.get("content_urls", {}).get("desktop", {}).get("page", "")
+
+def _orkg_request(query: str) -> Tuple[str, Dict[str, str]]:
+    return SOURCE_URLS["orkg"], {"query": query}
+
+def _orkg_parse(d: Any) -> Result:
+    if d.get("content"):
+        p = d["content"][0]
+        return p.get("title", "") + "\n\n" + (p.get("research_fields") or [{}])[0].get("label", ""), p.get("url", "")
     return None, None
 
-def fetch_from_dbpedia(query: str) -> Tuple[Optional[str], Optional[str]]:
-    try:
-        sparql = SPARQLWrapper("https://dbpedia.org/sparql")
-        sparql.setQuery(f"""
-            PREFIX dbo: <http://dbpedia.org/ontology/>
-            SELECT ?abstract WHERE {{
-                dbr:{query.replace(' ', '_')} dbo:abstract ?abstract .
-                FILTER(lang(?abstract)='en')
-            }}
-        """)
-        sparql.setReturnFormat(JSON)
-        results = sparql.query().convert()
-        b = results["results"]["bindings"]
-        if b:
-            return b[0]["abstract"]["value"], f"https://dbpedia.org/resource/{query.replace(' ', '_')}"
-    except Exception as e:
-        print(f"[DBpedia] {e}")
+def _dbpedia_request(query: str) -> Tuple[str, Dict[str, str]]:
+    sparql = f"""
+        PREFIX dbo: <http://dbpedia.org/ontology/>
+        SELECT ?abstract WHERE {{
+            dbr:{query.replace(' ', '_')} dbo:abstract ?abstract .
+            FILTER(lang(?abstract)='en')
+        }}
+    """
+    return SOURCE_URLS["dbpedia"], {"query": sparql, "format": "application/sparql-results+json"}
+
+def _dbpedia_parse(d: Any) -> Result:
+    b = d.get("results", {}).get("bindings", [])
+    if b:
+        return b[0]["abstract"]["value"], None  # URL は呼び出し側で補う
     return None, None
 
-def fetch_from_arxiv(query: str) -> Tuple[Optional[str], Optional[str]]:
-    try:
-        url = f"http://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results=1"
-        resp = requests.get(url, headers={"User-Agent": "Stellabiblia-RAG/1.0"})
-        if resp.status_code == 200 and "<title>" in resp.text:
-            t = resp.text
-            title = t.split("<title>")[1].split("</title>")[0].strip()
-            link = t.split("<id>")[1].split("</id>")[0].strip()
-            return title, link
-    except Exception as e:
-        print(f"[arXiv] {e}")
+def _arxiv_request(query: str) -> Tuple[str, Dict[str, str]]:
+    return SOURCE_URLS["arxiv"], {"search_query": f"all:{query}", "start": "0", "max_results": "1"}
+
+def _arxiv_parse(t: str) -> Result:
+    # フィード自体の <title>/<id> ではなく最初の <entry> のものを使う
+    entry = t.split("<entry>", 1)[1] if "<entry>" in t else ""
+    if "<title>" in entry:
+        title = entry.split("<title>")[1].split("</title>")[0].strip()
+        link = entry.split("<id>")[1].split("</id>")[0].strip() if "<id>" in entry else ""
+        return title, link
     return None, None
 
-def fetch_from_wikidata(query: str) -> Tuple[Optional[str], Optional[str]]:
-    try:
-        url = "https://www.wikidata.org/w/api.php"
-        resp = requests.get(url, params={
-            "action": "wbsearchentities",
-            "search": query,
-            "language": "en",
-            "format": "json"
-        })
-        if resp.status_code == 200:
-            d = resp.json().get("search", [])
-            if d:
-                return d[0].get("description", ""), d[0].get("concepturi", "")
-    except Exception as e:
-        print(f"[Wikidata] {e}")
+def _wikidata_request(query: str) -> Tuple[str, Dict[str, str]]:
+    return SOURCE_URLS["wikidata"], {"action": "wbsearchentities", "search": query, "language": "en", "format": "json"}
+
+def _wikidata_parse(d: Any) -> Result:
+    hits = d.get("search", [])
+    if hits:
+        return hits[0].get("description", "") or None, hits[0].get("concepturi", "")
     return None, None
 
-# === ルーティング判定 ===
-def route_query(query: str) -> Tuple[Optional[str], Optional[str]]:
+# 情報源名 → (リクエスト組み立て, 応答解析, JSON応答か)
+SOURCES: Dict[str, Tuple[Callable[[str], Tuple[str, Dict[str, str]]], Callable[[Any], Result], bool]] = {
+    "wikipedia": (_wikipedia_request, _wikipedia_parse, True),
+    "orkg": (_orkg_request, _orkg_parse, True),
+    "dbpedia": (_dbpedia_request, _dbpedia_parse, True),
+    "arxiv": (_arxiv_request, _arxiv_parse, False),
+    "wikidata": (_wikidata_request, _wikidata_parse, True)
+}
+
+# === ルーティング（語から主となる情報源を決め、残りは汎用順に並べる）===
+ROUTES = [
+    (["quantum", "neural", "embedding", "reasoning"], "arxiv"),
+    (["philosophy", "ontology", "ai", "structure"], "orkg"),
+    (["symbol", "representation", "definition", "concept"], "dbpedia"),
+    (["data", "entity", "name", "date"], "wikidata")
+]
+FALLBACK_ORDER = ["wikipedia", "wikidata", "dbpedia", "arxiv", "orkg"]
+
+def sources_for(query: str, fanout: int = FANOUT) -> List[str]:
     kws = query.lower().split()
-    if any(k in kws for k in ["quantum", "neural", "embedding", "reasoning"]):
-        return fetch_from_arxiv(query)
-    if any(k in kws for k in ["philosophy", "ontology", "ai", "structure"]):
-        return fetch_from_orkg(query)
-    if any(k in kws for k in ["symbol", "representation", "definition", "concept"]):
-        return fetch_from_dbpedia(query)
-    if any(k in kws for k in ["data", "entity", "name", "date"]):
-        return fetch_from_wikidata(query)
-    return fetch_from_wikipedia(query)
+    primary = next((source for words, source in ROUTES if any(k in kws for k in words)), "wikipedia")
+    return ([primary] + [s for s in FALLBACK_ORDER if s != primary])[:max(1, fanout)]
+
+# === 応答キャッシュ（SQLite・TTL付き。「該当なし」も短めに覚える）===
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (source TEXT, query TEXT, summary TEXT, url TEXT, expires REAL,"
+            " PRIMARY KEY (source, query))"
+        )
+        self._conn.commit()
+
+    def get(self, source: str, query: str) -> Optional[Result]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, url FROM responses WHERE source = ? AND query = ? AND expires > ?",
+                (source, query.lower(), time.time())
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], row[1]
+
+    def put(self, source: str, query: str, result: Result) -> None:
+        ttl = CACHE_TTL if result[0] else NEGATIVE_TTL
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (source, query, summary, url, expires) VALUES (?, ?, ?, ?, ?)",
+                (source, query.lower(), result[0], result[1], time.time() + ttl)
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+# === サーキットブレーカー ===
+class CircuitBreaker:
+    """連続失敗が続いた情報源を cooldown 秒止め、その後1回だけ試す（成功すれば復帰）"""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN) -> None:
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            self.opened_at = time.monotonic()  # 試行中は他の呼び出しを通さない
+            return True
+        return False
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        return "closed" if self.opened_at is None else "open"
+
+# === 非同期照射エンジン ===
+class RAGEngine:
+    """
+    専用スレッドのイベントループ上で aiohttp の接続プールを共有する
+    同期コード（memory_manager など）からも Discord のループからも同じエンジンを使える
+    """
+
+    def __init__(self) -> None:
+        self.cache = ResponseCache()
+        self.breakers = {name: CircuitBreaker() for name in SOURCES}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="rag-engine", daemon=True).start()
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """同期呼び出し用：エンジンのループで実行して結果を待つ"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    async def arun(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """別ループ（Discordなど）から await で呼ぶ"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()))
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+        return self._session
+
+    async def fetch(self, source: str, query: str) -> Result:
+        """1つの情報源に問い合わせる（キャッシュ → ブレーカー → HTTP。キャッシュのSQLiteはループ外のスレッドで読み書き）"""
+        cached = await asyncio.to_thread(self.cache.get, source, query)
+        if cached is not None:
+            return cached
+        breaker = self.breakers[source]
+        if not breaker.allow():
+            self.skipped += 1
+            return None, None
+        build, parse, is_json = SOURCES[source]
+        url, params = build(query)
+        session = await self._get_session()
+        self.requests += 1
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=SOURCE_TIMEOUTS[source])) as resp:
+                if resp.status == 404:
+                    result: Result = (None, None)
+                else:
+                    resp.raise_for_status()
+                    data = await resp.json(content_type=None) if is_json else await resp.text()
+                    result = parse(data)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            breaker.record(False)
+            print(f"[RAG] {source} タイムアウト（{SOURCE_TIMEOUTS[source]}秒）: {query}")
+            return None, None
+        except Exception as e:
+            self.failures += 1
+            breaker.record(False)
+            print(f"[RAG] {source} エラー: {e}")
+            return None, None
+        breaker.record(True)
+        if source == "dbpedia" and result[0]:
+            result = (result[0], f"https://dbpedia.org/resource/{query.replace(' ', '_')}")
+        await asyncio.to_thread(self.cache.put, source, query, result)
+        return result
+
+    async def search(self, keywords: List[str]) -> Optional[Tuple[str, str, str, Optional[str]]]:
+        """
+        キーワード×情報源を一斉に問い合わせ、優先順位（キーワード順 → 情報源順）で
+        最上位の成功結果が確定した時点で残りを打ち切る。(キーワード, 情報源, 要約, URL) を返す
+        """
+        candidates = [(word, source) for word in keywords for source in sources_for(word)]
+        if not candidates:
+            return None
+        tasks = [asyncio.ensure_future(self.fetch(source, word)) for word, source in candidates]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TOTAL_TIMEOUT
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # 全体の上限に達した
+                for (word, source), task in zip(candidates, tasks):
+                    if not task.done():
+                        break  # これより上位がまだ答えていない
+                    summary, url = task.result()
+                    if summary:
+                        return word, source, summary, url
+            # 打ち切り時は、終わったものの中で最上位の成功結果
+            for (word, source), task in zip(candidates, tasks):
+                if task.done() and not task.cancelled() and task.result()[0]:
+                    summary, url = task.result()
+                    return word, source, summary, url
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped_by_breaker": self.skipped,
+            "breakers": {name: b.state for name, b in self.breakers.items()},
+            "cache": self.cache.stats()
+        }
+
+_engine: Optional[RAGEngine] = None
+_engine_lock = threading.Lock()
+
+def get_rag_engine() -> RAGEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RAGEngine()
+        return _engine
+
+# === 各種照射API（同期版）===
+def fetch_from_wikipedia(query: str) -> Result:
+    return get_rag_engine().run(get_rag_engine().fetch("wikipedia", query))
+
+def fetch_from_orkg(query: str) -> Result:
+    return get_rag_engine().run(get_rag_engine().fetch("orkg", query))
+
+def fetch_from_dbpedia(query: str) -> Result:
+    return get_rag_engine().run(get_rag_engine().fetch("dbpedia", query))
+
+def fetch_from_arxiv(query: str) -> Result:
+    return get_rag_engine().run(get_rag_engine().fetch("arxiv", query))
+
+def fetch_from_wikidata(query: str) -> Result:
+    return get_rag_engine().run(get_rag_engine().fetch("wikidata", query))
+
+# === ルーティング判定 ===
+def route_query(query: str) -> Result:
+    """主となる情報源と代替の情報源を並行に照会し、優先順位の高い結果を返す"""
+    hit = get_rag_engine().run(get_rag_engine().search([query]))
+    return (hit[2], hit[3]) if hit else (None, None)
+
+# === 照射結果の記録 ===
+def _store_rag(word: str, summary: str, url: Optional[str]) -> None:
+    try:
+        if use_sqlite():
+            store = get_memory_store()
+            store.set_kv("rag_summary", {"query": word, "summary": summary})
+            store.set_kv("rag_origin_trace", {"query": word, "source": url})
+            return
+        os.makedirs(MEMORY_DIR, exist_ok=True)
+        with open(SUMMARY_PATH, "w", encoding="utf-8") as f:
+            json.dump({"query": word, "summary": summary}, f, ensure_ascii=False, indent=2)
+        with open(ORIGIN_TRACE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"query": word, "source": url}, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"[RAG] 保存エラー: {e}")
 
 # === メイン関数（全体処理）===
+async def afetch_and_store_rag(text: str) -> Optional[str]:
+    """非同期版：未知語すべてを並行に照射し、最上位の結果を記録して要約を返す"""
+    keywords = await asyncio.to_thread(extract_keywords, text)
+    flags = await asyncio.to_thread(are_new_terms, keywords)
+    new_words = [word for word, is_new in zip(keywords, flags) if is_new]
+    if not new_words:
+        return None
+    engine = get_rag_engine()
+    hit = await engine.arun(engine.search(new_words))
+    if hit is None:
+        return None
+    word, _, summary, url = hit
+    await asyncio.to_thread(_store_rag, word, summary, url)
+    return summary
+
 def fetch_and_store_rag(text: str) -> Optional[str]:
-    keywords = extract_keywords(text)
-    for word in keywords:
-        if is_new_term(word):
-            summary, url = route_query(word)
-            if summary:
-                try:
-                    os.makedirs(MEMORY_DIR, exist_ok=True)
-                    with open(SUMMARY_PATH, "w", encoding="utf-8") as f:
-                        json.dump({"query": word, "summary": summary}, f, ensure_ascii=False, indent=2)
-                    with open(ORIGIN_TRACE_PATH, "w", encoding="utf-8") as f:
-                        json.dump({"query": word, "source": url}, f, ensure_ascii=False, indent=2)
-                except Exception as e:
-                    print(f"[RAG] 保存エラー: {e}")
-                return summary
-    return None
+    return get_rag_engine().run(afetch_and_store_rag(text))
 
 # === テスト用 ===
 if __name__ == "__main__":
-    result = fetch_and_store_rag("symbolic reasoning")
+    result = fetch_and_store_rag(" ".join(sys.argv[1:]) or "symbolic reasoning")
     print(result or "❌ No summary")
+    print(json.dumps(get_rag_engine().stats(), ensure_ascii=False))
@@ -0,0 +1,58 @@
+# reply_streamer.py
+# LLMのストリーミング応答をDiscordへ逐次反映する（編集をまとめてレート制限内に収め、2000字超は次のメッセージへ）
+
+import os
+import time
+from typing import Any, Dict
+
+EDIT_INTERVAL = float(os.getenv("DISCORD_EDIT_INTERVAL", "1.2"))  # 同一メッセージの編集間隔（秒）
+MAX_MESSAGE_LENGTH = 2000
+
+class ReplyStreamer:
+    """
+    最初の可視トークンが届いた時点で送信し、以降は EDIT_INTERVAL ごとに
+    溜まった差分をまとめて編集する
+    """
+
+    def __init__(self, channel: Any, edit_interval: float = EDIT_INTERVAL, max_length: int = MAX_MESSAGE_LENGTH) -> None:
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.text = ""
+        self._messages: Dict[int, Any] = {}  # 分割位置 → 送信済みメッセージ
+        self._shown: Dict[int, str] = {}
+        self._last_flush = 0.0
+        self.edits = 0
+        self.coalesced = 0
+
+    async def feed(self, delta: str) -> None:
+        """トークン片を追加（間隔に満たなければ次回の編集にまとめる）"""
+        self.text += delta
+        if not self.text.strip():
+            return
+        if not self._messages or time.monotonic() - self._last_flush >= self.edit_interval:
+            await self.flush()
+        else:
+            self.coalesced += 1
+
+    async def flush(self) -> None:
+        """現在のテキストをDiscord上の表示に反映"""
+        pieces = [self.text[i:i + self.max_length] for i in range(0, len(self.text), self.max_length)]
+        for i, piece in enumerate(pieces):
+            if not piece.strip():
+                continue
+            if i in self._messages:
+                if self._shown[i] != piece:
+                    await self._messages[i].edit(content=piece)
+                    self._shown[i] = piece
+                    self.edits += 1
+            else:
+                self._messages[i] = await self.channel.send(piece)
+                self._shown[i] = piece
+        self._last_flush = time.monotonic()
+
+    async def finish(self) -> str:
+        """最後の差分を反映して全文を返す"""
+        if self.text.strip():
+            await self.flush()
+        return self.text
@@ -0,0 +1,49 @@
+# scoring.py
+# 正規化済み行列に対する共通スコアリング（1回の行列積 + 加点 + argpartition による上位k件選択）
+
+from typing import Optional
+
+import numpy as np
+
+def normalize(vec: np.ndarray) -> np.ndarray:
+    """ベクトル（1次元）または行列の各行を L2 正規化（ゼロ行はそのまま）"""
+    vec = np.asarray(vec, dtype=np.float32)
+    norms = np.linalg.norm(vec, axis=-1, keepdims=True)
+    return vec / np.where(norms > 0, norms, 1.0)
+
+def fused_scores(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    boosts: Optional[np.ndarray] = None,
+    mask: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    類似度 + 加点を1パスで計算（queries が2次元なら (Q, N) を1回の行列積で）
+    mask が False の行は -inf にして選ばれないようにする
+    """
+    scores = matrix @ queries if queries.ndim == 1 else queries @ matrix.T
+    if boosts is not None:
+        scores += boosts.astype(np.float32, copy=False)
+    if mask is not None:
+        scores[..., ~mask] = -np.inf
+    return scores
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """1次元スコアの上位k件のインデックス（降順、-inf は除外）"""
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+    ordered = part[np.argsort(-scores[part], kind="stable")]
+    return ordered[np.isfinite(scores[ordered])]
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """2次元スコア (Q, N) の行ごとの上位k件（(Q, k) の降順インデックス）"""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
@@ -0,0 +1,81 @@
+# startup_timer.py
+# 起動の内訳（import・Discordログイン・ウォームアップ）を計測して表示・保存する
+# 区間は phase() で囲み、ログイン・接続完了などの時点は mark() で記録する（どちらもこのモジュールの import からの経過秒）
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+
+REPORT_PATH = os.getenv("ARIA_STARTUP_REPORT", os.path.abspath("memory/startup_report.json"))
+
+def _process_age() -> Optional[float]:
+    """インタプリタ起動からの経過秒（psutil がなければ None）"""
+    try:
+        import psutil
+        return time.time() - psutil.Process().create_time()
+    except Exception:
+        return None
+
+class StartupTimer:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.before_import = _process_age()  # このモジュールを読み込むまでにかかった時間
+        self.origin = time.perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []  # (区間名, 開始時点, 所要秒)
+        self.marks: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.origin
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.phases.append((name, started - self.origin, seconds))
+            metrics.set_gauge("aria_startup_seconds", seconds, "起動の区間ごとの所要時間（秒）", phase=name)
+
+    def mark(self, name: str) -> float:
+        """時点を記録（同じ名前は最初の1回だけ）"""
+        with self._lock:
+            at = self.marks.setdefault(name, self.elapsed())
+        metrics.set_gauge("aria_startup_mark_seconds", at, "起動開始から各時点までの秒数", mark=name)
+        return at
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "before_import_s": round(self.before_import, 3) if self.before_import is not None else None,
+                "phases": [{"phase": name, "at_s": round(at, 3), "seconds": round(seconds, 3)} for name, at, seconds in self.phases],
+                "marks": {name: round(at, 3) for name, at in self.marks.items()}
+            }
+
+    def print_report(self) -> None:
+        report = self.report()
+        print(f"⏱ 起動の内訳（{self.name}）")
+        if report["before_import_s"] is not None:
+            print(f"  {'interpreter':<28} {report['before_import_s']:>7.3f}s")
+        rows = [(p["at_s"], f"  {p['phase']:<28} {p['seconds']:>7.3f}s  (@{p['at_s']:.3f}s)") for p in report["phases"]]
+        rows += [(at, f"  ▶ {name:<26} @{at:.3f}s") for name, at in report["marks"].items()]
+        for _, line in sorted(rows):
+            print(line)
+
+    def save(self, path: str = REPORT_PATH) -> None:
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"[startup_timer] 保存エラー: {e}")
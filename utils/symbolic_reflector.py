@@ -3,85 +3,139 @@
 
 import json
 import os
+import time
+import threading
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from vectorizer import encode_text
+from journal_index import get_journal_index, STYLE_CODES
+from ann_index import VectorIndex, create_index
+from scoring import normalize
+from memory_store import from_blob, get_memory_store, use_sqlite
 
 VECTOR_PATH = os.path.abspath("memory/vector_memory.json")
 JOURNAL_PATH = os.path.abspath("memory/aria_journal.jsonl")
 
+# === vector_memory.json の索引（ファイル更新時のみ再読込・追記分だけ索引へ追加）===
+_vector_lock = threading.Lock()
+_vector_state: Dict[str, Any] = {
+    "stamp": None, "entries": [], "boosts": [], "index": None,
+    "last_id": 0,        # 読み込み済みの最大 id（埋め込み未計算の行も含む）
+    "pending": set(),    # 読み込んだが埋め込み未計算だった id（後で埋まったら索引へ）
+    "fills": -1, "pending_checked": 0.0
+}
+PENDING_RECHECK = float(os.getenv("ARIA_VECTOR_PENDING_RECHECK", "10"))  # 他プロセスが埋めた分を確認する間隔（秒）
+
+def _has_vector_memory() -> bool:
+    return use_sqlite() or os.path.exists(VECTOR_PATH)
+
+def _index_rows(rows: List[Tuple[Any, ...]]) -> None:
+    """埋め込みのある行を索引へ追加し、未計算の行は pending に残す"""
+    index: Optional[VectorIndex] = _vector_state["index"]
+    entries, matrix, boosts = [], [], []
+    for row_id, timestamp, content, emotion_score, embedding in rows:
+        vec = from_blob(embedding)
+        if vec.size == 0:
+            _vector_state["pending"].add(row_id)
+            continue
+        _vector_state["pending"].discard(row_id)
+        if index is None:
+            index = create_index(int(vec.size))
+        if vec.size != index.dim:
+            continue
+        entries.append({"timestamp": timestamp, "content": content, "emotion_score": emotion_score})
+        matrix.append(normalize(vec))
+        boosts.append(float(emotion_score or 0.0))
+    if index is not None and matrix:
+        index.add(np.stack(matrix))
+    _vector_state["entries"].extend(entries)
+    _vector_state.update(
+        index=index,
+        boosts=np.concatenate([np.asarray(_vector_state["boosts"], dtype=np.float32), np.array(boosts, dtype=np.float32)])
+    )
+
+def _load_vector_index_sqlite() -> Tuple[List[Dict[str, Any]], np.ndarray, Optional[VectorIndex]]:
+    """vectors テーブルの id > last_id の行と、前回未計算だった行のうち埋まったものを索引へ追加"""
+    store = get_memory_store()
+    fills = store.vector_fills
+    rows = store.vectors_since(_vector_state["last_id"])
+    if rows:
+        _vector_state["last_id"] = rows[-1][0]
+        _index_rows(rows)
+    pending = _vector_state["pending"]
+    now = time.monotonic()
+    if pending and (fills != _vector_state["fills"] or now - _vector_state["pending_checked"] >= PENDING_RECHECK):
+        _vector_state.update(fills=fills, pending_checked=now)
+        filled = store.vectors_filled(sorted(pending))
+        if filled:
+            _index_rows(filled)
+    return _vector_state["entries"], _vector_state["boosts"], _vector_state["index"]
+
+def _load_vector_index() -> Tuple[List[Dict[str, Any]], np.ndarray, Optional[VectorIndex]]:
+    with _vector_lock:
+        if use_sqlite():
+            return _load_vector_index_sqlite()
+        st = os.stat(VECTOR_PATH)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp != _vector_state["stamp"]:
+            with open(VECTOR_PATH, "r", encoding="utf-8") as f:
+                vector_data = json.load(f)
+            entries, matrix, boosts = [], [], []
+            index: Optional[VectorIndex] = _vector_state["index"]
+            dim = index.dim if index is not None else 0
+            for entry in vector_data:
+                vec = np.array(entry.get("embedding", []), dtype=np.float32)
+                if vec.size == 0 or (dim and vec.size != dim):
+                    continue
+                dim = dim or int(vec.size)
+                entries.append(entry)
+                matrix.append(normalize(vec))
+                boosts.append(float(entry.get("emotion_score", 0.0)))
+            # 追記のみなら既存索引に新規分だけ追加、それ以外は作り直し
+            previous = _vector_state["entries"]
+            if index is None or len(entries) < len(previous) or (previous and entries[len(previous) - 1] != previous[-1]):
+                index = create_index(dim) if dim else None
+            if index is not None and matrix:
+                index.sync(np.stack(matrix))
+            _vector_state.update(stamp=stamp, entries=entries, boosts=np.array(boosts, dtype=np.float32), index=index)
+        return _vector_state["entries"], _vector_state["boosts"], _vector_state["index"]
+
 def reflect_vector_relevance(user_input: str, top_k: int = 3) -> List[Dict[str, Any]]:
-    if not os.path.exists(VECTOR_PATH):
+    if not _has_vector_memory():
         return []
     try:
-        with open(VECTOR_PATH, "r", encoding="utf-8") as f:
-            vector_data = json.load(f)
+        entries, boosts, index = _load_vector_index()
     except Exception as err:
         print(f"[symbolic_reflector] VECTOR_PATH読込エラー: {err}")
         return []
+    if index is None or not entries:
+        return []
 
     user_vec = np.array(encode_text(user_input), dtype=np.float32)
-    entries, matrix, boosts = [], [], []
-
-    for entry in vector_data:
-        vec = np.array(entry.get("embedding", []), dtype=np.float32)
-        if vec.size == 0:
-            continue
-        entries.append(entry)
-        matrix.append(vec)
-        boosts.append(float(entry.get("emotion_score", 0.0)))
-
-    if not matrix:
+    if user_vec.size != index.dim:
         return []
-
-    matrix_np = np.stack(matrix)
-    user_norm = np.linalg.norm(user_vec)
-    matrix_norms = np.linalg.norm(matrix_np, axis=1)
-    dot_products = np.dot(matrix_np, user_vec)
-    base_scores = dot_products / (matrix_norms * user_norm + 1e-8)
-    total_scores = base_scores + np.array(boosts, dtype=np.float32)
-
-    sorted_indices = np.argsort(total_scores)[::-1]
-    return [entries[i] for i in sorted_indices[:top_k]]
+    ids, _ = index.search_boosted(normalize(user_vec), top_k, boosts=boosts)
+    return [entries[i] for i in ids]
 
 def reflect_journal_relevance(user_input: str, top_k: int = 2) -> List[Dict[str, Any]]:
     """aria_journal.jsonlから象徴性・詩的性・意味的に近い記憶を返す（閾値・加点ロジック明示）"""
-    if not os.path.exists(JOURNAL_PATH):
+    index = get_journal_index(JOURNAL_PATH)
+    view = index.snapshot()
+    if view is None:
         return []
-    entries: List[Dict[str, Any]] = []
-    matrix: List[np.ndarray] = []
-    boosts: List[float] = []
-    try:
-        with open(JOURNAL_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    entry = json.loads(line.strip())
-                    score = float(entry.get("symbolic_score", 0.0))
-                    if score < 0.5:
-                        continue  # 象徴性が低いものは除外
-                    vec = np.array(entry.get("vector", []), dtype=np.float32)
-                    if vec.size == 0:
-                        continue
-                    entries.append(entry)
-                    matrix.append(vec)
-                    poetic_boost = 0.2 if entry.get("meta", {}).get("poetic_mode") or entry.get("style") == "poetic" else 0.0
-                    boosts.append(poetic_boost + score * 0.3)  # 象徴性スコア自体も加点
-                except json.JSONDecodeError:
-                    continue
-    except Exception as err:
-        print(f"[symbolic_reflector] JOURNAL_PATH読込エラー: {err}")
-        return []
-    if not matrix:
+    vectors, _, meta = view
+    scores = meta["symbolic_score"]
+    mask = scores >= 0.5  # 象徴性が低いものは除外
+    if not mask.any():
         return []
     user_vec = np.array(encode_text(user_input), dtype=np.float32)
-    matrix_np = np.stack(matrix)
-    user_norm = np.linalg.norm(user_vec)
-    matrix_norms = np.linalg.norm(matrix_np, axis=1)
-    dot_products = np.dot(matrix_np, user_vec)
-    base_scores = dot_products / (matrix_norms * user_norm + 1e-8)
-    total_scores = base_scores + np.array(boosts, dtype=np.float32)
-    sorted_indices = np.argsort(total_scores)[::-1]
-    return [entries[i] for i in sorted_indices[:top_k]]
+    if user_vec.size != vectors.shape[1]:
+        return []
+    user_vec = normalize(user_vec)  # 索引のベクトルは正規化済み
+    poetic = meta["poetic_mode"] | (meta["style"] == STYLE_CODES["poetic"])
+    boosts = np.where(poetic, 0.2, 0.0) + scores * 0.3  # 象徴性スコア自体も加点
+    ids, _ = index.ann().search_boosted(user_vec, top_k, boosts=boosts, mask=mask)
+    return index.load_entries([int(i) for i in ids])
 
 def recall_symbolic_memories(user_input: str) -> List[Dict[str, Any]]:
     vector_memories = reflect_vector_relevance(user_input)
@@ -0,0 +1,295 @@
+# term_index.py
+# ジャーナル・長期記憶に現れた語の転置集合（単語 + 隣接2語、和文は文字1-2gram）
+# 前段のブルームフィルタで「未知語」をファイル全体を読まずに即答し、陽性のときだけ語集合で確定する
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from memory_store import get_memory_store, use_sqlite
+
+MEMORY_DIR = os.path.abspath("memory")
+TERM_INDEX_BASE = os.path.join(MEMORY_DIR, "term_index")
+JOURNAL_PATH = os.path.join(MEMORY_DIR, "aria_journal.jsonl")
+LONG_TERM_PATH = os.path.join(MEMORY_DIR, "compressed_memory.json")
+BLOOM_CAPACITY = int(os.getenv("ARIA_TERM_BLOOM_CAPACITY", "200000"))  # 超えたら倍の容量で作り直す
+BLOOM_FP_RATE = float(os.getenv("ARIA_TERM_BLOOM_FP_RATE", "0.01"))
+REFRESH_INTERVAL = float(os.getenv("ARIA_TERM_REFRESH_INTERVAL", "5"))  # ソース側の差分確認の間隔（秒）
+
+_WORD = re.compile(r"[^\W぀-ヿ㐀-鿿]+")  # かな・漢字以外の語
+_CJK = re.compile(r"[぀-ヿ㐀-鿿]+")
+
+# === 語の切り出し ===
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+def _cjk_grams(run: str) -> List[str]:
+    return list(run) + [run[i:i + 2] for i in range(len(run) - 1)]
+
+def text_terms(text: str) -> Set[str]:
+    """本文から索引に入れる語（単語・隣接2語・和文の文字1-2gram）"""
+    text = _normalize(text)
+    words = _WORD.findall(text)
+    terms = set(words)
+    terms.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for run in _CJK.findall(text):
+        terms.update(_cjk_grams(run))
+    return terms
+
+def keyword_terms(keyword: str) -> List[str]:
+    """キーワードが既知とみなされるために索引に必要な語（2語以上は隣接2語すべて）"""
+    keyword = _normalize(keyword)
+    words = _WORD.findall(keyword)
+    required = [words[0]] if len(words) == 1 else [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for run in _CJK.findall(keyword):
+        required.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+    return required
+
+# === ブルームフィルタ ===
+class BloomFilter:
+    """memmap上のビット配列（k個の位置は blake2b の2値から二重ハッシュで生成）"""
+
+    def __init__(self, path: str, capacity: int, fp_rate: float = BLOOM_FP_RATE) -> None:
+        self.capacity = capacity
+        self.bits = max(1024, int(-capacity * np.log(fp_rate) / (np.log(2) ** 2)))
+        self.k = max(1, int(round(self.bits / capacity * np.log(2))))
+        nbytes = (self.bits + 7) // 8
+        if not os.path.exists(path) or os.path.getsize(path) != nbytes:
+            with open(path, "wb") as f:
+                f.truncate(nbytes)
+        self._data = np.memmap(path, dtype=np.uint8, mode="r+", shape=(nbytes,))
+
+    def _positions(self, term: str) -> List[int]:
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.k)]
+
+    def add(self, term: str) -> None:
+        for pos in self._positions(term):
+            self._data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, term: str) -> bool:
+        return all(self._data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(term))
+
+    def flush(self) -> None:
+        self._data.flush()
+
+    def close(self) -> None:
+        """マップを解放（Windowsでは開いたままのファイルを削除・置換できない）"""
+        if self._data is not None:
+            self._data.flush()
+            self._data = None  # 参照が消えた時点で numpy がマップを閉じる
+
+class TermIndex:
+    """
+    {base}.terms : 登録済みの語（1行1語・追記のみ）
+    {base}.bloom : ブルームフィルタのビット列
+    {base}.json  : 件数・容量と、各ソースをどこまで索引したか（ファイルのバイト数 / テーブルのid）
+    """
+
+    def __init__(self, base: str = TERM_INDEX_BASE) -> None:
+        self.terms_path = base + ".terms"
+        self.bloom_path = base + ".bloom"
+        self.header_path = base + ".json"
+        self._lock = threading.RLock()
+        self._terms: Optional[Set[str]] = None  # ブルームが陽性を返したときに初めて読む
+        self._last_refresh = 0.0
+        self.lookups = self.bloom_negatives = 0
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        self.header: Dict[str, Any] = {"count": 0, "capacity": BLOOM_CAPACITY, "sources": {}}
+        if os.path.exists(self.header_path):
+            try:
+                with open(self.header_path, "r", encoding="utf-8") as f:
+                    self.header.update(json.load(f))
+            except Exception as e:
+                print(f"[term_index] ヘッダ読込エラー: {e}")
+        if not os.path.exists(self.terms_path):
+            self.header.update(count=0, sources={})
+        self.bloom = BloomFilter(self.bloom_path, int(self.header["capacity"]))
+
+    def _save_header(self) -> None:
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.header, f)
+        os.replace(tmp_path, self.header_path)
+
+    def _load_terms(self) -> Set[str]:
+        if self._terms is None:
+            self._terms = set()
+            if os.path.exists(self.terms_path):
+                with open(self.terms_path, "r", encoding="utf-8") as f:
+                    self._terms.update(line.rstrip("\n") for line in f)
+        return self._terms
+
+    # === 追加 ===
+    def add_texts(self, texts: Iterable[str], source: Optional[str] = None, start: Optional[int] = None, end: Optional[int] = None) -> int:
+        """
+        本文の語を登録（新規語数を返す）
+        source/start/end を渡すと、そのソースの索引済み位置が start と一致する場合に end まで進める
+        """
+        with self._lock:
+            terms = self._load_terms()
+            new = set()
+            for text in texts:
+                new.update(text_terms(text or ""))
+            new -= terms
+            if new:
+                with open(self.terms_path, "a", encoding="utf-8") as f:
+                    f.write("".join(term + "\n" for term in new))
+                terms.update(new)
+                self.header["count"] = len(terms)
+                if len(terms) > self.header["capacity"]:
+                    self._resize(len(terms) * 2)
+                else:
+                    for term in new:
+                        self.bloom.add(term)
+                    self.bloom.flush()
+            if source is not None and self.header["sources"].get(source, 0) == start:
+                self.header["sources"][source] = end
+            if new or source is not None:
+                self._save_header()
+            return len(new)
+
+    def _resize(self, capacity: int) -> None:
+        """新しい容量のフィルタを一時ファイルに作り、旧マップを解放してから置き換える"""
+        tmp_path = self.bloom_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        fresh = BloomFilter(tmp_path, capacity)
+        for term in self._load_terms():
+            fresh.add(term)
+        fresh.close()
+        self.bloom.close()
+        os.replace(tmp_path, self.bloom_path)
+        self.bloom = BloomFilter(self.bloom_path, capacity)
+        self.header["capacity"] = capacity
+
+    # === ソースとの差分同期 ===
+    def refresh(self, force: bool = False) -> None:
+        """書き込みフックを経由しなかった追記分だけを取り込む"""
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+                return
+            self._last_refresh = time.monotonic()
+            try:
+                if use_sqlite():
+                    self._refresh_sqlite()
+                else:
+                    self._refresh_files()
+            except Exception as e:
+                print(f"[term_index] 差分更新エラー: {e}")
+
+    def _refresh_files(self) -> None:
+        sources = self.header["sources"]
+        if os.path.exists(JOURNAL_PATH):
+            size = os.path.getsize(JOURNAL_PATH)
+            done = sources.get("journal", 0)
+            if size != done:
+                texts, start = [], done if size > done else 0
+                with open(JOURNAL_PATH, "rb") as f:
+                    f.seek(start)
+                    end = start
+                    for raw in f:
+                        if not raw.endswith(b"\n"):
+                            break
+                        end += len(raw)
+                        try:
+                            texts.append(json.loads(raw).get("content", ""))
+                        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                            pass
+                sources["journal"] = start
+                self.add_texts(texts, "journal", start, end)
+        if os.path.exists(LONG_TERM_PATH):
+            size = os.path.getsize(LONG_TERM_PATH)
+            if size != sources.get("long_term", 0):
+                # 配列JSONは途中から読めないので全体を読む（フック経由の追記ではここに来ない）
+                with open(LONG_TERM_PATH, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                texts = [e.get("content", "") for e in data if isinstance(e, dict)] if isinstance(data, list) else []
+                sources["long_term"] = 0
+                self.add_texts(texts, "long_term", 0, size)
+
+    def _refresh_sqlite(self) -> None:
+        store = get_memory_store()
+        for source, table in (("journal_id", "journal"), ("long_term_row", "long_term")):
+            done = self.header["sources"].get(source, 0)
+            rows = store.contents_since(table, done)
+            if rows:
+                self.add_texts([r[1] for r in rows], source, done, rows[-1][0])
+
+    def rebuild(self) -> int:
+        with self._lock:
+            self.bloom.close()
+            for path in (self.terms_path, self.bloom_path, self.header_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._terms = None
+            self.header = {"count": 0, "capacity": BLOOM_CAPACITY, "sources": {}}
+            self.bloom = BloomFilter(self.bloom_path, BLOOM_CAPACITY)
+            self.refresh(force=True)
+            return int(self.header["count"])
+
+    # === 照会 ===
+    def contains_many(self, keywords: List[str]) -> List[bool]:
+        """各キーワードが記憶内に現れるか（まとめて照会）"""
+        self.refresh()
+        results = []
+        with self._lock:
+            for keyword in keywords:
+                required = keyword_terms(keyword)
+                self.lookups += 1
+                if not required or not all(term in self.bloom for term in required):
+                    self.bloom_negatives += 1
+                    results.append(False)
+                    continue
+                terms = self._load_terms()
+                results.append(all(term in terms for term in required))
+        return results
+
+    def contains(self, keyword: str) -> bool:
+        return self.contains_many([keyword])[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "terms": self.header["count"],
+            "capacity": self.header["capacity"],
+            "bloom_bits": self.bloom.bits,
+            "bloom_k": self.bloom.k,
+            "terms_loaded": self._terms is not None,
+            "lookups": self.lookups,
+            "bloom_negatives": self.bloom_negatives,
+            "sources": dict(self.header["sources"])
+        }
+
+# === プロセス内で共有する索引 ===
+_index: Optional[TermIndex] = None
+_index_lock = threading.Lock()
+
+def get_term_index() -> TermIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = TermIndex()
+        return _index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="記憶の語索引（term_index.*）")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("keywords", nargs="*", help="既知かどうかを確認する語")
+    args = parser.parse_args()
+    index = get_term_index()
+    if args.rebuild:
+        print(f"✅ 語索引再構築：{index.rebuild()}語")
+    for keyword, known in zip(args.keywords, index.contains_many(args.keywords)):
+        print(f"{'既知' if known else '未知'}: {keyword}")
+    json.dump(index.stats(), sys.stdout, ensure_ascii=False)
+    print()
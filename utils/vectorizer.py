@@ -2,13 +2,287 @@
 # テキストを意味ベクトル（数値リスト）に変換するベクトライザーモジュール
 
 
-from sentence_transformers import SentenceTransformer
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import hashlib
+import unicodedata
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
 import numpy as np
-from typing import List, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+import metrics
+import onnx_encoder
+from memory_store import get_memory_store, use_sqlite
 
-# モデル読み込み（軽量 or 高性能モデルに切替可能）
+# モデル（軽量 or 高性能モデルに切替可能）。最初のエンコード時に読み込む
 MODEL_NAME = "all-MiniLM-L6-v2"  # 384次元で高速
-_model = SentenceTransformer(MODEL_NAME)
+BACKEND = os.getenv("VECTORIZER_BACKEND", "torch").lower()  # torch: SentenceTransformer / onnx: ONNX Runtime（int8）
+
+def _resolve_backend() -> str:
+    if BACKEND != "onnx":
+        return "torch"
+    reason = onnx_encoder.unavailable_reason()
+    if reason:
+        print(f"[vectorizer] ONNXバックエンドが使えないためtorchで続行: {reason}")
+        return "torch"
+    return "onnx"
+
+ACTIVE_BACKEND = _resolve_backend()
+_model: Optional[Any] = None
+_model_lock = threading.Lock()
+
+def get_model() -> Any:
+    """SentenceTransformer または OnnxEncoder（どちらも .encode(texts, convert_to_numpy=True) で呼べる）"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                with metrics.span("load_model", backend=ACTIVE_BACKEND):
+                    if ACTIVE_BACKEND == "onnx":
+                        _model = onnx_encoder.OnnxEncoder()
+                    else:
+                        from sentence_transformers import SentenceTransformer
+                        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+VECTOR_PATH = os.path.abspath("memory/vector_memory.json")
+_vector_lock = threading.Lock()
+
+# マイクロバッチ設定（待機0ms または サイズ1以下でバッチ化を無効化）
+BATCH_SIZE = int(os.getenv("VECTORIZER_BATCH_SIZE", "32"))
+BATCH_WAIT_MS = float(os.getenv("VECTORIZER_BATCH_WAIT_MS", "2"))
+
+# === マイクロバッチ・エンコーダ ===
+class EncodeBatcher:
+    """
+    短い待機時間内に届いたエンコード要求（別メッセージ・別リフレクター由来）を
+    1回の get_model().encode にまとめる前段キュー
+    """
+
+    def __init__(self, max_batch_size: int = BATCH_SIZE, max_wait_ms: float = BATCH_WAIT_MS) -> None:
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._stats: Dict[str, float] = {
+            "requests": 0, "batches": 0, "max_batch": 0,
+            "queue_wait_s": 0.0, "encode_s": 0.0, "max_latency_s": 0.0
+        }
+        self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """テキスト群をキュー経由でエンコード（呼び出し元は結果が揃うまで待つ）"""
+        now = time.perf_counter()
+        futures: List[Future] = []
+        for text in texts:
+            future: Future = Future()
+            self._queue.put((text, future, now))
+            futures.append(future)
+        return [f.result() for f in futures]
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch: List[Tuple[str, Future, float]]) -> None:
+        started = time.perf_counter()
+        try:
+            vectors = get_model().encode([text for text, _, _ in batch], convert_to_numpy=True)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        for (_, future, _), vec in zip(batch, vectors):
+            future.set_result(vec.tolist())
+        with self._stats_lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            self._stats["queue_wait_s"] += sum(started - t for _, _, t in batch)
+            self._stats["encode_s"] += finished - started
+            self._stats["max_latency_s"] = max(self._stats["max_latency_s"], finished - min(t for _, _, t in batch))
+
+    def stats(self) -> Dict[str, Any]:
+        """スループット・レイテンシ計測値"""
+        with self._stats_lock:
+            s = dict(self._stats)
+        requests, batches = s["requests"], s["batches"]
+        return {
+            "requests": int(requests),
+            "batches": int(batches),
+            "queued": self._queue.qsize(),
+            "avg_batch_size": requests / batches if batches else 0.0,
+            "max_batch_size": int(s["max_batch"]),
+            "avg_queue_wait_ms": 1000 * s["queue_wait_s"] / requests if requests else 0.0,
+            "avg_encode_ms": 1000 * s["encode_s"] / batches if batches else 0.0,
+            "max_latency_ms": 1000 * s["max_latency_s"],
+            "texts_per_sec": requests / s["encode_s"] if s["encode_s"] else 0.0,
+            "uptime_s": time.perf_counter() - self._started_at
+        }
+
+_batcher: Optional[EncodeBatcher] = None
+_batcher_lock = threading.Lock()
+
+def _get_batcher() -> Optional[EncodeBatcher]:
+    global _batcher
+    if BATCH_WAIT_MS <= 0 or BATCH_SIZE <= 1:
+        return None
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EncodeBatcher()
+        return _batcher
+
+def get_batch_stats() -> Dict[str, Any]:
+    """バッチャーの計測値（未使用なら空）"""
+    return _batcher.stats() if _batcher is not None else {}
+
+# キャッシュ設定（パスを空にするとディスク永続化なし）
+CACHE_SIZE = int(os.getenv("VECTORIZER_CACHE_SIZE", "4096"))
+CACHE_PATH = os.getenv("VECTORIZER_CACHE_PATH", os.path.abspath("memory/embedding_cache.sqlite"))
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用の正規化（Unicode NFC + 空白の畳み込み）"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+# === 埋め込みキャッシュ（メモリLRU + SQLite永続化）===
+class EmbeddingCache:
+    """
+    モデル名 + 正規化テキストのハッシュをキーとする埋め込みキャッシュ
+    メモリ上のLRUを優先し、外れた場合はSQLiteを参照する
+    """
+
+    def __init__(self, model_name: str, max_size: int = CACHE_SIZE, path: Optional[str] = CACHE_PATH) -> None:
+        self.model_name = model_name
+        self.max_size = max(0, max_size)
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)")
+                self._db.commit()
+            except Exception as e:
+                print(f"[vectorizer] キャッシュDB初期化エラー: {e}")
+                self._db = None
+
+    def key(self, normalized: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = vec
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+            if missing and self._db is not None:
+                try:
+                    for i in range(0, len(missing), 500):
+                        chunk = missing[i:i + 500]
+                        rows = self._db.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                        ).fetchall()
+                        for key, blob in rows:
+                            vec = np.frombuffer(blob, dtype=np.float32)
+                            found[key] = vec
+                            self._remember(key, vec)
+                            self.disk_hits += 1
+                except Exception as e:
+                    print(f"[vectorizer] キャッシュDB読込エラー: {e}")
+            self.misses += sum(1 for key in missing if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        if not items:
+            return
+        with self._lock:
+            for key, vec in items.items():
+                self._remember(key, vec)
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                        [(key, self.model_name, vec.astype(np.float32).tobytes()) for key, vec in items.items()]
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    print(f"[vectorizer] キャッシュDB保存エラー: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "persistent": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+# ONNX（特に int8）の埋め込みは torch 版とわずかに違うので、キャッシュはバックエンドごとに分ける
+_cache = EmbeddingCache(MODEL_NAME if ACTIVE_BACKEND == "torch" else f"{MODEL_NAME}@{onnx_encoder.variant()}")
+
+def get_cache_stats() -> Dict[str, Any]:
+    """キャッシュのヒット率など"""
+    return _cache.stats()
+
+def _encode_uncached(texts: List[str]) -> List[List[float]]:
+    batcher = _get_batcher()
+    if batcher is not None:
+        return batcher.encode(texts)
+    return get_model().encode(texts, convert_to_numpy=True).tolist()
+
+def _encode_cached(texts: List[str]) -> List[List[float]]:
+    normalized = [normalize_text(t) for t in texts]
+    keys = [_cache.key(t) for t in normalized]
+    found = _cache.get_many(keys)
+    pending: Dict[str, str] = {}
+    for key, text in zip(keys, normalized):
+        if key not in found and key not in pending:
+            pending[key] = text
+    if pending:
+        vectors = _encode_uncached(list(pending.values()))
+        fresh = {key: np.asarray(vec, dtype=np.float32) for key, vec in zip(pending, vectors)}
+        _cache.put_many(fresh)
+        found.update(fresh)
+    return [found[key].tolist() for key in keys]
 
 def encode_text(text: str) -> List[float]:
     """
@@ -17,8 +291,8 @@ def encode_text(text: str) -> List[float]:
     if not text.strip():
         return []
     try:
-        embedding = _model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+        with metrics.span("encode_text"):
+            return _encode_cached([text])[0]
     except Exception as e:
         print(f"[vectorizer] encode_textエラー: {e}")
         return []
@@ -44,7 +318,103 @@ def batch_encode(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
     try:
-        return _model.encode(texts, convert_to_numpy=True).tolist()
+        with metrics.span("batch_encode"):
+            return _encode_cached(texts)
     except Exception as e:
         print(f"[vectorizer] batch_encodeエラー: {e}")
         return []
+
+# === vector_memory.json の読み書き ===
+def _load_vector_memory() -> List[dict]:
+    if not os.path.exists(VECTOR_PATH):
+        return []
+    try:
+        with open(VECTOR_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else []
+    except Exception as e:
+        print(f"[vectorizer] VECTOR_PATH読込エラー: {e}")
+        return []
+
+def _save_vector_memory(data: List[dict]) -> None:
+    os.makedirs(os.path.dirname(VECTOR_PATH), exist_ok=True)
+    tmp_path = VECTOR_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, VECTOR_PATH)
+
+def init_vector_memory(limit: Optional[int] = None) -> int:
+    """
+    vector_memory.json のうち埋め込み未計算のエントリを一括でベクトル化（更新件数を返す）
+    limit 指定時は先頭から limit 件だけ処理する（残りは次の呼び出しで）
+    """
+    if use_sqlite():
+        store = get_memory_store()
+        pending_rows = store.pending_vectors(limit)
+        if not pending_rows:
+            return 0
+        vectors = batch_encode([content for _, content in pending_rows])
+        if len(vectors) != len(pending_rows):
+            return 0
+        store.set_vectors([(row_id, vec) for (row_id, _), vec in zip(pending_rows, vectors)])
+        return len(pending_rows)
+    with _vector_lock:
+        data = _load_vector_memory()
+        pending = [e for e in data if isinstance(e, dict) and not e.get("embedding") and (e.get("content") or e.get("text"))]
+        pending = pending[:limit] if limit is not None else pending
+        if not pending:
+            return 0
+        vectors = batch_encode([e.get("content") or e.get("text") for e in pending])
+        if len(vectors) != len(pending):
+            return 0
+        for entry, vec in zip(pending, vectors):
+            entry["embedding"] = vec
+        try:
+            _save_vector_memory(data)
+        except Exception as e:
+            print(f"[vectorizer] 初期化保存エラー: {e}")
+            return 0
+        return len(pending)
+
+def append_vector_memory(text: str, emotion_score: float = 0.0) -> bool:
+    """
+    テキストをベクトル化して vector_memory.json に追記
+    """
+    text = text.strip()
+    if not text:
+        return False
+    vector = encode_text(text)
+    if not vector:
+        return False
+    if use_sqlite():
+        try:
+            get_memory_store().append_vector(text, vector, emotion_score)
+        except Exception as e:
+            print(f"[vectorizer] 追記保存エラー: {e}")
+            return False
+        return True
+    with _vector_lock:
+        data = _load_vector_memory()
+        data.append({
+            "timestamp": datetime.now().isoformat(),
+            "content": text,
+            "embedding": vector,
+            "emotion_score": emotion_score
+        })
+        try:
+            _save_vector_memory(data)
+        except Exception as e:
+            print(f"[vectorizer] 追記保存エラー: {e}")
+            return False
+    return True
+
+# === CLI（init: 未計算分の一括ベクトル化 / append: 1件追記）===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="vector_memory.json のベクトル化")
+    parser.add_argument("--mode", choices=["init", "append"], default="init")
+    parser.add_argument("text", nargs="*")
+    args = parser.parse_args()
+    if args.mode == "append":
+        ok = append_vector_memory(" ".join(args.text))
+        sys.exit(0 if ok else 1)
+    print(f"✅ ベクトル初期化：{init_vector_memory()}件")